@@ -0,0 +1,279 @@
+'''
+把众筹合约（CrowdFunding.txt）的交易打包成区块：
+交易先进入缓冲区，攒够 maxTransactions 笔或第一笔交易已经等待了 maxDelay 秒时封块，
+一次性计算整个区块的 Merkle 树（不逐笔 add、不逐笔打印），区块头通过前一个区块的 hash 串成链
+用法：python BlockBuilder.py [--count 100000] [--block-size 1000] [--workers 4]
+'''
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from MerkleHash import MerkleHasher
+from MerkleProof import MerkleProof, tree_height, verify_proof
+from MerkleTree import merge_levels, parallel_hash_leaves, parallel_levels
+
+
+# 会改变合约状态的调用
+METHODS = ('support', 'createRequest', 'approveRequest', 'finalizeRequest')
+GENESIS_HASH = bytes(MerkleHasher.HASH_SIZE)  # 第一个区块的前一个区块 hash
+
+
+class Transaction:
+    '''
+    对某个众筹合约（funding）的一次调用，args 为调用的参数，value 为附带的金额（support）
+    '''
+
+    def __init__(self, method, sender, funding, args=(), value=0, nonce=0):
+        if method not in METHODS:
+            raise ValueError('不支持的调用：' + str(method))
+        self.method = method
+        self.sender = sender
+        self.funding = funding
+        self.args = tuple(args)
+        self.value = value
+        self.nonce = nonce  # 同一个发送者的交易序号
+
+    def encode(self):
+        '''
+        函数功能：交易的规范编码，叶子的 hash 就是对它做 hash，验证者由交易本身可以重新算出
+        '''
+        return json.dumps([self.method, self.sender, self.funding, list(self.args), self.value, self.nonce],
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def __str__(self):
+        return 'Tx(' + self.method + ', sender=' + self.sender + ', funding=' + self.funding + ')'
+
+
+class BlockHeader:
+
+    def __init__(self, index, previousHash, merkleRoot, timestamp, txCount):
+        self.index = index
+        self.previousHash = previousHash  # 前一个区块头的 hash
+        self.merkleRoot = merkleRoot      # 区块中交易的 Merkle 树根
+        self.timestamp = timestamp
+        self.txCount = txCount
+
+    def encode(self):
+        return json.dumps([self.index, self.previousHash.hex(), self.merkleRoot.hex(), self.timestamp, self.txCount],
+                          separators=(',', ':')).encode('utf-8')
+
+    def hash(self, hasher):
+        return hasher.digest(self.encode())
+
+
+class Block:
+    '''
+    区块：区块头、交易和交易的 Merkle 树的每一层（用于生成证明）
+    树的形状与 imbalance 方式构建的 Merkle 树相同
+    '''
+
+    def __init__(self, header, transactions, levels, hasher):
+        self.header = header
+        self.transactions = transactions
+        self.levels = levels
+        self.hasher = hasher
+        self.hash = header.hash(hasher)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def proof(self, txIndex):
+        '''
+        函数功能：第 txIndex 笔交易在这个区块中的 Merkle 证明
+        可以用 verify_transaction(block.header, tx, proof) 验证
+        '''
+        if txIndex < 0 or txIndex >= len(self.transactions):
+            return None
+        path = []
+        index = txIndex
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append((level[sibling], sibling < index))
+            else:
+                # 这一层的节点只有一个孩子
+                path.append((None, False))
+            index >>= 1
+        return MerkleProof(self.levels[0][txIndex], txIndex, path, self.hasher.name, self.hasher.compat)
+
+
+def verify_transaction(header, tx, proof):
+    '''
+    函数功能：验证交易 tx 在区块头为 header 的区块中
+    '''
+    if proof == None:
+        return False
+    hasher = MerkleHasher(proof.hashName, proof.compat)
+    return hasher.leaf(tx.encode()) == proof.leafHash and verify_proof(header.merkleRoot, proof)
+
+
+def verify_chain(blocks, hashName='sha256', compat=False):
+    '''
+    函数功能：检查区块头是否首尾相连，以及每个区块的 Merkle 树根是否与其中的交易一致
+    '''
+    hasher = MerkleHasher(hashName, compat)
+    previousHash = GENESIS_HASH
+    for index, block in enumerate(blocks):
+        header = block.header
+        if header.index != index or header.previousHash != previousHash or header.txCount != len(block.transactions):
+            return False
+        hashes = [hasher.leaf(tx.encode()) for tx in block.transactions]
+        if merge_levels(hasher.name, hasher.compat, hashes, tree_height(len(hashes)))[-1][0] != header.merkleRoot:
+            return False
+        previousHash = header.hash(hasher)
+    return True
+
+
+class BlockBuilder:
+    '''
+    打包流水线：submit 把交易放入缓冲区，满足条件时封块，封好的区块追加在 chain 末尾
+    workers 大于 1 时，叶子和中间节点的 hash 在进程池中并行计算（进程池在多个区块之间复用，用完后 close）
+    进程间传递数据的开销不小，区块很大（例如几十万笔交易）时才值得并行
+    onBlock 不为空时，每封好一个区块就调用 onBlock(block)
+    '''
+
+    def __init__(self, maxTransactions=1000, maxDelay=1.0, hashName='sha256', compat=False,
+                 workers=None, onBlock=None):
+        self.maxTransactions = maxTransactions
+        self.maxDelay = maxDelay
+        self.hasher = MerkleHasher(hashName, compat)
+        self.workers = workers
+        self.executor = None
+        self.onBlock = onBlock
+        self.pending = []
+        self.pendingSince = None  # 缓冲区中第一笔交易到达的时间
+        self.chain = []
+
+    def submit(self, tx):
+        '''
+        函数功能：提交一笔交易，这笔交易导致封块时返回新的区块，否则返回 None
+        '''
+        if len(self.pending) == 0:
+            self.pendingSince = time.monotonic()
+        self.pending.append(tx)
+        if len(self.pending) >= self.maxTransactions:
+            return self.seal()
+        return self.poll()
+
+    def poll(self):
+        '''
+        函数功能：第一笔交易已经等待了 maxDelay 秒时封块，没有新交易时也应定期调用
+        '''
+        if len(self.pending) > 0 and time.monotonic() - self.pendingSince >= self.maxDelay:
+            return self.seal()
+        return None
+
+    def run(self, transactions):
+        '''
+        函数功能：处理一个交易流，依次返回封好的区块，交易流结束时把剩下的交易封成最后一个区块
+        '''
+        for tx in transactions:
+            block = self.submit(tx)
+            if block != None:
+                yield block
+        block = self.seal()
+        if block != None:
+            yield block
+
+    def seal(self):
+        '''
+        函数功能：把缓冲区中的交易封成一个区块，缓冲区为空时返回 None
+        '''
+        if len(self.pending) == 0:
+            return None
+        transactions, self.pending = self.pending, []
+        levels = self.build_levels([tx.encode() for tx in transactions])
+        previousHash = self.chain[-1].hash if len(self.chain) > 0 else GENESIS_HASH
+        header = BlockHeader(len(self.chain), previousHash, levels[-1][0], time.time(), len(transactions))
+        block = Block(header, transactions, levels, self.hasher)
+        self.chain.append(block)
+        if self.onBlock != None:
+            self.onBlock(block)
+        return block
+
+    def build_levels(self, payloads):
+        '''
+        函数功能：一次性计算区块的 Merkle 树的每一层
+        '''
+        height = tree_height(len(payloads))
+        if self.workers != None and self.workers > 1:
+            if self.executor == None:
+                self.executor = ProcessPoolExecutor(self.workers)
+            hashes = parallel_hash_leaves(self.hasher, payloads, self.executor, self.workers)
+            return parallel_levels(self.hasher, hashes, height, self.executor, self.workers)
+        hashes = [self.hasher.leaf(payload) for payload in payloads]
+        return merge_levels(self.hasher.name, self.hasher.compat, hashes, height)
+
+    def proof(self, blockIndex, txIndex):
+        '''
+        函数功能：第 blockIndex 个区块中第 txIndex 笔交易的 (交易, Merkle 证明)
+        '''
+        block = self.chain[blockIndex]
+        return block.transactions[txIndex], block.proof(txIndex)
+
+    def close(self):
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def random_address(rng):
+    return '0x%040x' % rng.getrandbits(160)
+
+
+def simulate_transactions(count, players=1000, fundings=10, seed=0):
+    '''
+    函数功能：生成 count 笔模拟的众筹交易，大部分是 support，其余为发起、批准和完成付款申请
+    同样的参数生成同样的交易
+    '''
+    rng = random.Random(seed)
+    playerAddresses = [random_address(rng) for _ in range(players)]
+    managers = {random_address(rng): random_address(rng) for _ in range(fundings)}  # 合约 -> 发起人
+    fundingAddresses = list(managers)
+    requests = {funding: 0 for funding in fundingAddresses}  # 合约 -> 付款申请的数量
+    nonces = {}
+    for _ in range(count):
+        funding = rng.choice(fundingAddresses)
+        r = rng.random()
+        if r < 0.85:
+            method, sender, args, value = 'support', rng.choice(playerAddresses), (), 100
+        elif requests[funding] == 0 or r < 0.88:
+            method, sender, value = 'createRequest', managers[funding], 0
+            args = ('request ' + str(requests[funding]), rng.randint(1, 1000), random_address(rng))
+            requests[funding] += 1
+        elif r < 0.98:
+            method, sender, args, value = 'approveRequest', rng.choice(playerAddresses), (rng.randrange(requests[funding]),), 0
+        else:
+            method, sender, args, value = 'finalizeRequest', managers[funding], (rng.randrange(requests[funding]),), 0
+        nonce = nonces.get(sender, 0)
+        nonces[sender] = nonce + 1
+        yield Transaction(method, sender, funding, args, value, nonce)
+
+
+def measure_tps(count=100000, maxTransactions=1000, workers=None, hashName='sha256'):
+    '''
+    函数功能：用模拟的交易测试打包的吞吐量，返回 (每秒交易数, 区块数)，不包括生成交易的时间
+    '''
+    transactions = list(simulate_transactions(count))
+    builder = BlockBuilder(maxTransactions, maxDelay=float('inf'), hashName=hashName, workers=workers)
+    try:
+        start = time.perf_counter()
+        blocks = sum(1 for _ in builder.run(transactions))
+        seconds = time.perf_counter() - start
+    finally:
+        builder.close()
+    return count / seconds, blocks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='众筹交易打包的吞吐量测试')
+    parser.add_argument('--count', type=int, default=100000, help='模拟的交易数量')
+    parser.add_argument('--block-size', type=int, default=1000, help='每个区块最多的交易数量')
+    parser.add_argument('--workers', type=int, default=None, help='计算 hash 的进程数')
+    parser.add_argument('--hash', default='sha256', help='hash 算法')
+    args = parser.parse_args()
+
+    tps, blocks = measure_tps(args.count, args.block_size, args.workers, args.hash)
+    print('INFO: %d 笔交易，%d 个区块，%.0f tx/s' % (args.count, blocks, tps))
@@ -0,0 +1,465 @@
+from array import array
+import mmap
+import os
+import struct
+
+from MerkleHash import MerkleHasher
+from MerkleTree import ArrayMerkleTree, LeafKeys
+from PrimePool import PrimePool
+
+
+'''
+磁盘上的 Merkle 树文件格式（所有整数为本机字节序）：
+  文件头（4096 字节）：魔数、hash 算法、兼容模式、容量、代数，以及各个向量已使用长度的计数表（包括墓碑数量等计数和有序模式标记）
+  第 0 ~ K 层的 hash：第 d 层有 capacity >> d 个 32 字节的位置（capacity = 2^K）
+  叶子元数据表（按列存放）：素数、标号、数据在 .values 文件中的偏移和长度、是否为补齐节点
+  素数 -> 叶子序号的开放寻址散列表（2 * capacity 个槽）
+  每一层节点的添加代
+叶子保存的数据追加写在同名的 .values 文件中
+'''
+
+MAGIC = b'NEUMERKL'
+HEADER_SIZE = 4096
+HEADER = struct.Struct('=8s16sB7xQQ')  # 魔数, hash 算法, 兼容模式, 容量, 代数
+COUNTS_OFFSET = 64
+COUNT_SLOTS = 160
+
+# 计数表中每个向量使用的位置
+LEVEL_SLOT = 0        # 第 d 层的 hash：LEVEL_SLOT + d
+GENERATION_SLOT = 64  # 第 d 层的添加代：GENERATION_SLOT + d
+PRIME_SLOT = 128
+ID_SLOT = 129
+VALUE_OFFSET_SLOT = 130
+VALUE_LENGTH_SLOT = 131
+PADDING_SLOT = 132
+TOMBSTONE_SLOT = 133  # 墓碑的数量
+NEXT_PRIME_SLOT = 134  # 素数池中下一个可以分配的数
+SORTED_SLOT = 135  # 是否为有序模式（build_merkle_tree(sorted=True)），旧文件中为 0
+
+
+def file_layout(capacity):
+    '''
+    函数功能：计算容量为 capacity 的文件中各段的偏移，返回 (各段的偏移, 文件大小)
+    '''
+    maxDepth = capacity.bit_length() - 1
+    sections = {}
+    offset = HEADER_SIZE
+    for depth in range(maxDepth + 1):
+        sections[('level', depth)] = offset
+        offset += (capacity >> depth) * MerkleHasher.HASH_SIZE
+    for name, size in (('prime', 8), ('id', 8), ('valueOffset', 8)):
+        sections[name] = offset
+        offset += capacity * size
+    sections['index'] = offset
+    offset += capacity * 2 * 16
+    for depth in range(maxDepth + 1):
+        sections[('generation', depth)] = offset
+        offset += (capacity >> depth) * 4
+    sections['valueLength'] = offset
+    offset += capacity * 4
+    sections['padding'] = offset
+    offset += capacity
+    return sections, offset
+
+
+class MappedBytes:
+    '''
+    文件中一层节点的 hash，行为与 ArrayMerkleTree 中的 bytearray 相同（切片读写、+= 追加）
+    已使用的字节数由计数表中的元素个数得到
+    '''
+
+    def __init__(self, tree, view, slot):
+        self.tree = tree
+        self.view = view
+        self.slot = slot
+
+    def __len__(self):
+        return self.tree.counts[self.slot] * MerkleHasher.HASH_SIZE
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def __setitem__(self, index, data):
+        self.view[index] = data
+
+    def __iadd__(self, data):
+        start = len(self)
+        self.view[start:start + len(data)] = data
+        self.tree.counts[self.slot] += len(data) // MerkleHasher.HASH_SIZE
+        return self
+
+    def __delitem__(self, index):
+        # 只支持截短：del level[size:]
+        self.tree.counts[self.slot] = min(self.tree.counts[self.slot], index.start // MerkleHasher.HASH_SIZE)
+
+
+class MappedVector:
+    '''
+    文件中一列定长的元素，行为与 array 相同（下标读写、append、遍历）
+    '''
+
+    def __init__(self, tree, view, slot):
+        self.tree = tree
+        self.view = view
+        self.slot = slot
+
+    def __len__(self):
+        return self.tree.counts[self.slot]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('下标越界')
+        return self.view[index]
+
+    def __setitem__(self, index, value):
+        self.view[index] = value
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.view[index]
+
+    def append(self, value):
+        count = len(self)
+        self.view[count] = value
+        self.tree.counts[self.slot] = count + 1
+
+    def __delitem__(self, index):
+        # 只支持截短：del vector[count:]
+        self.tree.counts[self.slot] = min(self.tree.counts[self.slot], index.start)
+
+
+class MappedValues:
+    '''
+    叶子保存的数据，追加写在 .values 文件中，元数据表中记录每个数据的偏移和长度
+    '''
+
+    def __init__(self, file, offsets, lengths):
+        self.file = file
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        self.file.seek(self.offsets[index])
+        return self.file.read(self.lengths[index]).decode('utf-8')
+
+    def append(self, value):
+        data = value.encode('utf-8')
+        self.file.seek(0, os.SEEK_END)
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(data))
+        self.file.write(data)
+
+    def __delitem__(self, index):
+        # 只支持截短，被截掉的数据留在文件中
+        del self.offsets[index]
+        del self.lengths[index]
+
+    def __setitem__(self, index, value):
+        # 旧的数据留在文件中，新的数据追加在末尾
+        data = value.encode('utf-8')
+        self.file.seek(0, os.SEEK_END)
+        self.offsets[index] = self.file.tell()
+        self.lengths[index] = len(data)
+        self.file.write(data)
+
+
+class MappedIndex:
+    '''
+    素数 -> 叶子序号的开放寻址散列表（线性探测），每个槽保存 (素数+1, 序号)，0 表示空槽
+    查找只访问一两个页面，打开文件时不需要重建索引
+    '''
+
+    def __init__(self, view):
+        self.view = view
+        self.mask = len(view) // 2 - 1
+
+    def home(self, key):
+        # 键最先探测的槽
+        return (key * 0x9E3779B97F4A7C15 >> 32) & self.mask
+
+    def find(self, key):
+        slot = self.home(key)
+        while self.view[2 * slot] != 0 and self.view[2 * slot] != key + 1:
+            slot = (slot + 1) & self.mask
+        return slot
+
+    def get(self, key, default=None):
+        slot = self.find(key)
+        if self.view[2 * slot] == 0:
+            return default
+        return self.view[2 * slot + 1]
+
+    def setdefault(self, key, value):
+        slot = self.find(key)
+        if self.view[2 * slot] == 0:
+            self.view[2 * slot] = key + 1
+            self.view[2 * slot + 1] = value
+        return self.view[2 * slot + 1]
+
+    def __setitem__(self, key, value):
+        slot = self.find(key)
+        self.view[2 * slot] = key + 1
+        self.view[2 * slot + 1] = value
+
+    def __delitem__(self, key):
+        '''
+        函数功能：删除一个键，同一簇中后面的键向前移动，保证线性探测仍然能找到它们
+        '''
+        hole = self.find(key)
+        if self.view[2 * hole] == 0:
+            raise KeyError(key)
+        slot = (hole + 1) & self.mask
+        while self.view[2 * slot] != 0:
+            home = self.home(self.view[2 * slot] - 1)
+            if (slot - home) & self.mask >= (slot - hole) & self.mask:
+                self.view[2 * hole] = self.view[2 * slot]
+                self.view[2 * hole + 1] = self.view[2 * slot + 1]
+                hole = slot
+            slot = (slot + 1) & self.mask
+        self.view[2 * hole] = 0
+        self.view[2 * hole + 1] = 0
+
+    def __contains__(self, key):
+        return self.view[2 * self.find(key)] != 0
+
+    def items(self):
+        for slot in range(self.mask + 1):
+            if self.view[2 * slot] != 0:
+                yield self.view[2 * slot] - 1, self.view[2 * slot + 1]
+
+
+class MappedKeys(LeafKeys):
+    '''
+    磁盘上的有序树的键，读取时才由叶子的数据得到，打开文件时不需要读出所有的键
+    键总是与叶子一致，修改叶子就修改了键，插入、修改、删除键都不需要另外处理
+    '''
+
+    def __setitem__(self, index, key):
+        pass
+
+    def __delitem__(self, index):
+        pass
+
+    def insert(self, index, key):
+        pass
+
+
+class MappedMerkleTree(ArrayMerkleTree):
+    '''
+    保存在磁盘上、通过 mmap 访问的 Merkle 树
+    打开文件不需要重建整棵树，查询和生成证明只读取用到的 O(log n) 个页面，
+    添加节点直接写入文件；容量用完时把文件扩大一倍
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.newNodes = []
+        self.compactRatio = 0.5
+        self.load()
+        # 被覆盖的旧 hash 和叶子只保存在内存中，打开文件之前的版本不能再查询
+        self.oldHashes = {}
+        self.oldLeaves = {}
+        self.oldIndex = {}
+        self.firstGeneration = self.history
+
+    @classmethod
+    def create(cls, path, hashName='sha256', compat=False, capacity=2):
+        '''
+        函数功能：创建一棵空的磁盘上的树
+        '''
+        write_tree(path, ArrayMerkleTree(hashName, compat), capacity)
+        return cls(path)
+
+    @classmethod
+    def save(cls, tree, path):
+        '''
+        函数功能：把内存中的 ArrayMerkleTree 保存为磁盘上的树，并打开它
+        '''
+        write_tree(path, tree)
+        return cls(path)
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def load(self):
+        self.file = open(self.path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, hashName, compat, capacity, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError('不是 Merkle 树文件：' + self.path)
+        self.hasher = MerkleHasher(hashName.rstrip(b'\0').decode(), bool(compat))
+        self.capacity = capacity
+
+        self.views = []
+        self.counts = self.map_view(COUNTS_OFFSET, COUNT_SLOTS * 8, 'Q')
+        sections, _ = file_layout(capacity)
+        maxDepth = capacity.bit_length() - 1
+        self.levels = []
+        self.generations = []
+        for depth in range(maxDepth + 1):
+            self.levels.append(MappedBytes(self, self.map_view(
+                sections[('level', depth)], (capacity >> depth) * MerkleHasher.HASH_SIZE, 'B'), LEVEL_SLOT + depth))
+            self.generations.append(MappedVector(self, self.map_view(
+                sections[('generation', depth)], (capacity >> depth) * 4, 'I'), GENERATION_SLOT + depth))
+        self.primes = MappedVector(self, self.map_view(sections['prime'], capacity * 8, 'Q'), PRIME_SLOT)
+        self.ids = MappedVector(self, self.map_view(sections['id'], capacity * 8, 'd'), ID_SLOT)
+        self.paddings = MappedVector(self, self.map_view(sections['padding'], capacity, 'B'), PADDING_SLOT)
+        self.valueFile = open(self.path + '.values', 'r+b')
+        self.values = MappedValues(
+            self.valueFile,
+            MappedVector(self, self.map_view(sections['valueOffset'], capacity * 8, 'Q'), VALUE_OFFSET_SLOT),
+            MappedVector(self, self.map_view(sections['valueLength'], capacity * 4, 'I'), VALUE_LENGTH_SLOT),
+        )
+        self.leafIndex = MappedIndex(self.map_view(sections['index'], capacity * 2 * 16, 'Q'))
+        self.primePool = PrimePool(self.counts[NEXT_PRIME_SLOT])
+        self.sortedKeys = MappedKeys(self) if self.counts[SORTED_SLOT] else None
+
+    def map_view(self, offset, size, format):
+        view = memoryview(self.mm)[offset:offset + size].cast(format)
+        self.views.append(view)
+        return view
+
+    @property
+    def history(self):
+        return HEADER.unpack_from(self.mm, 0)[4]
+
+    @history.setter
+    def history(self, history):
+        struct.pack_into('=Q', self.mm, HEADER.size - 8, history)
+
+    @property
+    def tombstones(self):
+        return self.counts[TOMBSTONE_SLOT]
+
+    @tombstones.setter
+    def tombstones(self, tombstones):
+        self.counts[TOMBSTONE_SLOT] = tombstones
+
+    def flush(self):
+        self.mm.flush()
+        self.valueFile.flush()
+
+    def close(self):
+        '''
+        函数功能：把修改写回磁盘并关闭文件
+        '''
+        self.flush()
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.mm.close()
+        self.file.close()
+        self.valueFile.close()
+
+    def grow(self):
+        '''
+        函数功能：容量用完时，把所有数据复制到容量大一倍的新文件中
+        '''
+        tempPath = self.path + '.grow'
+        write_tree(tempPath, self, self.capacity * 2)
+        self.close()
+        os.replace(tempPath, self.path)
+        os.replace(tempPath + '.values', self.path + '.values')
+        self.load()
+
+    def new_prime(self, pending=()):
+        newNodePrime = ArrayMerkleTree.new_prime(self, pending)
+        self.counts[NEXT_PRIME_SLOT] = self.primePool.next
+        return newNodePrime
+
+    def reset(self):
+        raise TypeError('磁盘上的树不能清空，请重新 create')
+
+    def append_leaf(self, value, digest, prime, id, padding=False):
+        if len(self.values) == self.capacity:
+            self.grow()
+        return ArrayMerkleTree.append_leaf(self, value, digest, prime, id, padding)
+
+    def build_merkle_tree(self, nodeData, way='filling', sorted=False, workers=None):
+        '''
+        函数功能：在内存中构建整棵树，再整体写入文件
+        '''
+        tree = ArrayMerkleTree(self.hasher.name, self.hasher.compat)
+        tree.history = self.history
+        tree.primePool = self.primePool
+        tree.build_merkle_tree(nodeData, way, sorted, workers)
+        if len(tree.values) == 0:
+            return
+        self.close()
+        write_tree(self.path, tree)
+        self.load()
+        self.newNodes = tree.newNodes
+        self.oldHashes = {}
+        self.oldLeaves = {}
+        self.oldIndex = {}
+        self.firstGeneration = self.history
+
+
+def write_tree(path, tree, capacity=None):
+    '''
+    函数功能：把 tree（ArrayMerkleTree 或 MappedMerkleTree）写成磁盘上的树文件，
+    容量至少为 capacity，并且能放下所有的叶子
+    '''
+    count = len(tree.values)
+    if capacity == None:
+        capacity = 2
+    while capacity < count:
+        capacity *= 2
+    sections, size = file_layout(capacity)
+
+    with open(path, 'w+b') as f:
+        f.truncate(size)
+        mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(mm, 0, MAGIC, tree.hasher.name.encode(), 1 if tree.hasher.compat else 0,
+                         capacity, tree.history)
+        counts = array('Q', [0]) * COUNT_SLOTS
+
+        for depth in range(len(tree.levels)):
+            size = len(tree.levels[depth])
+            offset = sections[('level', depth)]
+            mm[offset:offset + size] = bytes(tree.levels[depth][0:size])
+            counts[LEVEL_SLOT + depth] = size // MerkleHasher.HASH_SIZE
+            data = array('I', tree.generations[depth]).tobytes()
+            offset = sections[('generation', depth)]
+            mm[offset:offset + len(data)] = data
+            counts[GENERATION_SLOT + depth] = len(tree.generations[depth])
+
+        offsets = array('Q')
+        lengths = array('I')
+        with open(path + '.values', 'wb') as valueFile:
+            position = 0
+            for index in range(count):
+                data = tree.values[index].encode('utf-8')
+                valueFile.write(data)
+                offsets.append(position)
+                lengths.append(len(data))
+                position += len(data)
+
+        for name, slot, data in (
+                ('prime', PRIME_SLOT, array('Q', tree.primes)),
+                ('id', ID_SLOT, array('d', tree.ids)),
+                ('padding', PADDING_SLOT, array('B', tree.paddings)),
+                ('valueOffset', VALUE_OFFSET_SLOT, offsets),
+                ('valueLength', VALUE_LENGTH_SLOT, lengths)):
+            offset = sections[name]
+            mm[offset:offset + len(data) * data.itemsize] = data.tobytes()
+            counts[slot] = len(data)
+        counts[TOMBSTONE_SLOT] = tree.tombstones
+        counts[NEXT_PRIME_SLOT] = tree.primePool.next
+        counts[SORTED_SLOT] = 1 if tree.sortedKeys != None else 0
+        mm[COUNTS_OFFSET:COUNTS_OFFSET + COUNT_SLOTS * 8] = counts.tobytes()
+
+        view = memoryview(mm)[sections['index']:sections['index'] + capacity * 2 * 16].cast('Q')
+        index = MappedIndex(view)
+        for key, value in tree.leafIndex.items():
+            index.setdefault(key, value)
+        view.release()
+
+        mm.flush()
+        mm.close()
@@ -0,0 +1,43 @@
+def quote(text):
+    return '"' + str(text).replace('"', '\\"') + '"'
+
+
+def attr_list(attrs):
+    return ' '.join(key + '=' + quote(value) for key, value in attrs.items() if value != None)
+
+
+class DotWriter:
+    '''
+    把 DOT 格式的图边生成边写入文件，接口与 graphviz.Digraph 的 node / edge / attr 相同
+    节点和边不在内存中保存，可以输出很大的树；写完后用 close() 结束（也可以用 with）
+    '''
+
+    def __init__(self, path, name='MerkleTree'):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('digraph ' + name + ' {\n')
+
+    def node(self, name, label=None, _attributes=None, **attrs):
+        attrs = dict(attrs, label=label, **(_attributes or {}))
+        self.file.write('\t' + quote(name) + ' [' + attr_list(attrs) + ']\n')
+
+    def edge(self, tail_name, head_name, label=None, _attributes=None, **attrs):
+        attrs = dict(attrs, label=label, **(_attributes or {}))
+        self.file.write('\t' + quote(tail_name) + ' -> ' + quote(head_name))
+        if any(value != None for value in attrs.values()):
+            self.file.write(' [' + attr_list(attrs) + ']')
+        self.file.write('\n')
+
+    def attr(self, kw='graph', **attrs):
+        self.file.write('\t' + kw + ' [' + attr_list(attrs) + ']\n')
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write('}\n')
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
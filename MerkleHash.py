@@ -0,0 +1,69 @@
+import functools
+import hashlib
+
+try:
+    import blake3
+except ImportError:  # blake3 是可选依赖
+    blake3 = None
+
+
+def hash_backend(name):
+    '''
+    函数功能：根据名字返回 hash 构造函数，所有后端的摘要长度都是 32 字节
+    '''
+    if name == 'sha256':
+        return hashlib.sha256
+    if name == 'blake2b':
+        return functools.partial(hashlib.blake2b, digest_size=32)
+    if name in ('sha3', 'sha3_256'):
+        return hashlib.sha3_256
+    if name == 'blake3':
+        if blake3 == None:
+            raise ValueError('使用 blake3 需要先安装 blake3：pip install blake3')
+        return blake3.blake3
+    raise ValueError('不支持的 hash 算法：' + str(name))
+
+
+class MerkleHasher:
+    '''
+    Merkle 树使用的 hash 函数，输入和输出都是原始的字节串（32 字节摘要）
+    默认对叶子和中间节点做域分离：叶子前缀 0x00，中间节点前缀 0x01
+    compat=True 时与最初的实现相同：叶子直接做 hash，中间节点对孩子十六进制字符串的拼接做 hash
+    '''
+
+    LEAF_PREFIX = b'\x00'
+    NODE_PREFIX = b'\x01'
+    HASH_SIZE = 32
+
+    def __init__(self, name='sha256', compat=False):
+        self.name = name
+        self.compat = compat
+        self.new = hash_backend(name)
+        # 被删除的叶子（墓碑）的 hash，真实叶子的数据不会为空
+        self.tombstoneHash = self.leaf(b'')
+
+    def digest(self, data):
+        '''
+        函数功能：对字节串直接做 hash
+        '''
+        return self.new(data).digest()
+
+    def leaf(self, data):
+        '''
+        函数功能：计算叶子的 hash
+        '''
+        if self.compat:
+            return self.new(data).digest()
+        return self.new(self.LEAF_PREFIX + data).digest()
+
+    def node(self, left, right=None):
+        '''
+        函数功能：由孩子的 hash 计算中间节点的 hash，只有一个孩子时 right 为 None
+        '''
+        if self.compat:
+            if right == None:
+                return self.new(left.hex().encode()).digest()
+            return self.new((left.hex() + right.hex()).encode()).digest()
+        if right == None:
+            return self.new(self.NODE_PREFIX + left).digest()
+        return self.new(self.NODE_PREFIX + left + right).digest()
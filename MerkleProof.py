@@ -0,0 +1,390 @@
+from MerkleHash import MerkleHasher
+
+
+def tree_height(count):
+    '''
+    函数功能：count 个叶子构成的树的高度，只有一个叶子时树根是它的单孩子父节点
+    '''
+    if count <= 1:
+        return count
+    return (count - 1).bit_length()
+
+
+class MerkleProof:
+    '''
+    Merkle 证明（审计路径）
+    只保存叶子的 hash、叶子的序号和从叶子到树根每一层的作证 hash，大小为 O(log n)
+    '''
+
+    def __init__(self, leafHash, leafIndex, path, hashName='sha256', compat=False):
+        self.leafHash = leafHash    # 叶子的 hash 值
+        self.leafIndex = leafIndex  # 叶子在最底层的序号（从 0 开始）
+        # 从叶子到树根每一层的 (作证hash, 作证节点是否在左边)
+        # 作证 hash 为 None 表示这一层的节点只有一个孩子，只对自己做 hash
+        self.path = path
+        self.hashName = hashName    # 树使用的 hash 算法
+        self.compat = compat        # 树是否使用兼容模式的 hash
+
+    def __len__(self):
+        return len(self.path)
+
+    def __str__(self):
+        return 'Proof(index='+str(self.leafIndex)+', leaf='+self.leafHash.hex()+', length='+str(len(self.path))+')'
+
+
+def proof_root(proof, hasher=None):
+    '''
+    函数功能：沿着审计路径从叶子计算出树根的 hash
+    '''
+    if hasher == None:
+        hasher = MerkleHasher(proof.hashName, proof.compat)
+    thisHash = proof.leafHash
+    for siblingHash, siblingIsLeft in proof.path:
+        if siblingHash == None:
+            thisHash = hasher.node(thisHash)
+        elif siblingIsLeft:
+            thisHash = hasher.node(siblingHash, thisHash)
+        else:
+            thisHash = hasher.node(thisHash, siblingHash)
+    return thisHash
+
+
+def verify_proof(root_hash, proof):
+    '''
+    函数功能：验证 proof 能否证明它的叶子在树根为 root_hash 的树上
+    root_hash 可以是字节串，也可以是十六进制字符串
+    '''
+    if proof == None:
+        return False
+    if isinstance(root_hash, str):
+        root_hash = bytes.fromhex(root_hash)
+    return proof_root(proof) == root_hash
+
+
+class ConsistencyProof:
+    '''
+    一致性证明：证明 oldSize 个叶子的旧树是 newSize 个叶子的新树的前缀
+    hashes 中是自下而上的 O(log n) 个 hash，每个 hash 的位置和方向都由两个树的大小决定
+    '''
+
+    def __init__(self, oldSize, newSize, hashes, hashName='sha256', compat=False):
+        self.oldSize = oldSize
+        self.newSize = newSize
+        self.hashes = hashes
+        self.hashName = hashName
+        self.compat = compat
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __str__(self):
+        return 'ConsistencyProof(old='+str(self.oldSize)+', new='+str(self.newSize)+', length='+str(len(self.hashes))+')'
+
+
+def verify_consistency(oldRoot, newRoot, proof):
+    '''
+    函数功能：验证树根为 oldRoot 的旧树是树根为 newRoot 的新树的前缀
+    从旧树最右边的完全子树出发，同时向上计算旧树和新树的树根：
+    左边的作证节点两棵树共用，右边的作证节点只属于新树（旧树中这一层只有一个孩子）
+    '''
+    if proof == None:
+        return False
+    if isinstance(oldRoot, str):
+        oldRoot = bytes.fromhex(oldRoot)
+    if isinstance(newRoot, str):
+        newRoot = bytes.fromhex(newRoot)
+    oldSize, newSize = proof.oldSize, proof.newSize
+    if oldSize < 0 or oldSize > newSize:
+        return False
+    if oldSize == 0:
+        return len(proof.hashes) == 0
+    if oldSize == newSize:
+        return len(proof.hashes) == 0 and oldRoot == newRoot
+
+    hasher = MerkleHasher(proof.hashName, proof.compat)
+    hashes = list(proof.hashes)
+    hashes.reverse()
+    depth = (oldSize & -oldSize).bit_length() - 1
+    index = (oldSize >> depth) - 1
+    if oldSize == 1 << depth and oldSize != 1:
+        thisHash = oldRoot
+    elif len(hashes) > 0:
+        thisHash = hashes.pop()
+    else:
+        return False
+
+    oldHash = newHash = thisHash
+    oldHeight = tree_height(oldSize)
+    for d in range(depth, tree_height(newSize)):
+        i = index >> (d - depth)
+        if i & 1:
+            if len(hashes) == 0:
+                return False
+            siblingHash = hashes.pop()
+            if d < oldHeight:
+                oldHash = hasher.node(siblingHash, oldHash)
+            newHash = hasher.node(siblingHash, newHash)
+        else:
+            if d < oldHeight:
+                oldHash = hasher.node(oldHash)
+            if (i + 1) << d < newSize:
+                if len(hashes) == 0:
+                    return False
+                newHash = hasher.node(newHash, hashes.pop())
+            else:
+                newHash = hasher.node(newHash)
+    return len(hashes) == 0 and oldHash == oldRoot and newHash == newRoot
+
+
+def leaf_data(value, primeNum, id, sortedMode=False):
+    '''
+    函数功能：叶子被 hash 的数据
+    有序模式下数据（键）、素数、标号各自加上 4 字节的长度前缀，三段的分界是唯一的，
+    验证不存在证明时由它确定邻居叶子的键；其他模式与最初的实现相同，直接拼接
+    '''
+    if not sortedMode:
+        return (value+primeNum+id).encode('utf-8')
+    fields = [field.encode('utf-8') for field in (value, primeNum, id)]
+    return b''.join(len(field).to_bytes(4, 'big') + field for field in fields)
+
+
+class NonMembershipProof:
+    '''
+    有序模式下证明键 key 不在树上
+    left / right 是夹住 key 的两个叶子的 (数据, 素数, 标号, Merkle 证明)，
+    key 比所有的键都小时 left 为 None，比所有的键都大时 right 为 None
+    gap 是夹在 left 和 right 之间的墓碑（被删除的叶子）的 Merkle 证明，按序号从小到大排列
+    '''
+
+    def __init__(self, key, left, right, hashName='sha256', compat=False, gap=()):
+        self.key = key
+        self.left = left
+        self.right = right
+        self.hashName = hashName
+        self.compat = compat
+        self.gap = list(gap)
+
+    def __str__(self):
+        return 'NonMembershipProof(key='+str(self.key)+', left='+str(self.left != None)+', right='+str(self.right != None)+', gap='+str(len(self.gap))+')'
+
+
+def path_index(proof):
+    '''
+    函数功能：由审计路径每一层的方向得到叶子的序号（不依赖证明中记录的 leafIndex）
+    '''
+    index = 0
+    for depth, (_, siblingIsLeft) in enumerate(proof.path):
+        if siblingIsLeft:
+            index |= 1 << depth
+    return index
+
+
+def verify_non_membership(root_hash, proof):
+    '''
+    函数功能：验证 proof.key 不在树根为 root_hash 的有序树上
+    两个叶子的 hash 由它们的数据重新计算，中间的叶子都必须是墓碑，所有的审计路径都要能算出树根；
+    这些叶子必须依次相邻，两边的叶子夹住 key；
+    没有左边（右边）的叶子时，审计路径要说明最左边（最右边）的一个是第一个（最后一个）叶子
+    '''
+    if proof == None:
+        return False
+    if isinstance(root_hash, str):
+        root_hash = bytes.fromhex(root_hash)
+    hasher = MerkleHasher(proof.hashName, proof.compat)
+    chain = []
+    for witness in (proof.left, proof.right):
+        if witness == None:
+            continue
+        value, primeNum, id, leafProof = witness
+        # 叶子的数据与键一一对应，不能把邻居叶子的数据拆成别的键
+        if hasher.leaf(leaf_data(value, primeNum, id, sortedMode=True)) != leafProof.leafHash:
+            return False
+        chain.append(leafProof)
+    if any(tombProof.leafHash != hasher.tombstoneHash for tombProof in proof.gap):
+        return False
+    if proof.left != None:
+        chain = chain[:1] + proof.gap + chain[1:]
+    else:
+        chain = proof.gap + chain
+    if len(chain) == 0:
+        # 空树上什么都没有
+        return root_hash == b''
+    if any(proof_root(leafProof, hasher) != root_hash for leafProof in chain):
+        return False
+
+    if proof.left != None and not int(proof.left[0]) < proof.key:
+        return False
+    if proof.right != None and not proof.key < int(proof.right[0]):
+        return False
+    for leftProof, rightProof in zip(chain, chain[1:]):
+        if len(leftProof.path) != len(rightProof.path) or path_index(rightProof) != path_index(leftProof) + 1:
+            return False
+    if proof.left == None and not all(not siblingIsLeft for _, siblingIsLeft in chain[0].path):
+        # 第一个叶子：每一层都在左边
+        return False
+    if proof.right == None and not all(siblingHash == None for siblingHash, siblingIsLeft in chain[-1].path if not siblingIsLeft):
+        # 最后一个叶子：所有它在左边的层都没有右边的兄弟
+        return False
+    return True
+
+
+class MultiProof:
+    '''
+    多个叶子合并的 Merkle 证明
+    hashes 中是自下而上、每层从左到右的作证 hash，只包含验证者无法由请求的叶子算出的节点
+    单孩子节点的位置由叶子数量 leafCount 决定，不需要记录
+    '''
+
+    def __init__(self, leafIndices, leafHashes, hashes, leafCount, hashName='sha256', compat=False):
+        self.leafIndices = leafIndices  # 请求的叶子的序号（从小到大，不重复）
+        self.leafHashes = leafHashes    # 与 leafIndices 对应的叶子的 hash
+        self.hashes = hashes
+        self.leafCount = leafCount      # 树的叶子数量
+        self.hashName = hashName
+        self.compat = compat
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __str__(self):
+        return 'MultiProof(leaves='+str(len(self.leafIndices))+', count='+str(self.leafCount)+', length='+str(len(self.hashes))+')'
+
+
+def multiproof_root(proof, hasher=None):
+    '''
+    函数功能：由合并的证明逐层向上计算树根，每个共同的祖先节点只计算一次
+    证明的格式不对时返回 None
+    '''
+    if hasher == None:
+        hasher = MerkleHasher(proof.hashName, proof.compat)
+    indices = proof.leafIndices
+    if len(indices) == 0 or len(indices) != len(proof.leafHashes):
+        return None
+    if any(indices[i] >= indices[i+1] for i in range(len(indices) - 1)):
+        return None
+    if indices[0] < 0 or indices[-1] >= proof.leafCount:
+        return None
+
+    hashes = list(proof.hashes)
+    hashes.reverse()
+    level = dict(zip(indices, proof.leafHashes))
+    size = proof.leafCount
+    for _ in range(tree_height(proof.leafCount)):
+        parents = {}
+        for pos in sorted(level):
+            if pos >> 1 in parents:
+                # 和左边的兄弟一起算过了
+                continue
+            if pos & 1:
+                if len(hashes) == 0:
+                    return None
+                parents[pos >> 1] = hasher.node(hashes.pop(), level[pos])
+            elif pos + 1 in level:
+                parents[pos >> 1] = hasher.node(level[pos], level[pos + 1])
+            elif pos + 1 < size:
+                if len(hashes) == 0:
+                    return None
+                parents[pos >> 1] = hasher.node(level[pos], hashes.pop())
+            else:
+                parents[pos >> 1] = hasher.node(level[pos])
+        level = parents
+        size = (size + 1) // 2
+    if len(hashes) != 0:
+        return None
+    return level.get(0)
+
+
+def verify_multiproof(root_hash, proof):
+    '''
+    函数功能：验证合并的证明中所有的叶子都在树根为 root_hash 的树上
+    '''
+    if proof == None:
+        return False
+    if isinstance(root_hash, str):
+        root_hash = bytes.fromhex(root_hash)
+    return multiproof_root(proof) == root_hash
+
+
+DEFAULT_HASHES = {}  # (hash 算法, compat, 键的位数) -> 每一层空子树的 hash
+
+
+def default_hashes(hasher, keyBits):
+    '''
+    函数功能：稀疏 Merkle 树中高度为 0..keyBits 的空子树的 hash，每种参数只计算一次
+    空叶子的 hash 为 leaf(b'')，空子树的 hash 为两个低一层空子树的 hash
+    '''
+    key = (hasher.name, hasher.compat, keyBits)
+    defaults = DEFAULT_HASHES.get(key)
+    if defaults == None:
+        defaults = [hasher.leaf(b'')]
+        for _ in range(keyBits):
+            defaults.append(hasher.node(defaults[-1], defaults[-1]))
+        DEFAULT_HASHES[key] = defaults
+    return defaults
+
+
+def sparse_leaf_data(key, value, keyBits):
+    '''
+    函数功能：稀疏 Merkle 树中叶子被 hash 的数据，包含键，叶子不能被挪到别的键下
+    '''
+    return key.to_bytes((keyBits + 7) // 8, 'big') + value.encode('utf-8')
+
+
+class SparseProof:
+    '''
+    稀疏 Merkle 树的证明，value 不为 None 时证明键的值，为 None 时证明键《不在》树上
+    从叶子到树根每一层都有一个作证 hash，其中等于空子树的 hash 不保存，
+    bitmap 的第 d 位为 1 表示第 d 层的作证 hash 保存在 hashes 中（自下而上）
+    '''
+
+    def __init__(self, key, value, bitmap, hashes, keyBits=160, hashName='sha256', compat=False):
+        self.key = key
+        self.value = value
+        self.bitmap = bitmap
+        self.hashes = hashes
+        self.keyBits = keyBits
+        self.hashName = hashName
+        self.compat = compat
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __str__(self):
+        kind = 'inclusion' if self.value != None else 'exclusion'
+        return 'SparseProof('+kind+', key='+hex(self.key)+', length='+str(len(self.hashes))+')'
+
+
+def sparse_root(proof, hasher=None):
+    '''
+    函数功能：由稀疏 Merkle 树的证明计算树根，证明的格式不对时返回 None
+    '''
+    if hasher == None:
+        hasher = MerkleHasher(proof.hashName, proof.compat)
+    if proof.key < 0 or proof.key >> proof.keyBits or proof.bitmap >> proof.keyBits:
+        return None
+    if bin(proof.bitmap).count('1') != len(proof.hashes):
+        return None
+    defaults = default_hashes(hasher, proof.keyBits)
+    if proof.value == None:
+        thisHash = defaults[0]
+    else:
+        thisHash = hasher.leaf(sparse_leaf_data(proof.key, proof.value, proof.keyBits))
+    hashes = iter(proof.hashes)
+    for depth in range(proof.keyBits):
+        siblingHash = next(hashes) if (proof.bitmap >> depth) & 1 else defaults[depth]
+        if (proof.key >> depth) & 1:
+            thisHash = hasher.node(siblingHash, thisHash)
+        else:
+            thisHash = hasher.node(thisHash, siblingHash)
+    return thisHash
+
+
+def verify_sparse(root_hash, proof):
+    '''
+    函数功能：验证稀疏 Merkle 树的证明：键的值为 proof.value，或者 proof.value 为 None 时键不在树上
+    '''
+    if proof == None:
+        return False
+    if isinstance(root_hash, str):
+        root_hash = bytes.fromhex(root_hash)
+    return sparse_root(proof) == root_hash
@@ -0,0 +1,117 @@
+import time
+
+from MerkleHash import MerkleHasher
+
+
+# 开启统计后计时的公开操作
+OPERATIONS = (
+    'build_merkle_tree', 'add', 'add_many', 'remove', 'update', 'update_many', 'compact',
+    'search', 'merkle_path', 'get_proof', 'multiproof', 'non_membership_proof', 'consistency_proof',
+    'getTreePrime', 'compare', 'show',
+)
+
+# 统计的计数器
+COUNTERS = ('hashCalls', 'hashBytes', 'nodesAllocated', 'nodesTraversed', 'primesAllocated')
+
+
+class CountingHasher(MerkleHasher):
+    '''
+    统计 hash 次数、被 hash 的字节数和 hash 耗时的 hash 函数，开启统计时替换树上的 hasher
+    '''
+
+    def __init__(self, stats, name='sha256', compat=False):
+        self.stats = stats
+        MerkleHasher.__init__(self, name, compat)
+
+    def count(self, size, start):
+        self.stats.hashCalls += 1
+        self.stats.hashBytes += size
+        self.stats.hashSeconds += time.perf_counter() - start
+
+    def digest(self, data):
+        start = time.perf_counter()
+        result = MerkleHasher.digest(self, data)
+        self.count(len(data), start)
+        return result
+
+    def leaf(self, data):
+        start = time.perf_counter()
+        result = MerkleHasher.leaf(self, data)
+        self.count(len(data), start)
+        return result
+
+    def node(self, left, right=None):
+        start = time.perf_counter()
+        result = MerkleHasher.node(self, left, right)
+        self.count(len(left) + (len(right) if right != None else 0), start)
+        return result
+
+
+class TreeStats:
+    '''
+    一棵树的运行统计：hash 次数和字节数、分配和遍历的节点数、分配的素数，以及每个公开操作的次数和耗时
+    分配的节点由树在创建节点时计入（MerkleTree.count_allocated），同一进程中其他树创建的节点不计入
+    回调函数 callback(操作名, 耗时（秒）, 这次操作中各计数器的增量) 在每次公开操作结束时调用，
+    可以把指标转发给 Prometheus、OpenTelemetry 等
+    '''
+
+    def __init__(self):
+        self.callbacks = []
+        self.reset()
+
+    def reset(self):
+        self.hashCalls = 0
+        self.hashBytes = 0
+        self.hashSeconds = 0.0
+        self.nodesAllocated = 0
+        self.nodesTraversed = 0
+        self.primesAllocated = 0
+        # 操作名 -> [调用次数, 总耗时, 最大耗时]
+        self.operations = {}
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def counters(self):
+        return {name: getattr(self, name) for name in COUNTERS}
+
+    def wrap(self, name, method):
+        '''
+        函数功能：返回计时的 method，结束时更新操作的统计并调用回调函数
+        '''
+        def timed(*args, **kwargs):
+            before = self.counters()
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                after = self.counters()
+                self.record(name, seconds, {key: after[key] - before[key] for key in COUNTERS})
+        timed.__name__ = name
+        timed.__doc__ = method.__doc__
+        return timed
+
+    def record(self, name, seconds, delta):
+        operation = self.operations.setdefault(name, [0, 0.0, 0.0])
+        operation[0] += 1
+        operation[1] += seconds
+        operation[2] = max(operation[2], seconds)
+        for callback in self.callbacks:
+            callback(name, seconds, delta)
+
+    def snapshot(self):
+        '''
+        函数功能：当前统计的副本（dict），可以直接转成 JSON
+        '''
+        result = self.counters()
+        result['hashSeconds'] = self.hashSeconds
+        result['operations'] = {
+            name: {'calls': calls, 'seconds': seconds, 'maxSeconds': maxSeconds,
+                   'avgSeconds': seconds / calls}
+            for name, (calls, seconds, maxSeconds) in self.operations.items()
+        }
+        return result
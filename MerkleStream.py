@@ -0,0 +1,220 @@
+import os
+
+from MerkleHash import MerkleHasher
+from MerkleProof import MerkleProof
+
+
+CHUNK_SIZE = 4096  # 每次从文件读取、向文件写入的 hash 个数
+NODE_SUFFIX = '.nodes'  # 中间节点文件的后缀，与叶子 hash 文件放在一起
+
+
+def iter_records(source):
+    '''
+    函数功能：逐条读出数据，source 可以是文件路径、打开的文件或任意可迭代对象
+    文件按行读取，去掉行尾的换行符
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_records(f)
+        return
+    for record in source:
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        if record.endswith(b'\n'):
+            record = record[:-1]
+            if record.endswith(b'\r'):
+                record = record[:-1]
+        yield record
+
+
+class MerkleFolder:
+    '''
+    流式计算 Merkle 树根
+    栈中只保存 O(log n) 个还没有合并的完全子树的 (高度, hash)，
+    两个高度相同的子树立即合并，结果与 imbalance 方式构建的树完全相同
+    onNode 不为空时，每合并出一个完全子树就调用 onNode(hash)，按合并的顺序（后序）给出所有的中间节点
+    '''
+
+    def __init__(self, hasher, onNode=None):
+        self.hasher = hasher
+        self.onNode = onNode
+        self.stack = []
+        self.count = 0
+
+    def push(self, leafHash, height=0):
+        '''
+        函数功能：在右边追加一个叶子（height 大于 0 时追加一个高度为 height 的完全子树）
+        '''
+        thisHash = leafHash
+        while len(self.stack) > 0 and self.stack[-1][0] == height:
+            _, leftHash = self.stack.pop()
+            thisHash = self.hasher.node(leftHash, thisHash)
+            height += 1
+            if self.onNode != None:
+                self.onNode(thisHash)
+        self.stack.append((height, thisHash))
+        self.count += 1
+
+    def raise_to(self, height, thisHash, target):
+        '''
+        函数功能：右边不满的子树只有左孩子，逐层只对自己做 hash，直到高度为 target
+        '''
+        for _ in range(target - height):
+            thisHash = self.hasher.node(thisHash)
+        return thisHash
+
+    def result(self, height=None):
+        '''
+        函数功能：合并栈中剩余的子树，返回 (高度, hash)
+        给定 height 时，把结果补齐到这个高度（用于计算某个位置上的子树）
+        '''
+        if len(self.stack) == 0:
+            return 0, None
+        thisHeight, thisHash = self.stack[-1]
+        for leftHeight, leftHash in reversed(self.stack[:-1]):
+            thisHash = self.raise_to(thisHeight, thisHash, leftHeight)
+            thisHash = self.hasher.node(leftHash, thisHash)
+            thisHeight = leftHeight + 1
+        if height != None:
+            thisHash = self.raise_to(thisHeight, thisHash, height)
+            thisHeight = height
+        return thisHeight, thisHash
+
+    def root(self):
+        '''
+        函数功能：整棵树的树根，只有一个叶子时树根是它的单孩子父节点
+        '''
+        if self.count == 1:
+            return self.result(1)[1]
+        return self.result()[1]
+
+
+class ChunkWriter:
+    '''
+    把 hash 攒成块再写入文件
+    '''
+
+    def __init__(self, path):
+        self.out = open(path, 'wb')
+        self.buffer = bytearray()
+
+    def write(self, digest):
+        self.buffer += digest
+        if len(self.buffer) >= CHUNK_SIZE * MerkleHasher.HASH_SIZE:
+            self.out.write(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        self.out.write(self.buffer)
+        self.out.close()
+
+
+def stream_merkle_root(source, leafFile=None, hashName='sha256', compat=False):
+    '''
+    函数功能：流式地为任意多的数据计算 Merkle 树根，占用的内存与数据量无关
+    leafFile 不为空时，把每个叶子的 hash（32 字节）依次写入该文件，
+    所有完全子树的树根（中间节点）按合并的顺序写入 leafFile + NODE_SUFFIX，之后可以用 stream_proof 生成证明
+    返回 (树根的 hash, 叶子数量)
+    '''
+    hasher = MerkleHasher(hashName, compat)
+    leafOut = nodeOut = None
+    if leafFile != None:
+        leafOut = ChunkWriter(leafFile)
+        nodeOut = ChunkWriter(leafFile + NODE_SUFFIX)
+    folder = MerkleFolder(hasher, nodeOut.write if nodeOut != None else None)
+    try:
+        for record in iter_records(source):
+            leafHash = hasher.leaf(record)
+            folder.push(leafHash)
+            if leafOut != None:
+                leafOut.write(leafHash)
+    finally:
+        if leafOut != None:
+            leafOut.close()
+            nodeOut.close()
+    return folder.root(), folder.count
+
+
+def read_leaf_hashes(f, first, count, hashSize=MerkleHasher.HASH_SIZE):
+    '''
+    函数功能：从叶子 hash 文件中分块读出第 first 个开始的 count 个叶子的 hash
+    '''
+    f.seek(first * hashSize)
+    while count > 0:
+        size = min(count, CHUNK_SIZE)
+        data = f.read(size * hashSize)
+        for start in range(0, len(data), hashSize):
+            yield data[start:start + hashSize]
+        count -= size
+
+
+def node_position(depth, pos):
+    '''
+    函数功能：第 depth 层（depth >= 1）第 pos 个完全子树的树根在中间节点文件中的位置
+    它在追加第 m = (pos+1)·2^depth 个叶子时合并出来，是这次追加的第 depth 次合并；
+    追加前 m-1 个叶子时一共合并了 (m-1) - popcount(m-1) 次
+    '''
+    m = (pos + 1) << depth
+    return (m - 1) - bin(m - 1).count('1') + depth - 1
+
+
+def read_node_hash(f, depth, pos, hashSize=MerkleHasher.HASH_SIZE):
+    f.seek(node_position(depth, pos) * hashSize)
+    return f.read(hashSize)
+
+
+def subtree_hash(hasher, leaves, nodes, depth, first, size):
+    '''
+    函数功能：第 first 个叶子开始的 size 个叶子构成的、高度为 depth 的子树的树根
+    size 按二进制拆成从大到小的完全子树，各自从文件中读出，再像流式构建一样合并
+    '''
+    folder = MerkleFolder(hasher)
+    for height in range(depth, -1, -1):
+        if size & (1 << height):
+            if height == 0:
+                folder.push(next(read_leaf_hashes(leaves, first, 1)))
+            else:
+                folder.push(read_node_hash(nodes, height, first >> height), height)
+            first += 1 << height
+    return folder.result(depth)[1]
+
+
+def stream_proof(leafFile, index, hashName='sha256', compat=False):
+    '''
+    函数功能：由 stream_merkle_root 写出的叶子 hash 文件，为第 index 个叶子生成 Merkle 证明
+    每一层的作证 hash 是相邻子树的树根：完整的子树直接从中间节点文件读出，
+    最右边不满的子树由 O(log n) 个完整的子树合并，一共读取 O(log² n) 个 hash；
+    没有中间节点文件（旧版本写出的叶子文件）时逐个子树从叶子流式计算，内存占用为 O(log n)
+    '''
+    hasher = MerkleHasher(hashName, compat)
+    count = os.path.getsize(leafFile) // hasher.HASH_SIZE
+    if index < 0 or index >= count:
+        return None
+    height = 1 if count == 1 else (count - 1).bit_length()
+    nodeFile = leafFile + NODE_SUFFIX
+    nodes = open(nodeFile, 'rb') if os.path.exists(nodeFile) else None
+
+    try:
+        with open(leafFile, 'rb') as f:
+            leafHash = next(read_leaf_hashes(f, index, 1))
+            path = []
+            for depth in range(height):
+                siblingIndex = (index >> depth) ^ 1
+                first = siblingIndex << depth
+                if first >= count:
+                    # 这一层的节点只有一个孩子
+                    path.append((None, False))
+                    continue
+                size = min(1 << depth, count - first)
+                if nodes != None:
+                    siblingHash = subtree_hash(hasher, f, nodes, depth, first, size)
+                else:
+                    folder = MerkleFolder(hasher)
+                    for siblingLeaf in read_leaf_hashes(f, first, size):
+                        folder.push(siblingLeaf)
+                    siblingHash = folder.result(depth)[1]
+                path.append((siblingHash, siblingIndex < (index >> depth)))
+    finally:
+        if nodes != None:
+            nodes.close()
+    return MerkleProof(leafHash, index, path, hashName, compat)
@@ -1,11 +1,96 @@
-from Crypto.Hash import SHA256
 from graphviz import Digraph
-from random import randint
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+import contextlib
 import copy
 import math
 import time
 
-from graphviz.dot import node
+from MerkleDot import DotWriter
+from MerkleHash import MerkleHasher
+from MerkleStats import TreeStats, CountingHasher, OPERATIONS
+from PrimePool import PrimePool
+from MerkleProof import MerkleProof, ConsistencyProof, MultiProof, NonMembershipProof, leaf_data, verify_proof
+
+
+TOMBSTONE = '†'  # 被删除的叶子（墓碑）显示的数据
+TOMBSTONE_PRIME = '1'  # 墓碑的素数为 1，不影响祖先节点的素数乘积
+# 有序模式下墓碑沿用左边最近的叶子的键，最左边的墓碑的键为 NO_KEY，见 bury_key
+NO_KEY = float('-inf')
+ABOVE_ROOT = 'above root'  # 比较高度不同的两棵树时，矮的树在树根上方的虚拟节点
+
+
+def hash_leaves(hashName, compat, payloads):
+    '''
+    函数功能：计算一批叶子的 hash（在子进程中运行）
+    '''
+    hasher = MerkleHasher(hashName, compat)
+    return [hasher.leaf(payload) for payload in payloads]
+
+
+def merge_levels(hashName, compat, hashes, height):
+    '''
+    函数功能：由同一层节点的 hash 逐层向上合并 height 层，落单的节点只对自己做 hash
+    返回包括最底层在内的 height+1 层（可以在子进程中运行）
+    '''
+    hasher = MerkleHasher(hashName, compat)
+    levels = [hashes]
+    for _ in range(height):
+        prev = levels[-1]
+        level = [hasher.node(prev[i], prev[i+1]) for i in range(0, len(prev)-1, 2)]
+        if len(prev) % 2 == 1:
+            level.append(hasher.node(prev[-1]))
+        levels.append(level)
+    return levels
+
+
+def split_chunks(items, chunkSize):
+    return [items[i:i+chunkSize] for i in range(0, len(items), chunkSize)]
+
+
+def parallel_hash_leaves(hasher, payloads, executor, workers):
+    '''
+    函数功能：把叶子分成若干段，在进程池中并行计算 hash
+    '''
+    chunks = split_chunks(payloads, max(1, math.ceil(len(payloads) / (workers * 4))))
+    hashes = []
+    for chunkHashes in executor.map(hash_leaves, [hasher.name]*len(chunks), [hasher.compat]*len(chunks), chunks):
+        hashes.extend(chunkHashes)
+    return hashes
+
+
+def parallel_levels(hasher, leafHashes, height, executor, workers):
+    '''
+    函数功能：并行构造高度为 height 的树的每一层
+    最底层按 2 的整数幂切成若干段，每一段是一棵独立的子树，在进程池中构造；
+    父进程只合并最上面的几层，结果与逐层串行合并完全相同
+    '''
+    chunkLevels = min(height, (workers * 4 - 1).bit_length())
+    chunkHeight = height - chunkLevels
+    chunks = split_chunks(leafHashes, 2**chunkHeight)
+    levels = [[] for _ in range(chunkHeight+1)]
+    for subLevels in executor.map(merge_levels, [hasher.name]*len(chunks), [hasher.compat]*len(chunks),
+                                  chunks, [chunkHeight]*len(chunks)):
+        for depth, level in enumerate(subLevels):
+            levels[depth].extend(level)
+    topLevels = merge_levels(hasher.name, hasher.compat, levels[chunkHeight], chunkLevels)
+    return levels + topLevels[1:]
+
+
+def prune_entries(log, generation):
+    '''
+    函数功能：修改记录（键 -> [(修改时的代数, 旧的值)]）中去掉第 generation 代及以前的记录
+    每个键的记录整体替换，不影响正在读它的快照
+    '''
+    for key in list(log):
+        entries = log[key]
+        if entries[0][0] <= generation:
+            kept = [entry for entry in entries if entry[0] > generation]
+            if len(kept) > 0:
+                log[key] = kept
+            else:
+                del log[key]
 
 
 class TreeNode:
@@ -14,10 +99,10 @@ class TreeNode:
     '''
 
     def __init__(self, value, leftNode=None, rightNode=None, hash=None, childNum=None, depth=None, id=None, father=None, primeNum=None, hashIsRight=True, generation=None,):
-        self.value = value              # 节点保存的数据
+        self.value = value              # 节点保存的数据（中间节点为 None，展示时再由叶子计算）
         self.leftNode = leftNode        # 节点的左孩子
         self.rightNode = rightNode      # 节点的右孩子
-        self.hash = hash                # hash值
+        self.hash = hash                # hash值（32 字节的原始摘要）
         self.childNum = childNum        # 节点拥有的孩子数量
         self.depth = depth              # 节点的高度
         self.id = id                    # 唯一的标号
@@ -27,9 +112,15 @@ class TreeNode:
         self.generation = generation    # 该节点的添加代
         # self.rm = rm
 
+    def __copy__(self):
+        node = TreeNode.__new__(TreeNode)
+        node.__dict__.update(self.__dict__)
+        return node
+
     def __str__(self):
         # 可以打印树中某个节点的信息
-        return 'Node(value='+self.value+', prime='+self.primeNum+', hash='+self.hash+')'
+        hash = self.hash.hex() if isinstance(self.hash, bytes) else str(self.hash)
+        return 'Node(value='+str(self.value)+', prime='+str(self.primeNum)+', hash='+hash+')'
 
 
 class MerkleTree:
@@ -39,77 +130,124 @@ class MerkleTree:
     二、查询某一个元素是否《不在》树上
     '''
 
-    def __init__(self):
+    stats = None  # 运行统计，enable_stats 开启后为 TreeStats
+    published = None  # 最近一次发布给读者的快照，见 publish
+    sealed = 0        # 已经发布的最新一代，这一代及以前的节点不再就地修改
+    writing = 0       # 正在执行的写操作的层数，见 batch
+    keepVersions = None  # 保留最近多少代的历史版本，None 表示全部保留，见 trim_versions
+    firstGeneration = 0  # 最早可以查询的版本，更早的版本已被 forget 丢弃
+
+    def __init__(self, primeProduct=False, hashName='sha256', compat=False, keepVersions=None):
         self.history = 1  # 创建节点的代数，初始化为第一代节点
+        self.keepVersions = keepVersions
+        # hash 算法：sha256 / blake2b / sha3 / blake3，compat=True 时与最初的十六进制拼接方式相同
+        self.hasher = MerkleHasher(hashName, compat)
         self.newNodes = []
-        self.root = TreeNode(
+        # 素数 -> 叶子在最底层的序号，查找叶子只需 O(1)
+        self.leafIndex = {}
+        # 素数索引中被修改、删除的条目修改前的位置，素数 -> [(修改时的代数, 旧的序号或 None)]
+        self.oldIndex = {}
+        # 中间节点是否保存孩子素数的乘积，默认关闭，打开后每次添加节点都要做大整数乘法
+        self.primeProduct = primeProduct
+        # 有序模式下按叶子顺序排列的键（int），用于二分查找，None 表示不是有序模式
+        self.sortedKeys = None
+        # 树上墓碑的数量，超过叶子数量的 compactRatio 时自动 compact
+        self.tombstones = 0
+        self.compactRatio = 0.5
+        # 叶子的素数由素数池依次分配，不再随机生成再做素性检验
+        self.primePool = PrimePool()
+        self.root = self.empty_root()
+        # 每一代结束时的树根，修改树时通过路径复制，旧的树根下的节点不再变化
+        self.versionGenerations = []
+        self.versionRoots = []
+        self.versionIndexes = []  # 每一代结束时的 (素数索引, 旧位置记录)
+        self.versionSizes = []    # 每一代结束时的 (段号, 叶子数量)，见 version_size
+        self.record_version()
+
+    def empty_root(self):
+        '''
+        函数功能：空树的树桩
+        树桩不是叶子，不占用素数池中的素数，叶子的素数与 ArrayMerkleTree 相同
+        '''
+        self.count_allocated(1)
+        return TreeNode(
             value='root',
-            hash='',
+            hash=b'',
             childNum=0,
             depth=0,
             id=str(time.time()),
             generation=self.history,
-            primeNum=self.generate_prime_number()
+            primeNum=None
         )
 
     def calculate_hash(self, data):
         '''
-        函数功能：计算hash值（SHA256）
-        '''
-        bytes_data = bytearray(data, "utf-8")
-        h = SHA256.new()
-        h.update(bytes_data)
-        return str(h.hexdigest())
-
-    def miller_rabin(self, p):
-        '''
-        函数功能：miller rabin 素性检验是一种素数判定法则，利用随机化算法判断一个数是合数还是可能是素数。
-        '''
-        if p == 1:
-            return False
-        if p == 2:
-            return True
-        if p % 2 == 0:
-            return False
-        m, k, = p - 1, 0
-        while m % 2 == 0:
-            m, k = m // 2, k + 1
-        a = randint(2, p - 1)
-        x = pow(a, m, p)
-        if x == 1 or x == p - 1:
-            return True
-        while k > 1:
-            x = pow(x, 2, p)
-            if x == 1:
-                return False
-            if x == p - 1:
-                return True
-            k = k - 1
-        return False
-
-    def is_prime(self, p, r=40):
-        '''
-        函数功能：判断是否是素数
-        '''
-        for _ in range(r):
-            if self.miller_rabin(p) == False:
-                return False
-        return True
-
-    def generate_prime_number(self, index=10):
-        '''
-        函数功能：生成一个素数
-        '''
-        num = 0
-        for _ in range(index):
-            num = num * 2 + randint(0, 1)
-        while self.is_prime(num) == False:
-            num = num + 1
-        return str(num)
-
-    def bulid_complete_binary_tree(self, treeNodeData):
+        函数功能：计算字符串的hash值，返回十六进制字符串
+        '''
+        return self.hasher.digest(data.encode('utf-8')).hex()
+
+    def enable_stats(self, callback=None):
+        '''
+        函数功能：开启运行统计，返回 TreeStats，用 stats.snapshot() 查看，callback 见 TreeStats
+        公开操作换成计时的版本（只对这棵树生效），hasher 换成计数的版本；
+        不开启时只在分配素数、遍历节点时多一次判断，没有其他开销
+        '''
+        if self.stats == None:
+            self.stats = TreeStats()
+            self.hasher = CountingHasher(self.stats, self.hasher.name, self.hasher.compat)
+            for name in OPERATIONS:
+                setattr(self, name, self.stats.wrap(name, getattr(self, name)))
+        if callback != None:
+            self.stats.subscribe(callback)
+        return self.stats
+
+    def disable_stats(self):
+        '''
+        函数功能：关闭运行统计，恢复原来的方法和 hasher
+        '''
+        if self.stats == None:
+            return
+        for name in OPERATIONS:
+            delattr(self, name)
+        self.hasher = MerkleHasher(self.hasher.name, self.hasher.compat)
+        self.stats = None
+
+    def count_traversed(self, count):
+        if self.stats != None:
+            self.stats.nodesTraversed += count
+
+    def count_allocated(self, count):
+        # 只统计这棵树创建的节点（包括复制的节点），其他树和线程创建的节点不计入
+        if self.stats != None:
+            self.stats.nodesAllocated += count
+
+    def new_prime(self, pending=()):
+        '''
+        函数功能：从素数池中分配一个树上和 pending 中都还没有使用过的素数
+        素数池按从小到大的顺序分配，只有调用者自己指定过的素数才会被跳过，O(1)
+        '''
+        while True:
+            newNodePrime = str(self.primePool.allocate())
+            if self.stats != None:
+                self.stats.primesAllocated += 1
+            if int(newNodePrime) not in self.leafIndex and newNodePrime not in pending:
+                return newNodePrime
+
+    def merge_prime(self, leftNode, rightNode=None):
+        '''
+        函数功能：中间节点的素数为孩子素数的乘积，不保存乘积时为 None
+        乘积保存为 int，叶子很多时乘积非常大，转换成字符串的开销是平方级的
+        '''
+        if self.primeProduct == False:
+            return None
+        if rightNode == None:
+            return leftNode.primeNum
+        return int(leftNode.primeNum)*int(rightNode.primeNum)
+
+    def bulid_complete_binary_tree(self, treeNodeData, executor=None, workers=1):
         '''
         功能：构造一颗完全二叉树
+        给定进程池 executor 时，所有中间节点的 hash 由 parallel_levels 并行计算
         '''
         # 如果给定构造的节点数据为空，返回 Merkle 树初始状态
         if len(treeNodeData) == 0:
@@ -119,53 +257,61 @@ class MerkleTree:
         treeDepth = math.ceil(math.log2(len(treeNodeData)))
 
         # 为整棵树补充需要的节点（将最后一个节点复制若干次）
+        self.count_allocated(2**treeDepth - len(treeNodeData))
         for _ in range(2**treeDepth - len(treeNodeData)):
             copyNodeString = treeNodeData[len(treeNodeData)-1].value
             copyNodeHash = treeNodeData[len(treeNodeData)-1].hash
             copyNode = TreeNode(
                 value=copyNodeString,
-                hash=self.calculate_hash(copyNodeHash),
+                hash=self.hasher.node(copyNodeHash),
                 depth=0,
                 childNum=0,
                 id=str(time.time()),
-                primeNum=self.generate_prime_number(),
+                primeNum=self.new_prime(),
                 generation=self.history,
             )
             treeNodeData.append(copyNode)
 
+        levels = None
+        if executor != None:
+            levels = parallel_levels(self.hasher, [node.hash for node in treeNodeData],
+                                     treeDepth, executor, workers)
+
         # 构造所有的中间节点 -> nodeQueue
         nodeQueue = []
         for index in range(0, len(treeNodeData), 2):
-            mergeStrings = treeNodeData[index].value + \
-                ' '+treeNodeData[index+1].value
-            hashString = self.calculate_hash(
-                treeNodeData[index].hash+treeNodeData[index+1].hash)
+            if levels != None:
+                hashString = levels[1][index//2]
+            else:
+                hashString = self.hasher.node(
+                    treeNodeData[index].hash, treeNodeData[index+1].hash)
             mergeNode = TreeNode(
-                value=mergeStrings,
+                value=None,
                 hash=hashString,
                 leftNode=treeNodeData[index],
                 rightNode=treeNodeData[index+1],
                 depth=1,
                 childNum=2,
                 id=str(time.time()),
-                primeNum=str(
-                    int(treeNodeData[index].primeNum)*int(treeNodeData[index+1].primeNum)),
+                primeNum=self.merge_prime(treeNodeData[index], treeNodeData[index+1]),
                 generation=self.history,
             )
             treeNodeData[index].father = mergeNode
             treeNodeData[index+1].father = mergeNode
             nodeQueue.append(mergeNode)
+        self.count_allocated(len(nodeQueue))
 
         # 逐层向上合并节点
         while len(nodeQueue) > 1:
             temp = []
             for index in range(0, len(nodeQueue), 2):
-                mergeStrings = nodeQueue[index].value + \
-                    ' '+nodeQueue[index+1].value
-                hashString = self.calculate_hash(
-                    nodeQueue[index].hash+nodeQueue[index+1].hash)
+                if levels != None:
+                    hashString = levels[nodeQueue[index].depth+1][index//2]
+                else:
+                    hashString = self.hasher.node(
+                        nodeQueue[index].hash, nodeQueue[index+1].hash)
                 mergeNode = TreeNode(
-                    value=mergeStrings,
+                    value=None,
                     hash=hashString,
                     depth=nodeQueue[index].depth+1,
                     childNum=nodeQueue[index].childNum +
@@ -173,58 +319,74 @@ class MerkleTree:
                     leftNode=nodeQueue[index],
                     rightNode=nodeQueue[index+1],
                     id=str(time.time()),
-                    primeNum=str(
-                        int(nodeQueue[index].primeNum)*int(nodeQueue[index+1].primeNum)),
+                    primeNum=self.merge_prime(nodeQueue[index], nodeQueue[index+1]),
                     generation=self.history,
                 )
                 nodeQueue[index].father = mergeNode
                 nodeQueue[index+1].father = mergeNode
                 temp.append(mergeNode)
+            self.count_allocated(len(temp))
 
             # 一棵完全2叉树构建完成
             nodeQueue = temp
         return nodeQueue[0]
 
-    def build_merkle_tree(self, nodeData, way='filling', sorted=False):
+    def build_merkle_tree(self, nodeData, way='filling', sorted=False, workers=None):
+        '''
+        参数：workers 大于 1 时，叶子和完全二叉树部分的 hash 在 workers 个进程中并行计算，
+             得到的树根与串行构建完全相同
+        '''
         if len(nodeData) == 0:
             print('INFO: 构建了个寂寞')
             return
 
+        with self.batch():
+            if workers != None and workers > 1:
+                with ProcessPoolExecutor(workers) as executor:
+                    return self.build_merkle_tree_with(nodeData, way, sorted, executor, workers)
+            return self.build_merkle_tree_with(nodeData, way, sorted)
+
+    def build_merkle_tree_with(self, nodeData, way='filling', sorted=False, executor=None, workers=1):
         # 将每一个节点数据构造节点
         if sorted == True:
             nodeData = [int(i) for i in nodeData]
             nodeData.sort()
+            self.sortedKeys = list(nodeData)
             nodeData = [str(i) for i in nodeData]
-
-        rootPrime = 1
+            # 有序模式下不补齐叶子，复制出来的节点会破坏叶子的顺序
+            way = 'imbalance'
+        else:
+            self.sortedKeys = None
+
+        # 重新构建时丢弃原来的叶子和历史版本
+        self.new_index()
+        self.versionGenerations = []
+        self.versionRoots = []
+        self.versionIndexes = []
+        self.versionSizes = []
+        self.tombstones = 0
         # 构造每一个叶子节点
         treeNodeData = []
+        usedPrimes = set()
         for data in nodeData:
-            while True:
-                newNodePrime = self.generate_prime_number()
-                if int(rootPrime) == 1:
-                    break
-                if int(rootPrime) % int(newNodePrime) == 0 and int(rootPrime) > int(newNodePrime):
-                    # print(newNodePrime, ' 重复！！')
-                    continue
-                else:
-                    break
-            rootPrime = str(int(rootPrime) * int(newNodePrime))
-            thisTime = str(time.time())
-            newNode = TreeNode(
-                value=data,
-                hash=self.calculate_hash(data+newNodePrime+thisTime),
-                depth=0,
-                childNum=0,
-                id=thisTime,
-                primeNum=newNodePrime,
-                generation=self.history,
-            )
+            newNode = self.make_leaf(data, usedPrimes, hashLeaf=executor == None)
+            usedPrimes.add(newNode.primeNum)
             treeNodeData.append(newNode)
+
+        if executor != None:
+            payloads = [self.leaf_payload(node.value, node.primeNum, node.id) for node in treeNodeData]
+            for node, hash in zip(treeNodeData, parallel_hash_leaves(self.hasher, payloads, executor, workers)):
+                node.hash = hash
+
+        for newNode in treeNodeData:
             print('INFO: 节点构造完成：', str(newNode))
 
+        # 只有一个叶子时没有需要补齐的节点，与不补齐的构造相同（与 ArrayMerkleTree 一致）
+        if way == 'filling' and len(treeNodeData) == 1:
+            way = 'imbalance'
+
         if way == 'filling':
-            self.root = self.bulid_complete_binary_tree(treeNodeData)
+            self.root = self.bulid_complete_binary_tree(treeNodeData, executor, workers)
             self.newNodes = [self.root]
 
         elif way == 'imbalance':
@@ -246,214 +408,667 @@ class MerkleTree:
             # print(len(treeNodeDataSub_1))
             # print(len(treeNodeDataSub_2))
 
-            self.root = self.bulid_complete_binary_tree(treeNodeDataSub_1)
-            # 将剩余的不足2的整数幂的节点，依次插入
-            for node in treeNodeDataSub_2:
-                self.insert(node, addAgain=True)
+            self.root = self.bulid_complete_binary_tree(treeNodeDataSub_1, executor, workers)
+            # 将剩余的不足2的整数幂的节点，一次性插入
+            self.insert_many(treeNodeDataSub_2, addAgain=True)
 
-    def add(self, Data):
-        self.history += 1
-        rootPrime = self.root.primeNum
-        # 构造每一个叶子节点
-        treeNodeData = []
-        while True:
-            newNodePrime = self.generate_prime_number()
-            if int(rootPrime) == 1:
-                break
-            if int(rootPrime) % int(newNodePrime) == 0 and int(rootPrime) > int(newNodePrime):
-                # print(newNodePrime, ' 重复！！')
-                continue
-            else:
-                break
-        rootPrime = str(int(rootPrime) * int(newNodePrime))
+        # 为叶子建立索引，filling 方式补充的复制节点也在 treeNodeData 中
+        for index, node in enumerate(treeNodeData):
+            self.leafIndex.setdefault(int(node.primeNum), index)
+        self.record_version()
+
+    def make_leaf(self, Data, pending=(), hashLeaf=True):
+        '''
+        函数功能：为数据构造一个叶子节点，它的素数与树上的叶子、pending 中还未插入的叶子都不重复
+        hashLeaf=False 时暂不计算叶子的 hash（由调用者批量计算）
+        '''
+        newNodePrime = self.new_prime(pending)
         thisTime = str(time.time())
+        self.count_allocated(1)
         newNode = TreeNode(
             value=Data,
-            hash=self.calculate_hash(Data+newNodePrime+thisTime),
+            hash=None,
             depth=0,
             childNum=0,
             id=thisTime,
             primeNum=newNodePrime,
             generation=self.history,
         )
-        treeNodeData.append(newNode)
-        for node in treeNodeData:
-            self.insert(node)
+        if hashLeaf:
+            newNode.hash = self.hasher.leaf(self.leaf_payload(Data, newNodePrime, thisTime))
+        return newNode
+
+    def leaf_payload(self, value, prime, id):
+        '''
+        函数功能：叶子被 hash 的数据，有序模式下各段带长度前缀（见 MerkleProof.leaf_data）
+        '''
+        return leaf_data(value, prime, id, self.sortedKeys != None)
+
+    def add(self, Data):
+        self.history += 1
+        newNode = self.make_leaf(Data)
+        if self.sortedKeys != None:
+            self.insert_sorted([newNode])
+        else:
+            self.insert(newNode)
 
         print('INFO: 节点构造完成：', str(newNode))
 
+    def add_many(self, Datas):
+        '''
+        函数功能：一次添加一批数据，整批数据属于同一代
+        先放好所有的叶子，再逐层向上，每个受影响的中间节点只计算一次 hash
+        '''
+        self.history += 1
+        treeNodeData = []
+        usedPrimes = set()
+        for Data in Datas:
+            newNode = self.make_leaf(Data, usedPrimes)
+            usedPrimes.add(newNode.primeNum)
+            treeNodeData.append(newNode)
+        if len(treeNodeData) == 0:
+            return
+        if self.sortedKeys != None:
+            self.insert_sorted(treeNodeData)
+        else:
+            self.insert_many(treeNodeData)
+
+        print('INFO: 批量添加完成：', len(treeNodeData), '个节点')
+
+    def insert_sorted(self, nodes):
+        '''
+        函数功能：有序模式下按键的顺序插入叶子
+        键都不小于已有的最大键时只需追加在最右边，每个叶子 O(log n)；
+        否则最靠左的插入点之前完整的子树原样保留，只重新构造从插入点开始的节点，
+        插入点之后的叶子依次后移，叶子本身不变，旧版本的树仍然完整
+        '''
+        nodes = sorted(nodes, key=lambda node: int(node.value))
+        self.newNodes = []
+        if len(self.sortedKeys) == 0 or int(nodes[0].value) >= self.sortedKeys[-1]:
+            self.sortedKeys.extend(int(node.value) for node in nodes)
+            self.insert_many(nodes, addAgain=True)
+            return
+
+        first = bisect_right(self.sortedKeys, int(nodes[0].value))
+        moved = [self.leaf_view(index) for index in range(first, self.leaf_count())]
+        for node in nodes:
+            index = bisect_right(self.sortedKeys, int(node.value))
+            self.sortedKeys.insert(index, int(node.value))
+            moved.insert(index - first, node)
+        self.keep_prefix(first)
+        for index, leaf in enumerate(moved, first):
+            self.set_index(leaf.primeNum, index)
+        self.insert_many(moved, addAgain=True)
+
+    def remove(self, prime):
+        '''
+        函数功能：删除素数为 prime 的叶子
+        叶子换成墓碑（hash 固定，素数为 1），只重新计算从它到树根的一条路径，O(log n)；
+        墓碑超过叶子数量的 compactRatio 时自动 compact()。有序模式下墓碑留在原位，不打乱键的顺序
+        '''
+        index = self.locate_leaf(prime)
+        if index == None:
+            print('INFO: 这棵树上没有这个叶子')
+            return
+        with self.batch():
+            self.history += 1
+            self.newNodes = []
+            self.bury(index)
+            self.drop_index(prime)
+            self.tombstones += 1
+            if self.tombstones > self.compactRatio * self.leaf_count():
+                self.compact()
+
+    def is_tombstone(self, index):
+        return self.ref_hash(self.leaf_path(index)[-1][0]) == self.hasher.tombstoneHash
+
+    def bury(self, index):
+        '''
+        函数功能：把第 index 个叶子换成墓碑
+        '''
+        self.count_allocated(1)
+        self.replace_leaves({index: TreeNode(
+            value=TOMBSTONE,
+            hash=self.hasher.tombstoneHash,
+            depth=0,
+            childNum=0,
+            id=str(time.time()),
+            primeNum=TOMBSTONE_PRIME,
+            generation=self.history,
+        )})
+        if self.sortedKeys != None:
+            self.bury_key(index)
+
+    def bury_key(self, index):
+        '''
+        函数功能：有序模式下第 index 个叶子变成墓碑之后修改它的键
+        墓碑沿用左边最近的叶子的键（左边没有叶子时为 NO_KEY），紧跟在后面沿用它的键的墓碑一起修改，
+        键的顺序不变，二分查找到的第一个等于 key 的位置总是叶子而不是墓碑
+        '''
+        keys = self.sortedKeys
+        oldKey = keys[index]
+        newKey = keys[index - 1] if index > 0 else NO_KEY
+        keys[index] = newKey
+        index += 1
+        while index < len(keys) and keys[index] == oldKey and self.leaf_view(index).value == TOMBSTONE:
+            keys[index] = newKey
+            index += 1
+
+    def update(self, prime, value):
+        '''
+        函数功能：修改素数为 prime 的叶子的数据
+        '''
+        self.update_many({prime: value})
+
+    def update_many(self, mapping):
+        '''
+        函数功能：修改一批叶子的数据（mapping 为 素数 -> 新的数据），整批修改属于同一代
+        叶子的素数和标号不变，只重新计算叶子的 hash，再自下而上每个受影响的祖先节点只计算一次，
+        k 个叶子共 k + (不同祖先的数量) 次 hash，而不是 k·log n
+        有序模式下键变化的叶子原来的位置换成墓碑，再按新的键插入
+        '''
+        nodes = {}
+        for prime, value in mapping.items():
+            index = self.locate_leaf(prime)
+            if index == None:
+                print('INFO: 这棵树上没有这个叶子：', prime)
+                return
+            leaf = self.leaf_view(index)
+            self.count_allocated(1)
+            nodes[index] = TreeNode(
+                value=value,
+                hash=self.hasher.leaf(self.leaf_payload(value, leaf.primeNum, leaf.id)),
+                depth=0,
+                childNum=0,
+                id=leaf.id,
+                primeNum=leaf.primeNum,
+                generation=self.history+1,
+            )
+        if len(nodes) == 0:
+            return
+        self.history += 1
+        self.newNodes = []
+
+        with self.batch():
+            moved = {}
+            if self.sortedKeys != None:
+                moved = {index: node for index, node in nodes.items() if int(node.value) != self.sortedKeys[index]}
+                nodes = {index: node for index, node in nodes.items() if index not in moved}
+            if len(nodes) > 0:
+                self.replace_leaves(nodes)
+            if len(moved) > 0:
+                for index, node in moved.items():
+                    self.bury(index)
+                    self.drop_index(node.primeNum)
+                    self.tombstones += 1
+                self.insert_sorted(list(moved.values()))
+                if self.tombstones > self.compactRatio * self.leaf_count():
+                    self.compact()
+
+            print('INFO: 批量修改完成：', len(mapping), '个节点')
+
+    def replace_leaves(self, nodes):
+        '''
+        函数功能：把一批叶子（nodes 为 叶子序号 -> 新的叶子节点）换成新的节点
+        所有路径的并集上的节点先换成副本（路径复制，这一代新建的节点直接修改），
+        再按高度自下而上，每个受影响的祖先节点只计算一次 hash
+        '''
+        copies = {}  # id(原来的节点) -> 副本
+        dirty = [[] for _ in range(self.tree_height() + 1)]
+        oldRoot = self.root
+        for index, child in nodes.items():
+            self.newNodes.append(child)
+            chain = [self.root] + [thisRef for thisRef, _, _ in self.leaf_path(index)]
+            oldChild = chain[-1]
+            for oldNode in reversed(chain[:-1]):
+                thisNode = copies.get(id(oldNode))
+                seen = thisNode != None
+                if not seen:
+                    thisNode = oldNode
+                    if not self.is_private(thisNode):
+                        thisNode = copy.copy(oldNode)
+                        self.count_allocated(1)
+                    copies[id(oldNode)] = thisNode
+                    dirty[thisNode.depth].append(thisNode)
+                if thisNode.leftNode is oldChild:
+                    thisNode.leftNode = child
+                else:
+                    thisNode.rightNode = child
+                if seen:
+                    # 上面的路径已经处理过
+                    break
+                oldChild, child = oldNode, thisNode
+
+        for depth in range(1, len(dirty)):
+            for thisNode in dirty[depth]:
+                for node in (thisNode.leftNode, thisNode.rightNode):
+                    if node != None:
+                        node.father = thisNode
+                if thisNode.rightNode != None:
+                    thisNode.hash = self.hasher.node(thisNode.leftNode.hash, thisNode.rightNode.hash)
+                else:
+                    thisNode.hash = self.hasher.node(thisNode.leftNode.hash)
+                thisNode.primeNum = self.merge_prime(thisNode.leftNode, thisNode.rightNode)
+                self.newNodes.append(thisNode)
+        self.root = copies[id(oldRoot)]
+        self.root.father = None
+        self.record_version()
+
+    def compact(self):
+        '''
+        函数功能：去掉所有的墓碑，后面的叶子依次前移
+        第一个墓碑之前完整的子树原样保留，只重新构造从第一个墓碑开始的节点，
+        叶子的 hash 不需要重新计算，旧版本的树仍然完整
+        '''
+        leaves = self.leaf_nodes()
+        first = 0
+        while first < len(leaves) and leaves[first].hash != self.hasher.tombstoneHash:
+            first += 1
+        if first == len(leaves):
+            return
+        moved = [leaf for leaf in leaves[first:] if leaf.hash != self.hasher.tombstoneHash]
+        if self.sortedKeys != None:
+            self.sortedKeys = self.sortedKeys[:first] + [int(leaf.value) for leaf in moved]
+        self.tombstones = 0
+        self.keep_prefix(first)
+        for index, leaf in enumerate(moved, first):
+            self.set_index(leaf.primeNum, index)
+        if len(moved) == 0:
+            self.record_version()
+            return
+        self.insert_many(moved, addAgain=True)
+
+    def keep_prefix(self, count):
+        '''
+        函数功能：只保留前 count 个叶子（不修改素数索引）
+        完整地落在前 count 个叶子中的子树原样保留，只重新构造最右边的一条路径，O(log² n)
+        '''
+        if count == 0:
+            self.root = self.empty_root()
+            return
+        height = max(1, math.ceil(math.log2(count)))
+
+        def subtree(depth, pos):
+            # 第 depth 层第 pos 个节点，覆盖第 pos·2^depth 个叶子开始的 2^depth 个叶子
+            if (pos + 1) << depth <= count and depth < self.tree_height():
+                return self.leaf_path(pos, depth)[-1][0]
+            leftNode = subtree(depth - 1, 2*pos)
+            rightNode = subtree(depth - 1, 2*pos + 1) if (2*pos + 1) << (depth - 1) < count else None
+            self.count_allocated(1)
+            thisNode = TreeNode(
+                value=None,
+                leftNode=leftNode,
+                rightNode=rightNode,
+                depth=depth,
+                childNum=min(1 << depth, count - (pos << depth)),
+                id=str(time.time()),
+                generation=self.history,
+            )
+            for node in (leftNode, rightNode):
+                if node != None:
+                    node.father = thisNode
+            if rightNode != None:
+                thisNode.hash = self.hasher.node(leftNode.hash, rightNode.hash)
+            else:
+                thisNode.hash = self.hasher.node(leftNode.hash)
+            thisNode.primeNum = self.merge_prime(leftNode, rightNode)
+            self.newNodes.append(thisNode)
+            return thisNode
+
+        self.root = subtree(height, 0)
+        self.root.father = None
+
+    def leaf_nodes(self):
+        '''
+        函数功能：按从左到右的顺序返回所有的叶子节点
+        '''
+        level = [self.root] if self.leaf_count() > 0 else []
+        for _ in range(self.tree_height()):
+            level = [child for node in level for child in (node.leftNode, node.rightNode) if child != None]
+            self.count_traversed(len(level))
+        return level
+
+    def right_spine(self):
+        '''
+        函数功能：沿着树的最右边从树根走到最右边的叶子
+        返回的列表按高度排列：rightSpine[d] 是高度为 d 的最右边的节点，rightSpine[-1] 是树根
+        '''
+        rightSpine = []
+        thisNode = self.root
+        while thisNode != None:
+            rightSpine.append(thisNode)
+            if thisNode.rightNode:
+                thisNode = thisNode.rightNode
+            else:
+                thisNode = thisNode.leftNode
+        rightSpine.reverse()
+        self.count_traversed(len(rightSpine))
+        return rightSpine
+
+    def insert_many(self, nodes, addAgain=False):
+        '''
+        函数功能：在树的最右边依次添加多个叶子，结果与逐个 insert 相同
+        叶子在最底层的位置是连续的，每一层受影响的节点也是连续的一段，
+        从下往上逐层构造或更新这些节点，每个节点只计算一次 hash
+        '''
+        if addAgain == False:
+            self.newNodes = []
+        if len(nodes) == 0:
+            return
+
+        rightSpine = self.current_spine()
+        # 原来最右边的节点会被就地更新，先换成副本
+        self.copy_spine(rightSpine, 1)
+
+        # 原有的叶子数量（空树只有一个树桩）
+        oldCount = self.root.childNum if self.root.depth > 0 else 0
+        total = oldCount + len(nodes)
+        treeDepth = max(1, math.ceil(math.log2(total)))
+
+        # 本层受影响的节点：位置 -> 节点
+        dirty = {}
+        for offset, node in enumerate(nodes):
+            dirty[oldCount + offset] = node
+            if node.hash != self.hasher.tombstoneHash:
+                self.leafIndex.setdefault(int(node.primeNum), oldCount + offset)
+            self.newNodes.append(node)
+        newSpine = [nodes[-1]]
+
+        for depth in range(1, treeDepth+1):
+            # 下一层中不受影响、但可能被用作孩子的节点只有原来最右边的那一个
+            oldChild = None
+            if oldCount > 0 and depth-1 < len(rightSpine):
+                oldChild = rightSpine[depth-1]
+            oldChildPos = (oldCount-1) >> (depth-1)
+
+            parents = {}
+            for pos in range(min(dirty) >> 1, (max(dirty) >> 1) + 1):
+                if oldCount > 0 and depth < len(rightSpine) and pos == (oldCount-1) >> depth:
+                    # 原来最右边的节点，就地更新，不受影响的孩子保持不变
+                    thisNode = rightSpine[depth]
+                    leftNode = dirty.get(2*pos, thisNode.leftNode)
+                    rightNode = dirty.get(2*pos+1, thisNode.rightNode)
+                else:
+                    # 新的节点，不受影响的孩子只可能是原来最右边的节点（例如原来的树根）
+                    self.count_allocated(1)
+                    thisNode = TreeNode(
+                        value=None,
+                        depth=depth,
+                        id=str(time.time()),
+                        generation=self.history,
+                    )
+                    self.newNodes.append(thisNode)
+                    leftNode = dirty.get(2*pos)
+                    if leftNode == None and 2*pos == oldChildPos:
+                        leftNode = oldChild
+                    rightNode = dirty.get(2*pos+1)
+
+                thisNode.leftNode = leftNode
+                thisNode.rightNode = rightNode
+                leftNode.father = thisNode
+                if rightNode != None:
+                    rightNode.father = thisNode
+                    thisNode.hash = self.hasher.node(leftNode.hash, rightNode.hash)
+                    thisNode.primeNum = self.merge_prime(leftNode, rightNode)
+                else:
+                    thisNode.hash = self.hasher.node(leftNode.hash)
+                    thisNode.primeNum = self.merge_prime(leftNode)
+                thisNode.childNum = min(2**depth, total - pos * 2**depth)
+                parents[pos] = thisNode
+
+            dirty = parents
+            newSpine.append(dirty[max(dirty)])
+
+        self.root = newSpine[-1]
+        self.root.father = None
+        self.rightSpine = newSpine
+        self.record_version()
+
+    def current_spine(self):
+        '''
+        函数功能：返回当前树最右边的路径
+        树根被替换过（例如重新构建了整棵树）时，需要重新找到最右边的路径
+        '''
+        if getattr(self, 'rightSpine', None) == None or self.rightSpine[-1] != self.root:
+            self.rightSpine = self.right_spine()
+        return self.rightSpine
+
+    def build_right_branch(self, node, depth):
+        '''
+        函数功能：在叶子上方构造高度为 depth 的右分支（每个节点只有左孩子）
+        返回从叶子到分支顶端的所有节点
+        '''
+        branch = [node]
+        newright = node
+        for _ in range(depth):
+            self.count_allocated(1)
+            newright_temp = TreeNode(
+                value=None,
+                hash=self.hasher.node(newright.hash),
+                depth=newright.depth+1,
+                leftNode=newright,
+                childNum=1,
+                id=str(time.time()),
+                primeNum=self.merge_prime(newright),
+                generation=self.history,
+            )
+            self.newNodes.append(newright_temp)
+            newright.father = newright_temp
+            newright = newright_temp
+            branch.append(newright)
+        return branch
+
     def insert(self, node, addAgain=False):
+        '''
+        函数功能：在树的最右边添加一个叶子
+        只需要维护树最右边的一条路径（rightSpine），找到其中最低的不满的节点，
+        在它的右边挂上新的右分支，再沿着这条路径向上更新，每次添加只需 O(log n) 次 hash
+        '''
         if addAgain == False:
             self.newNodes = []
         self.newNodes.append(node)
-        canNodes = []
-        searchQueue = []
-        thisNode = self.root
-        if 2**(thisNode.depth) != thisNode.childNum:
-            # 说明这个节点是不够的
-            searchQueue.append(self.root)
-            while len(searchQueue) != 0:
-                thisNode = searchQueue[0]
-                searchQueue.pop(0)
-                # print(str(thisNode))
-                if thisNode.leftNode == None or thisNode.rightNode == None and thisNode.depth != 0:
-                    # print('check', str(thisNode))
-                    canNodes.append(thisNode)
-
-                if thisNode.rightNode and thisNode.rightNode.depth != 0 and 2**thisNode.rightNode.depth != thisNode.rightNode.childNum:
-                    searchQueue.append(thisNode.rightNode)
-                if thisNode.leftNode and thisNode.leftNode.depth != 0 and 2**thisNode.leftNode.depth != thisNode.leftNode.childNum:
-                    searchQueue.append(thisNode.leftNode)
-
-                # print('满足条件的孩子',[i.depth for i in searchQueue])
-            thisNode = canNodes[len(canNodes)-1]
-        # print('##################')
-        # print(str(thisNode))
-        # print('##################')
-        if thisNode == self.root:
-            #######################################
-            # 原先的树已经满了，需要构建新的根，和右分支 #
-            # 分两种情况：                          #
-            # 一、原先的树不是“满”，而是完全没有       #
-            # 二、第一步完成之后完全缺失右子树         #
-            # 二、满树                             #
-            #######################################
-
-            if thisNode.value == 'root':
-                # 第一种情况 原先的树不是“满”，而是完全没有
-                # 构造新树根
-                newRoot = TreeNode(
-                    value=node.value,
-                    hash=self.calculate_hash(node.hash),
-                    depth=node.depth+1,
-                    childNum=node.childNum+1,
-                    leftNode=node,
-                    rightNode=None,
-                    id=str(time.time()),
-                    primeNum=str(int(node.primeNum)),
-                    generation=self.history,
-                )
-                node.father = newRoot
-                self.root = newRoot  # 移植成功
-                # 记录新加入的节点
-                self.newNodes.append(newRoot)
-                return
-
-            elif thisNode.depth == 1 and thisNode.rightNode == None:
-                # 第二种情况 第一步完成之后完全缺失右子树
-                thisNode.value = thisNode.value+' '+node.value
-                thisNode.hash = self.calculate_hash(
-                    thisNode.leftNode.hash+node.hash)
-                thisNode.childNum += 1
-                thisNode.primeNum = str(
-                    int(thisNode.primeNum)*int(node.primeNum))
-
-                thisNode.rightNode = node
-                node.father = thisNode
-                return
 
-            # 第三  种情况 满树
-            nowTreeDepth = thisNode.depth
-            newright = node
-            for _ in range(nowTreeDepth):
-                newright_temp = TreeNode(
-                    value=node.value,
-                    hash=self.calculate_hash(newright.hash),
-                    depth=newright.depth+1,
-                    leftNode=newright,
-                    childNum=1,
-                    id=str(time.time()),
-                    primeNum=newright.primeNum,
-                    generation=self.history,
-                )
-                self.newNodes.append(newright_temp)
-                newright.father = newright_temp
-                newright = newright_temp
-            # 循环结束 构建右分支完成，并进行添加
+        rightSpine = self.current_spine()
+        # 新叶子的序号就是原有的叶子数量（空树的树桩 childNum 为 0）
+        self.leafIndex.setdefault(int(node.primeNum), self.root.childNum)
 
+        thisNode = self.root
+        if thisNode.depth == 0:
+            # 第一种情况 原先的树不是“满”，而是完全没有
             # 构造新树根
+            self.count_allocated(1)
+            newRoot = TreeNode(
+                value=None,
+                hash=self.hasher.node(node.hash),
+                depth=node.depth+1,
+                childNum=node.childNum+1,
+                leftNode=node,
+                rightNode=None,
+                id=str(time.time()),
+                primeNum=self.merge_prime(node),
+                generation=self.history,
+            )
+            node.father = newRoot
+            self.root = newRoot  # 移植成功
+            # 记录新加入的节点
+            self.newNodes.append(newRoot)
+            self.rightSpine = [node, newRoot]
+            self.record_version()
+            return
+
+        if 2**(thisNode.depth) == thisNode.childNum:
+            # 第二种情况 满树：构建同样高度的右分支，和原先的树合并成新的树根
+            branch = self.build_right_branch(node, thisNode.depth)
+            newright = branch[-1]
+            self.count_allocated(1)
             newRoot = TreeNode(
-                value=thisNode.value+' '+newright.value,
-                hash=self.calculate_hash(thisNode.hash+newright.hash),
+                value=None,
+                hash=self.hasher.node(thisNode.hash, newright.hash),
                 depth=thisNode.depth+1,
                 childNum=thisNode.childNum+newright.childNum,
                 leftNode=thisNode,
                 rightNode=newright,
                 id=str(time.time()),
-                primeNum=str(int(thisNode.primeNum)*int(newright.primeNum)),
+                primeNum=self.merge_prime(thisNode, newright),
                 generation=self.history,
             )
             self.newNodes.append(newRoot)
             thisNode.father = newRoot
             newright.father = newRoot
             self.root = newRoot  # 移植成功
+            self.rightSpine = branch + [newRoot]
+            self.record_version()
+            return
 
-        else:
-            #######################################
-            # 在右分支上进行添加节点，补充整棵树        #
-            # 分两种情况：                          #
-            # 1. 在左叶子节点的旁边直接添加右叶子节点   #
-            # 2. 添加右边的分支，然后作为其左叶子节点添加#
-            #######################################
-
-            # 第一种情况 直接添加
-            if thisNode != None and thisNode.depth == 1:
-                if thisNode.leftNode == None:
-                    thisNode.leftNode = node
+        # 第三种情况 不满：最右边路径上最低的不满的节点只有左孩子，为它补上右分支
+        depth = 1
+        while 2**depth == rightSpine[depth].childNum:
+            depth += 1
+        # 路径复制：要修改的节点先换成副本，旧版本的树保持不变
+        self.copy_spine(rightSpine, depth)
+        thisNode = rightSpine[depth]
+        branch = self.build_right_branch(node, depth-1)
+        thisNode.rightNode = branch[-1]
+        branch[-1].father = thisNode
+        rightSpine[:depth] = branch
+
+        # 沿着最右边的路径向上更新
+        for thisNode in rightSpine[depth:]:
+            if thisNode.rightNode != None:
+                thisNode.hash = self.hasher.node(thisNode.leftNode.hash, thisNode.rightNode.hash)
+            else:
+                thisNode.hash = self.hasher.node(thisNode.leftNode.hash)
+            thisNode.childNum += 1
+            thisNode.primeNum = self.merge_prime(thisNode.leftNode, thisNode.rightNode)
+        self.record_version()
+
+    def copy_spine(self, rightSpine, depth):
+        '''
+        函数功能：路径复制，把最右边路径上高度不低于 depth 的节点换成副本，之后只修改副本
+        旧版本的树根仍然指向原来的节点，没有变化的子树由新旧版本共享
+        这一代新建的、还没有发布的节点不属于任何旧版本，直接修改即可
+        '''
+        oldBelow = newBelow = None
+        for d in range(depth, len(rightSpine)):
+            oldNode = rightSpine[d]
+            if self.is_private(oldNode):
+                newNode = oldNode
+            else:
+                newNode = copy.copy(oldNode)
+                self.count_allocated(1)
+            if newBelow is not oldBelow:
+                if newNode.rightNode is oldBelow:
+                    newNode.rightNode = newBelow
                 else:
-                    thisNode.rightNode = node
-                node.father = thisNode
+                    newNode.leftNode = newBelow
+            if newNode is not oldNode:
+                for child in (newNode.leftNode, newNode.rightNode):
+                    if child != None:
+                        child.father = newNode
+            rightSpine[d] = newNode
+            oldBelow, newBelow = oldNode, newNode
+        self.root = rightSpine[-1]
+
+    def record_version(self):
+        '''
+        函数功能：记录这一代的树根，同一代内多次修改只保留最后的树根
+        '''
+        if len(self.versionGenerations) > 0 and self.versionGenerations[-1] == self.history:
+            self.versionRoots[-1] = self.root
+            self.versionIndexes[-1] = (self.leafIndex, self.oldIndex)
+            self.versionSizes[-1] = self.version_size(len(self.versionSizes) - 2)
+        else:
+            self.versionGenerations.append(self.history)
+            self.versionRoots.append(self.root)
+            self.versionIndexes.append((self.leafIndex, self.oldIndex))
+            self.versionSizes.append(self.version_size(len(self.versionSizes) - 1))
+            self.trim_versions()
+        if self.writing == 0:
+            self.publish()
+
+    def version_size(self, previous):
+        '''
+        函数功能：当前版本的 (段号, 叶子数量)，previous 为上一个版本的位置
+        叶子数量比上一个版本少（compact、截短）时开始新的一段，同一段内叶子数量不会减少，
+        所以所有版本的 (段号, 叶子数量) 是有序的，可以按叶子数量二分查找版本
+        '''
+        count = self.leaf_count()
+        if previous < 0:
+            return (0, count)
+        segment, previousCount = self.versionSizes[previous]
+        return (segment + 1 if count < previousCount else segment, count)
 
-            # 第二种情况 先构建右分支（左延伸）
-            if thisNode != None and thisNode.depth != 1:
+    def trim_versions(self):
+        '''
+        函数功能：设置了 keepVersions 时只保留最近 keepVersions 代的版本
+        旧版本累积到两倍时才清理一次，清理的开销分摊到每一代
+        '''
+        if self.keepVersions != None and len(self.versionGenerations) >= 2 * max(1, self.keepVersions):
+            self.forget(self.versionGenerations[-max(1, self.keepVersions)])
 
-                if thisNode.rightNode == None:
-                    nowTreeDepth = thisNode.leftNode.depth
-                else:
-                    nowTreeDepth = thisNode.rightNode.depth
-
-                newright = node
-                for _ in range(nowTreeDepth):
-                    newright_temp = TreeNode(
-                        value=node.value,
-                        hash=self.calculate_hash(newright.hash),
-                        depth=newright.depth+1,
-                        leftNode=newright,
-                        childNum=1,
-                        id=str(time.time()),
-                        primeNum=newright.primeNum,
-                        generation=self.history,
-                    )
-                    self.newNodes.append(newright_temp)
-                    newright.father = newright_temp
-                    newright = newright_temp
-                # 循环结束 构建右分支完成，并进行添加
+    def forget(self, generation):
+        '''
+        函数功能：丢掉早于第 generation 代的版本，之后 at() 只能查询第 generation 代及以后的版本
+        只被旧版本的树根引用的节点副本随之释放，素数索引中只有旧版本才用得到的修改记录也一起清理
+        '''
+        position = bisect_right(self.versionGenerations, generation) - 1
+        if position <= 0:
+            return
+        del self.versionGenerations[:position]
+        del self.versionRoots[:position]
+        del self.versionIndexes[:position]
+        del self.versionSizes[:position]
+        # 最早的版本之前的修改记录不会再被用到（快照只使用晚于自己这一代的记录）
+        self.firstGeneration = self.versionGenerations[0]
+        logs = {id(oldIndex): oldIndex for _, oldIndex in self.versionIndexes + [(None, self.oldIndex)]}
+        for oldIndex in logs.values():
+            prune_entries(oldIndex, self.firstGeneration)
+
+    def is_private(self, node):
+        '''
+        函数功能：节点是否可以就地修改：这一代新建的、还没有发布给读者的节点
+        其他节点属于旧版本或者已经发布的版本，读者可能正在读，只能换成副本再修改
+        '''
+        return node.generation == self.history and self.sealed < self.history
 
-                if thisNode.rightNode == None:
-                    thisNode.rightNode = newright
-                else:
-                    thisNode.leftNode = newright
-
-                newright.father = thisNode
-
-            while thisNode != None:
-                MergeString = ''
-                MergeHash = ''
-                MergePrime = 1
-                if thisNode.leftNode != None:
-                    MergeString = thisNode.leftNode.value
-                    MergeHash = thisNode.leftNode.hash
-                    MergePrime = int(thisNode.leftNode.primeNum)
-                if thisNode.rightNode != None:
-                    MergeString = MergeString + ' ' + thisNode.rightNode.value
-                    MergeHash = MergeHash + thisNode.rightNode.hash
-                    MergePrime = MergePrime * int(thisNode.rightNode.primeNum)
+    def publish(self):
+        '''
+        函数功能：把当前的树根作为新的只读快照发布给读者，发布只是一次属性赋值，读者要么看到旧的快照、要么看到新的快照
+        发布之后这个快照下的节点不再被修改（修改时路径复制），读者线程不需要加锁；
+        father 指针不属于快照，读者只沿着孩子向下走
+        '''
+        self.sealed = self.history
+        self.published = MerkleSnapshot(self, self.root, self.history, self.leafIndex, self.oldIndex)
+
+    def latest(self):
+        '''
+        函数功能：最近一次发布的快照，可以在多个读者线程中与一个写者线程并发地 search、生成证明
+        用 snapshot.root_hash() 验证这个快照生成的证明
+        '''
+        return self.published
 
-                thisNode.value = MergeString
-                thisNode.hash = self.calculate_hash(MergeHash)
-                thisNode.childNum += 1
-                thisNode.primeNum = str(MergePrime)
-                thisNode = thisNode.father
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        函数功能：一次写操作分成多步修改树时（例如删除后 compact），只在最后发布一次，读者看不到中间状态
+        '''
+        self.writing += 1
+        try:
+            yield
+        finally:
+            self.writing -= 1
+            if self.writing == 0:
+                self.publish()
+
+    def at(self, generation):
+        '''
+        函数功能：返回第 generation 代结束时的树的只读快照，可以在上面 search、生成证明
+        快照与当前的树共享没有变化的节点，不复制整棵树
+        '''
+        position = bisect_right(self.versionGenerations, generation) - 1
+        if position < 0:
+            raise ValueError('没有第 ' + str(generation) + ' 代的版本')
+        return MerkleSnapshot(self, self.versionRoots[position], generation, *self.versionIndexes[position])
 
     def merkle_path(self, proofPath):
         '''
@@ -475,13 +1090,10 @@ class MerkleTree:
 
         thisNode = thisNode.father
         while thisNode != None:
-            mergeHash = ''
-            if thisNode.leftNode:
-                mergeHash = thisNode.leftNode.hash
             if thisNode.rightNode:
-                mergeHash = mergeHash + thisNode.rightNode.hash
-
-            mergeHash = self.calculate_hash(mergeHash)
+                mergeHash = self.hasher.node(thisNode.leftNode.hash, thisNode.rightNode.hash)
+            else:
+                mergeHash = self.hasher.node(thisNode.leftNode.hash)
             if thisNode.hash == mergeHash:
                 thisNode.hashIsRight = True
             else:
@@ -498,57 +1110,441 @@ class MerkleTree:
             dot.attr(label=r'\nMerkle tree has been modified')
         return dot
 
-    def search(self, prime, showNode=False):
-        # 保证数据类型正确
-        prime = int(prime)
+    def tree_height(self):
+        return self.root.depth
 
-        # 复制这棵树
-        proofNode = copy.deepcopy(self.root)
-        proofPath = proofNode
+    def leaf_count(self):
+        # 空树只有一个树桩
+        return self.root.childNum if self.root.depth > 0 else 0
 
-        thisNode = self.root
-        if int(thisNode.primeNum) % prime == 0:
-
-            # 如果是 叶子节点 就退出循环
-            while thisNode.leftNode or thisNode.rightNode:
-
-                if thisNode.leftNode and int(thisNode.leftNode.primeNum) % int(prime) == 0:
-                    thisNode = thisNode.leftNode
-
-                    if proofNode.rightNode:
-                        proofNode.rightNode.leftNode = None
-                        proofNode.rightNode.rightNode = None
-                        proofNode.rightNode.value = 'Ref Hash'
-                    proofNode.value = '✱'
-                    proofNode = proofNode.leftNode
-
-                elif thisNode.rightNode and int(thisNode.rightNode.primeNum) % int(prime) == 0:
-                    thisNode = thisNode.rightNode
-
-                    if proofNode.leftNode:
-                        proofNode.leftNode.leftNode = None
-                        proofNode.leftNode.rightNode = None
-                        proofNode.leftNode.value = 'Ref Hash'
-                    proofNode.value = '✱'
-                    proofNode = proofNode.rightNode
-                else:
-                    break
-            proofNode.value = 'Target'
-            proofPath.value = 'Root'
+    @staticmethod
+    def open(path):
+        '''
+        函数功能：打开保存在磁盘上的树（见 MappedMerkleTree），不需要重新构建
+        '''
+        from MappedMerkleTree import MappedMerkleTree
+        return MappedMerkleTree.open(path)
 
-        else:
-            thisNode = None
-            proofPath = None
-            print('INFO: 这棵树上没有这个叶子')
+    def root_hash(self):
+        return self.root.hash
 
-        return thisNode, proofPath
+    def root_ref(self):
+        '''
+        函数功能：树根的引用
+        root_ref / child_refs / ref_hash / ref_view 屏蔽了节点的存储方式，
+        证明等算法只通过它们访问节点，MerkleTree 中节点的引用就是 TreeNode 本身
+        '''
+        return self.root
 
-    def tampering_test(self, proofPath, Index):
-        if proofPath == None:
-            print('INFO: 请检查验证路径的合理性')
-            return
+    def child_refs(self, ref):
+        return ref.leftNode, ref.rightNode
 
-        proofPath = copy.deepcopy(proofPath)
+    def ref_hash(self, ref):
+        return ref.hash
+
+    def ref_view(self, ref, value):
+        '''
+        函数功能：复制一个节点（不带孩子），用于构造 Merkle 路径
+        '''
+        node = copy.copy(ref)
+        self.count_allocated(1)
+        node.leftNode = None
+        node.rightNode = None
+        node.father = None
+        node.value = value
+        return node
+
+    def ref_node(self, ref):
+        '''
+        函数功能：用于展示的节点（中间节点的 value 为 None，展示时由叶子得到）
+        '''
+        return ref
+
+    def ref_name(self, ref):
+        # 节点在图中的名字
+        return ref.id
+
+    def ref_generation(self, ref):
+        return ref.generation
+
+    def locate_leaf(self, prime):
+        '''
+        函数功能：根据素数找到叶子在最底层的序号，不在树上返回 None
+        '''
+        return self.leafIndex.get(int(prime))
+
+    def new_index(self):
+        '''
+        函数功能：叶子重新排列之前换成新的素数索引，旧版本仍然使用原来的索引
+        '''
+        self.leafIndex = {}
+        self.oldIndex = {}
+
+    def save_old_index(self, prime):
+        '''
+        函数功能：修改素数索引中的条目之前保存旧的位置，快照由此查到自己那一代的位置
+        在末尾追加叶子时不需要保存：新的序号不小于任何快照的叶子数量，快照不会用到它
+        '''
+        entries = self.oldIndex.setdefault(int(prime), [])
+        if len(entries) == 0 or entries[-1][0] != self.history:
+            entries.append((self.history, self.leafIndex.get(int(prime))))
+
+    def set_index(self, prime, index):
+        if int(prime) == int(TOMBSTONE_PRIME):
+            # 墓碑不在素数索引中
+            return
+        self.save_old_index(prime)
+        self.leafIndex[int(prime)] = index
+
+    def drop_index(self, prime):
+        if int(prime) in self.leafIndex:
+            self.save_old_index(prime)
+            del self.leafIndex[int(prime)]
+
+    def leaf_view(self, index):
+        # 第 index 个叶子
+        return self.leaf_path(index)[-1][0]
+
+    def key_index(self):
+        '''
+        函数功能：有序模式下按叶子顺序排列的键，用于二分查找
+        '''
+        if self.sortedKeys == None:
+            raise ValueError('只有有序模式（build_merkle_tree(sorted=True)）的树才能按键查找')
+        return self.sortedKeys
+
+    def locate_key(self, key):
+        '''
+        函数功能：有序模式下二分查找键为 key 的叶子，返回叶子的序号，不在树上返回 None
+        '''
+        keys = self.key_index()
+        index = bisect_left(keys, int(key))
+        if index < len(keys) and keys[index] == int(key):
+            return index
+        return None
+
+    def leaf_witness(self, index):
+        '''
+        函数功能：叶子的数据（用于重新计算叶子的 hash）和它的 Merkle 证明
+        '''
+        leaf = self.leaf_view(index)
+        return leaf.value, leaf.primeNum, leaf.id, self.proof_by_index(index)
+
+    def non_membership_proof(self, key):
+        '''
+        函数功能：有序模式下证明 key《不在》树上
+        二分查找夹住 key 的两个叶子，证明中包含它们的数据和审计路径，以及夹在它们之间的墓碑的审计路径
+        key 比所有的键都小（大）时只有右边（左边）的叶子，审计路径说明它前面（后面）只有墓碑
+        可以用 MerkleProof.verify_non_membership(mt.root_hash(), proof) 验证
+        '''
+        keys = self.key_index()
+        key = int(key)
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            print('INFO: 这个键在树上')
+            return None
+        leftIndex = index - 1
+        while leftIndex >= 0 and self.is_tombstone(leftIndex):
+            leftIndex -= 1
+        left = self.leaf_witness(leftIndex) if leftIndex >= 0 else None
+        right = self.leaf_witness(index) if index < len(keys) else None
+        gap = [self.proof_by_index(i) for i in range(leftIndex + 1, index)]
+        return NonMembershipProof(key, left, right, self.hasher.name, self.hasher.compat, gap)
+
+    def leaf_path(self, index, depth=0):
+        '''
+        函数功能：从树根走到第 index 个叶子（depth 大于 0 时走到第 depth 层第 index 个节点）
+        返回自上而下每一层的 (路径上的节点, 作证节点, 作证节点是否在左边)，最后一项是目标节点
+        '''
+        path = []
+        thisRef = self.root_ref()
+        for d in range(self.tree_height(), depth, -1):
+            leftRef, rightRef = self.child_refs(thisRef)
+            if (index >> (d-1-depth)) & 1:
+                thisRef, siblingRef, siblingIsLeft = rightRef, leftRef, True
+            else:
+                thisRef, siblingRef, siblingIsLeft = leftRef, rightRef, False
+            path.append((thisRef, siblingRef, siblingIsLeft))
+        self.count_traversed(len(path) + 1)
+        return path
+
+    def get_proof(self, prime):
+        '''
+        函数功能：生成证明叶子存在的 Merkle 证明，只访问从树根到叶子的一条路径
+        可以用 MerkleProof.verify_proof(mt.root_hash(), proof) 验证
+        '''
+        index = self.locate_leaf(prime)
+        if index == None:
+            print('INFO: 这棵树上没有这个叶子')
+            return None
+        return self.proof_by_index(index)
+
+    def proof_by_index(self, index):
+        path = self.leaf_path(index)
+        proofPath = []
+        for _, siblingRef, siblingIsLeft in reversed(path):
+            if siblingRef == None:
+                proofPath.append((None, False))
+            else:
+                proofPath.append((self.ref_hash(siblingRef), siblingIsLeft))
+        return MerkleProof(self.ref_hash(path[-1][0]), index, proofPath,
+                           self.hasher.name, self.hasher.compat)
+
+    def multiproof(self, keys):
+        '''
+        函数功能：为多个叶子（keys 为叶子的素数，与 get_proof 相同）生成一个合并的 Merkle 证明
+        自上而下只走一遍所有路径的并集，证明中只包含这些路径旁边、验证者算不出来的作证 hash，
+        大小和验证时间与涉及的子树数量成正比，而不是 k·log n
+        可以用 MerkleProof.verify_multiproof(mt.root_hash(), proof) 验证
+        '''
+        indices = set()
+        for key in keys:
+            index = self.locate_leaf(key)
+            if index == None:
+                print('INFO: 这棵树上没有这个叶子：', key)
+                return None
+            indices.add(index)
+        indices = sorted(indices)
+
+        # levelRefs[d]：第 d 层在路径上的节点，位置 -> 引用
+        height = self.tree_height()
+        levelRefs = [None] * (height + 1)
+        levelRefs[height] = {0: self.root_ref()}
+        for depth in range(height, 0, -1):
+            children = {}
+            for pos in sorted(set(index >> (depth-1) for index in indices)):
+                leftRef, rightRef = self.child_refs(levelRefs[depth][pos >> 1])
+                children[pos] = rightRef if pos & 1 else leftRef
+            levelRefs[depth-1] = children
+
+        # 自下而上，兄弟节点也在路径上的不需要作证 hash
+        hashes = []
+        for depth in range(height):
+            for pos in sorted(levelRefs[depth]):
+                if pos ^ 1 in levelRefs[depth]:
+                    continue
+                leftRef, rightRef = self.child_refs(levelRefs[depth+1][pos >> 1])
+                siblingRef = leftRef if pos & 1 else rightRef
+                if siblingRef != None:
+                    hashes.append(self.ref_hash(siblingRef))
+        leafHashes = [self.ref_hash(levelRefs[0][index]) for index in indices]
+        return MultiProof(indices, leafHashes, hashes, self.leaf_count(),
+                          self.hasher.name, self.hasher.compat)
+
+    def version_of_size(self, size, generation=None):
+        '''
+        函数功能：找到叶子数量为 size 的最近一代（不晚于第 generation 代）的快照
+        在最后一段（上一次叶子数量减少之后）的版本中按记录的叶子数量二分查找，
+        修改、删除叶子不影响查找，O(log n)
+        '''
+        if generation == None and size == self.leaf_count():
+            return self
+        end = len(self.versionGenerations)
+        if generation != None:
+            end = bisect_right(self.versionGenerations, generation)
+        if end > 0:
+            segment = self.versionSizes[end - 1][0]
+            position = bisect_right(self.versionSizes, (segment, size), 0, end) - 1
+            if position >= 0 and self.versionSizes[position] == (segment, size):
+                return MerkleSnapshot(self, self.versionRoots[position], self.versionGenerations[position],
+                                      *self.versionIndexes[position])
+        raise ValueError('没有叶子数量为 ' + str(size) + ' 的版本')
+
+    def consistency_proof(self, oldSize, newSize=None):
+        '''
+        函数功能：生成一致性证明，证明 oldSize 个叶子的旧树是 newSize 个叶子的新树的前缀
+        newSize 默认为当前的叶子数量，否则使用叶子数量为 newSize 的历史版本
+        旧树由若干棵完全子树组成，它们在新树中不会再变化；
+        证明就是其中最右边的一棵在新树中的审计路径，左边的作证节点正好是旧树的其余部分
+        可以用 MerkleProof.verify_consistency(oldRoot, newRoot, proof) 验证
+        '''
+        tree = self if newSize == None else self.version_of_size(newSize)
+        newSize = tree.leaf_count()
+        if oldSize < 0 or oldSize > newSize:
+            raise ValueError('旧树的叶子数量必须在 0 到 ' + str(newSize) + ' 之间')
+        hashes = []
+        if oldSize == 0 or oldSize == newSize:
+            return ConsistencyProof(oldSize, newSize, hashes, self.hasher.name, self.hasher.compat)
+
+        # 旧树最右边的完全子树
+        depth = (oldSize & -oldSize).bit_length() - 1
+        index = (oldSize >> depth) - 1
+        path = tree.leaf_path(index, depth)
+        if oldSize != 1 << depth or oldSize == 1:
+            # 子树就是旧树的树根时，验证者已经知道它的 hash
+            hashes.append(tree.ref_hash(path[-1][0]))
+        for _, siblingRef, _ in reversed(path):
+            if siblingRef != None:
+                hashes.append(tree.ref_hash(siblingRef))
+        return ConsistencyProof(oldSize, newSize, hashes, self.hasher.name, self.hasher.compat)
+
+    def top_ref(self, height):
+        '''
+        函数功能：第 height 层第 0 个节点的引用，比树高时为树根上方的虚拟节点，空树为 None
+        '''
+        if self.leaf_count() == 0:
+            return None
+        if height == self.tree_height():
+            return self.root_ref()
+        return ABOVE_ROOT
+
+    def diff_children(self, ref, depth):
+        '''
+        函数功能：diff 中第 depth 层节点的左右孩子，虚拟节点只有左孩子
+        '''
+        if ref == None or depth == 0:
+            return None, None
+        if ref is ABOVE_ROOT:
+            return self.top_ref(depth - 1), None
+        return self.child_refs(ref)
+
+    def diff(self, other):
+        '''
+        函数功能：与另一棵树（可以是另一种存储方式的树或历史版本）比较，
+        按从左到右的顺序给出内容不同的叶子的范围 (first, last)（闭区间），相邻的范围合并为一个
+        同一位置上的节点 hash 相同时，下面的叶子完全相同，不再向下比较；只在一棵树上存在的子树整段给出，
+        有 k 处不同时只访问 O(k log n) 个节点
+        '''
+        if (self.hasher.name, self.hasher.compat) != (other.hasher.name, other.hasher.compat):
+            raise ValueError('两棵树使用的 hash 算法不同，无法比较')
+        height = max(self.tree_height(), other.tree_height())
+        pending = None
+        visited = 0
+        stack = [(height, 0, self.top_ref(height), other.top_ref(height))]
+        while len(stack) != 0:
+            depth, index, thisRef, otherRef = stack.pop()
+            visited += 1
+            if thisRef == None and otherRef == None:
+                continue
+            if thisRef != None and otherRef != None and thisRef is not ABOVE_ROOT and otherRef is not ABOVE_ROOT \
+                    and self.ref_hash(thisRef) == other.ref_hash(otherRef):
+                continue
+            if thisRef == None or otherRef == None or depth == 0:
+                # 只在一棵树上存在的子树，或者不同的叶子
+                count = max(self.leaf_count(), other.leaf_count())
+                first, last = index << depth, min((index + 1) << depth, count) - 1
+                if pending != None and pending[1] + 1 == first:
+                    pending = (pending[0], last)
+                else:
+                    if pending != None:
+                        yield pending
+                    pending = (first, last)
+                continue
+            thisLeft, thisRight = self.diff_children(thisRef, depth)
+            otherLeft, otherRight = other.diff_children(otherRef, depth)
+            # 先处理左孩子，范围按从左到右的顺序给出
+            stack.append((depth - 1, 2 * index + 1, thisRight, otherRight))
+            stack.append((depth - 1, 2 * index, thisLeft, otherLeft))
+        self.count_traversed(visited)
+        if pending != None:
+            yield pending
+
+    def sync(self, source):
+        '''
+        函数功能：让这棵树（副本）与 source 的叶子完全相同，只从 source 取出 diff 得到的叶子，
+        替换不同的叶子、追加多出来的叶子，source 更短时先截短，整次同步属于同一代
+        返回从 source 取出的叶子数量，同步之后两棵树的树根 hash 相同
+        '''
+        ranges = list(self.diff(source))
+        if len(ranges) == 0:
+            return 0
+        count = source.leaf_count()
+        self.history += 1
+        self.newNodes = []
+        with self.batch():
+            if count < self.leaf_count():
+                self.shrink(count)
+
+            changed = {}
+            appended = []
+            for first, last in ranges:
+                for index in range(first, min(last, count - 1) + 1):
+                    leaf = source.leaf_view(index)
+                    self.count_allocated(1)
+                    node = TreeNode(
+                        value=leaf.value,
+                        hash=leaf.hash,
+                        depth=0,
+                        childNum=0,
+                        id=leaf.id,
+                        primeNum=leaf.primeNum,
+                        generation=self.history,
+                    )
+                    if index < self.leaf_count():
+                        changed[index] = node
+                    else:
+                        appended.append(node)
+
+            for index, node in changed.items():
+                oldLeaf = self.leaf_view(index)
+                if oldLeaf.hash == self.hasher.tombstoneHash:
+                    self.tombstones -= 1
+                elif self.leafIndex.get(int(oldLeaf.primeNum)) == index:
+                    self.drop_index(oldLeaf.primeNum)
+            if len(changed) > 0:
+                self.replace_leaves(changed)
+            if len(appended) > 0:
+                self.insert_many(appended, addAgain=True)
+            for index, node in list(changed.items()) + list(enumerate(appended, count - len(appended))):
+                if node.hash == self.hasher.tombstoneHash:
+                    self.tombstones += 1
+                else:
+                    self.set_index(node.primeNum, index)
+            if self.sortedKeys != None:
+                keys = LeafKeys(self)
+                self.sortedKeys = [keys[index] for index in range(len(keys))]
+            self.drop_index(TOMBSTONE_PRIME)
+            print('INFO: 同步完成：', sum(last - first + 1 for first, last in ranges), '个叶子')
+            return len(changed) + len(appended)
+
+    def shrink(self, count):
+        '''
+        函数功能：只保留前 count 个叶子，由它们重新构造中间节点（叶子的 hash 不重新计算）
+        '''
+        leaves = self.leaf_nodes()[:count]
+        self.tombstones = sum(1 for leaf in leaves if leaf.hash == self.hasher.tombstoneHash)
+        if self.sortedKeys != None:
+            del self.sortedKeys[count:]
+        self.root = self.empty_root()
+        self.new_index()
+        if len(leaves) == 0:
+            self.record_version()
+            return
+        self.insert_many(leaves, addAgain=True)
+        self.drop_index(TOMBSTONE_PRIME)
+
+    def search(self, prime, showNode=False):
+        index = self.locate_leaf(prime)
+        if index == None:
+            print('INFO: 这棵树上没有这个叶子')
+            return None, None
+
+        # 只复制从树根到叶子的路径，以及路径旁边作证的节点
+        proofPath = self.ref_view(self.root_ref(), 'Root')
+        proofNode = proofPath
+        thisRef = None
+        for thisRef, siblingRef, siblingIsLeft in self.leaf_path(index):
+            child = self.ref_view(thisRef, '✱')
+            child.father = proofNode
+            sibling = None
+            if siblingRef != None:
+                sibling = self.ref_view(siblingRef, 'Ref Hash')
+                sibling.father = proofNode
+            if siblingIsLeft:
+                proofNode.leftNode, proofNode.rightNode = sibling, child
+            else:
+                proofNode.leftNode, proofNode.rightNode = child, sibling
+            proofNode = child
+        proofNode.value = 'Target'
+
+        return thisRef, proofPath
+
+    def tampering_test(self, proofPath, Index):
+        if proofPath == None:
+            print('INFO: 请检查验证路径的合理性')
+            return
+
+        proofPath = copy.deepcopy(proofPath)
         queue = [proofPath]
         count = 0
         thisNode = None
@@ -559,7 +1555,7 @@ class MerkleTree:
                 count += 1
             if count == Index:
                 thisNode.value = 'Modified'
-                thisNode.hash = 'chaos'
+                thisNode.hash = b'chaos'
                 break
             if thisNode.leftNode:
                 queue.append(thisNode.leftNode)
@@ -571,44 +1567,186 @@ class MerkleTree:
         allPrime = []
         queue = [self.root]
         thisNode = None
+        visited = 0
         while len(queue) != 0:
             thisNode = queue[0]
             queue.pop(0)
-            if thisNode.leftNode == None and thisNode.rightNode == None:
+            visited += 1
+            if thisNode.leftNode == None and thisNode.rightNode == None and thisNode.hash != self.hasher.tombstoneHash:
                 allPrime.append(thisNode.primeNum)
             if thisNode.leftNode:
                 queue.append(thisNode.leftNode)
             if thisNode.rightNode:
                 queue.append(thisNode.rightNode)
+        self.count_traversed(visited)
         return allPrime
 
-    def compare(self, showHistory=False):
-        dot = self.show()
+    def compare(self, showHistory=False, maxDepth=None, around=None, window=0, since=None, path=None):
+        '''
+        参数：maxDepth / around / window / since / path 与 show 相同，只为展示出来的节点上色
+        '''
+        if self.leaf_count() == 0:
+            return self.show(path=path)
         if showHistory == False:
-            for node in self.newNodes:
-                dot.node(node.id, _attributes={'fillcolor': '#FFCDD2'})
+            newRefs = set(self.newNodes)
+
+            def colorOf(ref):
+                return '#FFCDD2' if ref in newRefs else '#FFFFFF'
         else:
             allColor = ['#FFCDD2', '#FFE0B2', '#FFF9C4',
                         '#C8E6C9', '#B2EBF2', '#BBDEFB', '#E1BEE7']
-            queue = [self.root]
-            thisNode = None
-            while len(queue) != 0:
-                thisNode = queue[0]
-                queue.pop(0)
-                dot.node(thisNode.id, _attributes={
-                    'fillcolor': allColor[abs(thisNode.generation-self.history) % len(allColor)]
-                }
-                )
-                if thisNode.leftNode:
-                    queue.append(thisNode.leftNode)
-                if thisNode.rightNode:
-                    queue.append(thisNode.rightNode)
-        return dot
 
+            def colorOf(ref):
+                return allColor[abs(self.ref_generation(ref)-self.history) % len(allColor)]
+        return self.show_tree(True, None, maxDepth, around, window, since, path, colorOf)
+
+
+    def leaf_range(self, node):
+        '''
+        函数功能：找到节点下面最左边和最右边的叶子
+        '''
+        first = node
+        while first.leftNode:
+            first = first.leftNode
+        last = node
+        while last.leftNode or last.rightNode:
+            if last.rightNode:
+                last = last.rightNode
+            else:
+                last = last.leftNode
+        return first, last
+
+    def node_label(self, node_i):
+        '''
+        函数功能：可视化时节点上显示的文字
+        '''
+        # 现将节点所包含的树叶的个数加进去
+        nodeString = 'childs: ' + str(node_i.childNum)
+
+        # 中间节点不保存数据，只在展示时由首尾两个叶子得到
+        value = node_i.value
+        if value == None:
+            first, last = self.leaf_range(node_i)
+            value = first.value
+            if first != last:
+                value = first.value + ' ~ ' + last.value
+
+        # 如果节点的 value 太长，这样不利于显示，所以 “掐头去尾” 的显示
+        if len(value) > 8:
+            strings = str(value).split(' ')
+            strsL = len(strings)-1
+            nodeString = strings[0] + ' ~ ' + \
+                strings[strsL] + '\n' + nodeString
+        else:
+            nodeString = value + '\n' + nodeString
+        return nodeString
+
+    def show_depth(self, dot, depth, levels=None):
+        '''
+        函数功能：在图的左侧标注树的高度，levels 不为空时只标注最上面的 levels+1 层
+        '''
+        rows = depth if levels == None else min(depth, levels)
+        for i in range(rows+1):
+            dot.node(
+                name=str(i),
+                label='depth : '+str(depth-i),
+                _attributes={'color': '#FFFFFF'})
+
+        for i in range(rows):
+            dot.edge(str(i), str(i+1), _attributes={'arrowhead': 'none', 'color': '#FFFFFF'})
 
-    def show(self, node=0, proof=False, showDepth=True, showMinDepth=False, string=None):
+    def node_ref(self, depth, index):
+        '''
+        函数功能：第 depth 层第 index 个节点的引用，这个位置没有节点时返回 None
+        '''
+        height = self.tree_height()
+        if self.leaf_count() == 0 or depth > height or index >= (self.leaf_count() + (1 << depth) - 1) >> depth:
+            return None
+        if depth == height:
+            return self.root_ref()
+        return self.leaf_path(index, depth)[-1][0]
+
+    def show_tree(self, showDepth=True, string=None, maxDepth=None, around=None, window=0, since=None,
+                  path=None, colorOf=None):
+        '''
+        函数功能：自上而下逐层展示整棵树，只展开需要展示的子树，其他子树折叠成一个灰色的节点
+        节点 (depth, index) 覆盖第 index<<depth 到 (index+1)<<depth 个叶子，满足以下条件时折叠：
+        在树根下面 maxDepth 层或更深；与 around 前后 window 个叶子没有交集；与第 since 代相比 hash 相同
+        生成图的开销只与展示出来的节点数有关，例如按 around 展示时为 O(window + log n)
+        '''
+        first, last = 0, self.leaf_count() - 1
+        if around != None:
+            index = self.locate_leaf(around)
+            if index == None:
+                print('INFO: 这棵树上没有这个叶子')
+                return None
+            first, last = max(first, index - window), min(last, index + window)
+        old = self.at(since) if since != None else None
+
+        dot = DotWriter(path) if path != None else Digraph(name='MerkleTree', format='png')
+        height = self.tree_height()
+        if showDepth:
+            self.show_depth(dot, height, maxDepth)
+
+        queue = [(self.root_ref(), height, 0)]
+        while len(queue) != 0:
+            temp = []
+            self.count_traversed(len(queue))
+            for ref, depth, index in queue:
+                nodeString = self.node_label(self.ref_node(ref))
+                node_color = '#FFFFFF' if colorOf == None else colorOf(ref)
+                style = 'filled'
+
+                collapsed = None
+                if depth > 0:
+                    if maxDepth != None and height - depth >= maxDepth:
+                        collapsed = '...'
+                    elif index << depth > last or (index + 1) << depth <= first:
+                        collapsed = '...'
+                    elif old != None:
+                        oldRef = old.node_ref(depth, index)
+                        if oldRef != None and old.ref_hash(oldRef) == self.ref_hash(ref):
+                            collapsed = '未变化'
+                if collapsed != None:
+                    nodeString += '\n' + collapsed
+                    node_color = '#E0E0E0'
+                    style = 'filled,dashed'
+
+                dot.node(
+                    name=self.ref_name(ref),
+                    label=nodeString,
+                    style=style,
+                    fillcolor=node_color)
+                if collapsed != None:
+                    continue
+
+                leftRef, rightRef = self.child_refs(ref) if depth > 0 else (None, None)
+                for childRef, childIndex in ((leftRef, 2 * index), (rightRef, 2 * index + 1)):
+                    if childRef != None:
+                        temp.append((childRef, depth - 1, childIndex))
+                        dot.edge(self.ref_name(ref), self.ref_name(childRef))
+            queue = temp
+
+        if string:
+            dot.attr(label=r'\n'+string)
+        if path != None:
+            dot.close()
+            return path
+        return dot
+
+    def show(self, node=0, proof=False, showDepth=True, showMinDepth=False, string=None,
+             maxDepth=None, around=None, window=0, since=None, path=None):
+        '''
+        参数：以下参数只在展示整棵树时有效（见 show_tree），叶子很多时只展示其中的一部分
+             maxDepth 只展开树根下面 maxDepth 层
+             around 只展开素数为 around 的叶子前后 window 个叶子所在的子树
+             since 与第 since 代相比没有变化的子树折叠成一个节点
+             path 不为空时不在内存中构造 Digraph，而是把 DOT 边生成边写入文件 path，返回 path
+        '''
         # 默认值为展示整棵树
         if node == 0:
+            if self.leaf_count() > 0 and proof == False and showMinDepth == False:
+                return self.show_tree(showDepth, string, maxDepth, around, window, since, path)
             node = self.root
 
         # 如果输入不合法，直接返回
@@ -621,14 +1759,7 @@ class MerkleTree:
         # 展示树的高度
         if showDepth:
             # 标注树的高度
-            for i in range(node.depth+1):
-                dot.node(
-                    name=str(i),
-                    label='depth : '+str(node.depth-i),
-                    _attributes={'color': '#FFFFFF'})
-
-            for i in range(node.depth):
-                dot.edge(str(i), str(i+1), _attributes={'arrowhead': 'none', 'color': '#FFFFFF'})
+            self.show_depth(dot, node.depth)
 
         # 使用层次遍历
         queue = [node]
@@ -637,19 +1768,10 @@ class MerkleTree:
         while len(queue) != 0:
             # temp 变量用于存储 某一层（depth=i）的所有节点信息
             temp = []
+            self.count_traversed(len(queue))
 
             for node_i in queue:
-                # 现将节点所包含的树叶的个数加进去
-                nodeString = 'childs: ' + str(node_i.childNum)
-
-                # 如果节点的 value 太长，这样不利于显示，所以 “掐头去尾” 的显示
-                if len(node_i.value) > 8:
-                    strings = str(node_i.value).split(' ')
-                    strsL = len(strings)-1
-                    nodeString = strings[0] + ' ~ ' + \
-                        strings[strsL] + '\n' + nodeString
-                else:
-                    nodeString = node_i.value + '\n' + nodeString
+                nodeString = self.node_label(node_i)
 
                 # 可视化节点的默认颜色
                 node_color = '#FFFFFF'
@@ -724,3 +1846,691 @@ class MerkleTree:
                 dot.attr(label=r'\n'+string)
                 
         return dot
+
+
+class ArrayMerkleTree(MerkleTree):
+    '''
+    数组存储的 Merkle 树
+    每一层节点的 hash 值按 32 字节定长连续存放在 bytearray 中，叶子为第 0 层
+    第 d 层第 i 个节点的孩子是第 d-1 层的 2i 和 2i+1 号节点（右孩子可能不存在）
+    叶子数据、素数、标号、添加代等信息保存在与之平行的数组中
+    不再为每个节点创建 TreeNode 对象，也没有 father 形成的循环引用
+    对外提供与 MerkleTree 相同的 build_merkle_tree / add / search / show 接口
+    '''
+
+    HASH_SIZE = 32  # 每个 hash 值占用的字节数
+    verbose = False  # 构建时是否逐个打印叶子，叶子很多时打印比构建本身还慢
+
+    def __init__(self, hashName='sha256', compat=False, keepVersions=None, verbose=False):
+        self.history = 1  # 创建节点的代数，初始化为第一代节点
+        self.keepVersions = keepVersions
+        self.verbose = verbose
+        self.hasher = MerkleHasher(hashName, compat)
+        self.sortedKeys = None
+        self.compactRatio = 0.5
+        self.primePool = PrimePool()
+        self.reset()
+
+    def reset(self):
+        '''
+        函数功能：清空整棵树
+        '''
+        self.newNodes = []                # 最近一次新增的节点 (depth, index)
+        self.levels = [bytearray()]       # levels[d]：第 d 层所有节点的 hash
+        self.generations = [array('I')]   # 与 levels 平行：每个节点的添加代
+        self.values = []                  # 叶子节点保存的数据
+        self.primes = array('Q')          # 叶子节点的素数
+        self.ids = array('d')             # 叶子节点的唯一标号（创建时间）
+        self.paddings = bytearray()       # 叶子是否为补齐用的复制节点
+        self.leafIndex = {}               # 素数 -> 叶子下标
+        # 写时复制：节点被覆盖前的 hash，(depth, index) -> [(覆盖时的代数, 旧的 hash)]
+        self.oldHashes = {}
+        self.oldLeaves = {}                  # 叶子下标 -> [(覆盖时的代数, 旧的叶子数据)]
+        self.oldIndex = {}                   # 素数 -> [(修改时的代数, 旧的叶子下标或 None)]
+        self.firstGeneration = self.history  # 最早可以查询的版本
+        self.tombstones = 0                  # 墓碑的数量
+
+    def leaf_count(self):
+        return len(self.values)
+
+    def tree_height(self, count=None):
+        '''
+        函数功能：count 个叶子构成的树的高度
+        只有一个叶子时，树根是它的单孩子父节点，高度为 1
+        '''
+        if count is None:
+            count = self.leaf_count()
+        if count <= 1:
+            return count
+        return (count - 1).bit_length()
+
+    def get_hash(self, depth, index):
+        '''
+        函数功能：读取第 depth 层第 index 个节点的 hash（32 字节）
+        '''
+        start = index * self.HASH_SIZE
+        return bytes(self.levels[depth][start:start + self.HASH_SIZE])
+
+    def level_size(self, depth):
+        return len(self.levels[depth]) // self.HASH_SIZE
+
+    def set_hash(self, depth, index, digest):
+        '''
+        函数功能：写入第 depth 层第 index 个节点的 hash
+        如果该节点还不存在，就追加在这一层的末尾，并记录为新增的节点
+        '''
+        while len(self.levels) <= depth:
+            self.levels.append(bytearray())
+            self.generations.append(array('I'))
+        if index == self.level_size(depth):
+            self.levels[depth] += digest
+            self.generations[depth].append(self.history)
+            self.newNodes.append((depth, index))
+        else:
+            self.save_old_hash(depth, index)
+            start = index * self.HASH_SIZE
+            self.levels[depth][start:start + self.HASH_SIZE] = digest
+
+    def save_old_hash(self, depth, index):
+        '''
+        函数功能：覆盖节点之前保存旧的 hash，旧版本的快照仍然可以读到它
+        这一代新建的节点、这一代已经保存过的节点不需要再保存
+        '''
+        if self.generations[depth][index] == self.history:
+            return
+        entries = self.oldHashes.setdefault((depth, index), [])
+        if len(entries) == 0 or entries[-1][0] != self.history:
+            entries.append((self.history, self.get_hash(depth, index)))
+
+    def at(self, generation):
+        '''
+        函数功能：返回第 generation 代结束时的树的只读快照，可以在上面 search、生成证明
+        叶子只会追加，快照只需要记住当时的叶子数量，被覆盖过的节点从 oldHashes 中读出
+        '''
+        if generation < self.firstGeneration:
+            raise ValueError('没有第 ' + str(generation) + ' 代的版本')
+        return ArraySnapshot(self, generation)
+
+    def version_of_size(self, size, generation=None):
+        '''
+        函数功能：找到叶子数量为 size 的最近一代（不晚于第 generation 代）的快照
+        叶子只会追加，第 size+1 个叶子添加之前的那一代就是叶子数量为 size 的最后一代
+        '''
+        count = self.leaf_count()
+        if generation == None:
+            if size == count:
+                return self
+            generation = self.history
+        if 0 <= size <= count:
+            last = generation if size == count else min(generation, self.generations[0][size] - 1)
+            if last >= self.firstGeneration:
+                snapshot = self.at(last)
+                if snapshot.leaf_count() == size:
+                    return snapshot
+        raise ValueError('没有叶子数量为 ' + str(size) + ' 的版本')
+
+    def trim_versions(self):
+        '''
+        函数功能：设置了 keepVersions 时只保留最近 keepVersions 代的版本，累积到两倍时清理一次
+        '''
+        keep = self.keepVersions
+        if keep != None and self.history - self.firstGeneration + 1 >= 2 * max(1, keep):
+            self.forget(self.history - max(1, keep) + 1)
+
+    def forget(self, generation):
+        '''
+        函数功能：丢掉早于第 generation 代的版本：只有更早的快照才用得到的旧 hash、旧叶子和索引记录
+        '''
+        if generation <= self.firstGeneration:
+            return
+        self.firstGeneration = min(generation, self.history)
+        for log in (self.oldHashes, self.oldLeaves, self.oldIndex):
+            prune_entries(log, self.firstGeneration)
+
+    def publish(self):
+        # 数组是就地修改的，没有不可变的树根可以发布
+        pass
+
+    def latest(self):
+        raise TypeError('ArrayMerkleTree 就地修改数组，不支持无锁的并发读，多线程读写时请使用 MerkleTree')
+
+    def rehash(self, depth, index):
+        '''
+        函数功能：由第 depth-1 层的孩子重新计算第 depth 层第 index 个节点的 hash
+        '''
+        left = self.get_hash(depth - 1, 2 * index)
+        if 2 * index + 1 < self.level_size(depth - 1):
+            digest = self.hasher.node(left, self.get_hash(depth - 1, 2 * index + 1))
+        else:
+            digest = self.hasher.node(left)
+        self.set_hash(depth, index, digest)
+
+    def append_leaf(self, value, digest, prime, id, padding=False):
+        '''
+        函数功能：在叶子层末尾追加一个叶子，返回叶子的下标
+        '''
+        index = len(self.values)
+        self.values.append(value)
+        self.primes.append(int(prime))
+        self.ids.append(float(id))
+        self.paddings.append(1 if padding else 0)
+        self.set_hash(0, index, digest)
+        if digest != self.hasher.tombstoneHash:
+            self.leafIndex.setdefault(int(prime), index)
+        return index
+
+    def leaf_record(self, index):
+        '''
+        函数功能：第 index 个叶子的 (数据, hash, 素数, 标号, 是否为补齐节点)，可以直接传给 append_leaf / set_leaf
+        '''
+        return (self.values[index], self.get_hash(0, index), self.primes[index],
+                self.ids[index], self.paddings[index] == 1)
+
+    def set_leaf(self, index, value, digest, prime, id, padding=False):
+        '''
+        函数功能：覆盖第 index 个叶子（不更新祖先节点和素数索引），覆盖前保存旧的叶子供旧版本读取
+        '''
+        self.save_old_leaf(index)
+        self.values[index] = value
+        self.primes[index] = int(prime)
+        self.ids[index] = float(id)
+        self.paddings[index] = 1 if padding else 0
+        self.set_hash(0, index, digest)
+
+    def save_old_leaf(self, index):
+        if self.generations[0][index] == self.history:
+            return
+        entries = self.oldLeaves.setdefault(index, [])
+        if len(entries) == 0 or entries[-1][0] != self.history:
+            entries.append((self.history, (self.values[index], self.primes[index],
+                                           self.ids[index], self.paddings[index])))
+
+    def update_path(self, index):
+        '''
+        函数功能：从第 index 个叶子出发，逐层向上重新计算祖先节点的 hash
+        树满了之后新叶子的祖先会作为新节点追加在各层末尾，相当于 insert 中构造的右分支
+        '''
+        self.update_range(index, index)
+
+    def update_range(self, first, last):
+        '''
+        函数功能：第 first 到 last 个叶子发生变化后，逐层向上重新计算受影响的节点
+        每一层受影响的节点是连续的一段，每个节点只计算一次 hash
+        '''
+        self.trim_versions()
+        for depth in range(1, self.tree_height() + 1):
+            for index in range(first >> depth, (last >> depth) + 1):
+                self.rehash(depth, index)
+
+    def build_levels(self, executor=None, workers=1):
+        '''
+        函数功能：由叶子层逐层向上构造所有的中间节点
+        给定进程池 executor 时，由 parallel_levels 并行计算
+        '''
+        if executor != None:
+            leafHashes = [self.get_hash(0, index) for index in range(len(self.values))]
+            levels = parallel_levels(self.hasher, leafHashes, self.tree_height(), executor, workers)
+            self.levels = [bytearray(b''.join(level)) for level in levels]
+            self.generations = [array('I', [self.history]) * len(level) for level in levels]
+            return
+
+        del self.levels[1:]
+        del self.generations[1:]
+        for depth in range(1, self.tree_height() + 1):
+            for index in range((self.level_size(depth - 1) + 1) // 2):
+                self.rehash(depth, index)
+
+    def build_merkle_tree(self, nodeData, way='filling', sorted=False, workers=None):
+        if len(nodeData) == 0:
+            print('INFO: 构建了个寂寞')
+            return
+
+        if workers != None and workers > 1:
+            with ProcessPoolExecutor(workers) as executor:
+                return self.build_merkle_tree_with(nodeData, way, sorted, executor, workers)
+        return self.build_merkle_tree_with(nodeData, way, sorted)
+
+    def build_merkle_tree_with(self, nodeData, way='filling', sorted=False, executor=None, workers=1):
+        if sorted == True:
+            nodeData = [int(i) for i in nodeData]
+            nodeData.sort()
+            self.sortedKeys = list(nodeData)
+            nodeData = [str(i) for i in nodeData]
+            # 有序模式下不补齐叶子，复制出来的节点会破坏叶子的顺序
+            way = 'imbalance'
+        else:
+            self.sortedKeys = None
+
+        # 重新构建时丢弃原来的树
+        self.reset()
+
+        # 为每一个叶子分配素数和标号，再（并行）计算叶子的 hash
+        primes = []
+        ids = []
+        usedPrimes = set()
+        for data in nodeData:
+            newNodePrime = self.new_prime(usedPrimes)
+            usedPrimes.add(newNodePrime)
+            primes.append(newNodePrime)
+            ids.append(str(time.time()))
+        payloads = [self.leaf_payload(data, newNodePrime, thisTime)
+                    for data, newNodePrime, thisTime in zip(nodeData, primes, ids)]
+        if executor != None:
+            digests = parallel_hash_leaves(self.hasher, payloads, executor, workers)
+        else:
+            digests = [self.hasher.leaf(payload) for payload in payloads]
+
+        # 构造每一个叶子节点
+        for data, newNodePrime, thisTime, digest in zip(nodeData, primes, ids, digests):
+            index = self.append_leaf(
+                value=data,
+                digest=digest,
+                prime=newNodePrime,
+                id=thisTime,
+            )
+            if self.verbose:
+                print('INFO: 节点构造完成：', str(self.node_view(0, index)))
+
+        if way == 'filling':
+            # 为整棵树补充需要的节点（将最后一个节点复制若干次）
+            treeDepth = math.ceil(math.log2(len(nodeData)))
+            for _ in range(2**treeDepth - len(nodeData)):
+                last = len(self.values) - 1
+                self.append_leaf(
+                    value=self.values[last],
+                    digest=self.hasher.node(self.get_hash(0, last)),
+                    prime=self.new_prime(),
+                    id=time.time(),
+                    padding=True,
+                )
+        # imbalance 方式逐个 insert 的结果与逐层合并、落单的节点只对自己做 hash 完全相同
+        self.build_levels(executor, workers)
+        self.newNodes = [(self.tree_height(), 0)]
+
+    def insert(self, node, addAgain=False):
+        '''
+        函数功能：将一个叶子节点（TreeNode）追加到树的最右边
+        '''
+        self.insert_many([node], addAgain)
+
+    def insert_sorted(self, nodes):
+        '''
+        函数功能：有序模式下按键的顺序插入叶子
+        插入点之后的叶子依次后移一位，只重新计算从最靠左的插入点开始的节点；
+        键都不小于已有的最大键时就是在最右边追加
+        '''
+        self.newNodes = []
+        first = len(self.values)
+        for node in sorted(nodes, key=lambda node: int(node.value)):
+            index = bisect_right(self.sortedKeys, int(node.value))
+            self.sortedKeys.insert(index, int(node.value))
+            count = len(self.values)
+            if index < count:
+                self.append_leaf(*self.leaf_record(count - 1))
+                self.set_index(self.primes[count], count)
+                for i in range(count - 1, index, -1):
+                    self.set_leaf(i, *self.leaf_record(i - 1))
+                    self.set_index(self.primes[i], i)
+                self.set_leaf(index, node.value, node.hash, node.primeNum, node.id)
+                self.set_index(node.primeNum, index)
+            else:
+                self.append_leaf(node.value, node.hash, node.primeNum, node.id)
+            first = min(first, index)
+        self.update_range(first, len(self.values) - 1)
+
+    def is_tombstone(self, index):
+        return self.get_hash(0, index) == self.hasher.tombstoneHash
+
+    def replace_leaves(self, nodes):
+        '''
+        函数功能：把一批叶子（nodes 为 叶子序号 -> 新的叶子节点）换成新的数据，
+        再逐层向上，每个受影响的祖先节点只计算一次 hash
+        '''
+        dirty = set()
+        for index, node in nodes.items():
+            self.set_leaf(index, node.value, node.hash, node.primeNum, node.id)
+            self.newNodes.append((0, index))
+            dirty.add(index)
+        for depth in range(1, self.tree_height() + 1):
+            dirty = set(index >> 1 for index in dirty)
+            for index in sorted(dirty):
+                self.rehash(depth, index)
+                self.newNodes.append((depth, index))
+
+    def truncate(self, count):
+        '''
+        函数功能：只保留前 count 个叶子，各层截短为 count 个叶子的树的大小
+        '''
+        del self.values[count:]
+        del self.primes[count:]
+        del self.ids[count:]
+        del self.paddings[count:]
+        height = self.tree_height(count)
+        for depth in range(len(self.levels)):
+            size = (count + (1 << depth) - 1) >> depth if depth <= height else 0
+            del self.levels[depth][size * self.HASH_SIZE:]
+            del self.generations[depth][size:]
+
+    def compact(self):
+        '''
+        函数功能：去掉所有的墓碑，后面的叶子依次前移，只重新计算从第一个墓碑开始的节点
+        叶子的 hash 不需要重新计算；数组被截短之后，不能再查询更早的版本
+        '''
+        count = self.leaf_count()
+        first = 0
+        while first < count and not self.is_tombstone(first):
+            first += 1
+        keep = first
+        for index in range(first, count):
+            if not self.is_tombstone(index):
+                self.set_leaf(keep, *self.leaf_record(index))
+                self.set_index(self.primes[keep], keep)
+                keep += 1
+        self.truncate(keep)
+        if keep > first:
+            self.update_range(first, keep - 1)
+        elif keep > 0:
+            # 墓碑都在末尾时没有叶子移动，截短之后仍要重新计算最右边的一条路径
+            self.update_path(keep - 1)
+        if self.sortedKeys != None:
+            self.sortedKeys = [int(self.values[index]) for index in range(keep)]
+        self.tombstones = 0
+        self.oldHashes = {}
+        self.oldLeaves = {}
+        self.oldIndex = {}
+        self.firstGeneration = self.history
+
+    def shrink(self, count):
+        '''
+        函数功能：只保留前 count 个叶子，重新计算最右边的一条路径；数组被截短之后，不能再查询更早的版本
+        '''
+        self.tombstones -= sum(1 for index in range(count, self.leaf_count()) if self.is_tombstone(index))
+        for index in range(count, self.leaf_count()):
+            if self.leafIndex.get(self.primes[index]) == index:
+                self.drop_index(self.primes[index])
+        if self.sortedKeys != None:
+            del self.sortedKeys[count:]
+        self.truncate(count)
+        if count > 0:
+            self.update_path(count - 1)
+        self.oldHashes = {}
+        self.oldLeaves = {}
+        self.oldIndex = {}
+        self.firstGeneration = self.history
+
+    def insert_many(self, nodes, addAgain=False):
+        '''
+        函数功能：将多个叶子节点（TreeNode）依次追加到树的最右边
+        '''
+        if addAgain == False:
+            self.newNodes = []
+        first = len(self.values)
+        for node in nodes:
+            self.append_leaf(
+                value=node.value,
+                digest=node.hash,
+                prime=node.primeNum,
+                id=node.id,
+            )
+        if len(self.values) > first:
+            self.update_range(first, len(self.values) - 1)
+
+    def node_id(self, depth, index):
+        '''
+        函数功能：可视化时节点的名字，叶子沿用创建时间作为标号
+        '''
+        if depth == 0:
+            return str(self.ids[index])
+        return 'n%d_%d' % (depth, index)
+
+    def node_range(self, depth, index):
+        '''
+        函数功能：第 depth 层第 index 个节点覆盖的叶子下标范围 [first, last]
+        '''
+        first = index << depth
+        last = min(first + (1 << depth), self.leaf_count()) - 1
+        return first, last
+
+    def range_value(self, depth, index):
+        '''
+        函数功能：节点显示的数据，中间节点只在展示时由首尾两个叶子得到
+        '''
+        first, last = self.node_range(depth, index)
+        if first == last:
+            return self.values[first]
+        return self.values[first] + ' ~ ' + self.values[last]
+
+    def node_view(self, depth, index, value=None):
+        '''
+        函数功能：为数组中的某个节点临时构造一个 TreeNode，用于展示和 Merkle 路径验证
+        '''
+        first, last = self.node_range(depth, index)
+        self.count_allocated(1)
+        return TreeNode(
+            value=self.range_value(depth, index) if value is None else value,
+            hash=self.get_hash(depth, index),
+            childNum=last - first + 1 if depth > 0 else 0,
+            depth=depth,
+            id=self.node_id(depth, index),
+            primeNum=str(self.primes[index]) if depth == 0 else None,
+            generation=self.generations[depth][index],
+        )
+
+    def root_hash(self):
+        if self.leaf_count() == 0:
+            return b''
+        return self.get_hash(self.tree_height(), 0)
+
+    def leaf_view(self, index):
+        return self.node_view(0, index)
+
+    def save(self, path):
+        '''
+        函数功能：把树保存为磁盘上的文件，之后可以用 MerkleTree.open(path) 直接打开
+        '''
+        from MappedMerkleTree import write_tree
+        write_tree(path, self)
+
+    def root_ref(self):
+        # 数组中节点的引用是 (depth, index)
+        return (self.tree_height(), 0)
+
+    def child_refs(self, ref):
+        depth, index = ref
+        rightRef = None
+        if 2 * index + 1 < self.level_size(depth - 1):
+            rightRef = (depth - 1, 2 * index + 1)
+        return (depth - 1, 2 * index), rightRef
+
+    def ref_hash(self, ref):
+        return self.get_hash(ref[0], ref[1])
+
+    def ref_view(self, ref, value):
+        return self.node_view(ref[0], ref[1], value)
+
+    def ref_node(self, ref):
+        return self.node_view(ref[0], ref[1])
+
+    def ref_name(self, ref):
+        return self.node_id(ref[0], ref[1])
+
+    def ref_generation(self, ref):
+        return self.generations[ref[0]][ref[1]]
+
+    def search(self, prime, showNode=False):
+        thisNode, proofPath = MerkleTree.search(self, prime, showNode)
+        if thisNode != None:
+            thisNode = self.node_view(thisNode[0], thisNode[1])
+        return thisNode, proofPath
+
+    def getTreePrime(self,):
+        self.count_traversed(self.leaf_count())
+        return [str(self.primes[index]) for index in range(self.leaf_count()) if not self.is_tombstone(index)]
+
+    def show(self, node=0, proof=False, showDepth=True, showMinDepth=False, string=None,
+             maxDepth=None, around=None, window=0, since=None, path=None):
+        if node == 0 and self.leaf_count() == 0:
+            # 空树只展示一个树桩
+            self.count_allocated(1)
+            node = TreeNode(value='root', childNum=0, depth=0, id='root')
+        return MerkleTree.show(self, node, proof=proof, showDepth=showDepth, showMinDepth=showMinDepth,
+                               string=string, maxDepth=maxDepth, around=around, window=window,
+                               since=since, path=path)
+
+
+class TreeSnapshot:
+    '''
+    历史版本的只读快照，与原来的树共享节点，修改树的方法都会抛出异常
+    '''
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError('历史版本是只读的')
+
+    build_merkle_tree = add = add_many = insert = insert_many = read_only
+    remove = compact = update = update_many = sync = shrink = read_only
+
+    def check_retained(self):
+        '''
+        函数功能：快照所在的一代已被 forget 丢弃时抛出异常，它需要的修改记录已经不在了
+        '''
+        if self.history < self.tree.firstGeneration:
+            raise ValueError('第 ' + str(self.history) + ' 代的版本已被丢弃')
+
+    def locate_leaf(self, prime):
+        '''
+        函数功能：这个版本中素数为 prime 的叶子的序号，O(1)
+        索引在这一代之后被修改过时，取这一代之后第一次修改前的位置；写者先保存旧的位置再修改索引，
+        这里先读索引再读旧位置，与写者并发时也能得到这一代的位置。这一代之后追加的叶子不算
+        '''
+        self.check_retained()
+        index = self.leafIndex.get(int(prime))
+        entries = self.oldIndex.get(int(prime))
+        if entries != None:
+            position = bisect_right(entries, self.history, key=lambda entry: entry[0])
+            if position < len(entries):
+                index = entries[position][1]
+        if index != None and index < self.leaf_count():
+            return index
+        return None
+
+    def key_index(self):
+        # 有序模式的键由这个版本的叶子得到
+        if self.tree.sortedKeys == None:
+            raise ValueError('只有有序模式（build_merkle_tree(sorted=True)）的树才能按键查找')
+        return LeafKeys(self)
+
+    def at(self, generation):
+        return self.tree.at(generation)
+
+    def version_of_size(self, size, generation=None):
+        # 只能找到这一代及以前的版本
+        if generation == None and size == self.leaf_count():
+            return self
+        return self.tree.version_of_size(size, self.history if generation == None else min(generation, self.history))
+
+    def latest(self):
+        return self.tree.latest()
+
+
+class LeafKeys:
+    '''
+    按叶子顺序排列的键，读取时才由叶子的数据得到，供 bisect 使用
+    '''
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __len__(self):
+        return self.tree.leaf_count()
+
+    def __getitem__(self, index):
+        # 墓碑沿用左边最近的叶子的键（见 MerkleTree.bury_key）
+        while index >= 0:
+            value = self.tree.leaf_view(index).value
+            if value != TOMBSTONE:
+                return int(value)
+            index -= 1
+        return NO_KEY
+
+
+class SnapshotLeaves:
+    '''
+    快照中叶子的某一列数据，这一代之后被覆盖过的叶子从 oldLeaves 中读出
+    '''
+
+    def __init__(self, snapshot, column, field):
+        self.snapshot = snapshot
+        self.column = column
+        self.field = field
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def __getitem__(self, index):
+        entries = self.snapshot.tree.oldLeaves.get(index)
+        if entries != None:
+            position = bisect_right(entries, self.snapshot.history, key=lambda entry: entry[0])
+            if position < len(entries):
+                return entries[position][1][self.field]
+        return self.column[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class MerkleSnapshot(TreeSnapshot, MerkleTree):
+    '''
+    MerkleTree 某一代的快照，树根下的节点不会再被修改
+    '''
+
+    def __init__(self, tree, root, generation, leafIndex, oldIndex):
+        self.tree = tree
+        self.history = generation
+        self.hasher = tree.hasher
+        # 这一代使用的素数索引，之后的修改记录在 oldIndex 中
+        self.leafIndex = leafIndex
+        self.oldIndex = oldIndex
+        self.primeProduct = tree.primeProduct
+        self.newNodes = []
+        self.root = root
+
+
+class ArraySnapshot(TreeSnapshot, ArrayMerkleTree):
+    '''
+    ArrayMerkleTree 某一代的快照
+    叶子按添加的代数排列，这一代结束时的叶子数量由二分查找得到
+    '''
+
+    def __init__(self, tree, generation):
+        self.tree = tree
+        self.history = generation
+        self.hasher = tree.hasher
+        self.leafIndex = tree.leafIndex
+        self.oldIndex = tree.oldIndex
+        self.newNodes = []
+        self.levels = tree.levels
+        self.generations = tree.generations
+        self.values = SnapshotLeaves(self, tree.values, 0)
+        self.primes = SnapshotLeaves(self, tree.primes, 1)
+        self.ids = SnapshotLeaves(self, tree.ids, 2)
+        self.paddings = SnapshotLeaves(self, tree.paddings, 3)
+        self.count = bisect_right(tree.generations[0], generation)
+
+    def leaf_count(self):
+        return self.count
+
+    def level_size(self, depth):
+        if depth > self.tree_height():
+            return 0
+        return (self.count + (1 << depth) - 1) >> depth
+
+    def get_hash(self, depth, index):
+        # 这一代之后被覆盖过的节点，取第一次覆盖前的 hash
+        self.check_retained()
+        entries = self.tree.oldHashes.get((depth, index))
+        if entries != None:
+            position = bisect_right(entries, (self.history, b'\xff' * (self.HASH_SIZE + 1)))
+            if position < len(entries):
+                return entries[position][1]
+        return self.tree.get_hash(depth, index)
@@ -0,0 +1,64 @@
+from itertools import compress
+from math import isqrt
+
+
+class PrimePool:
+    '''
+    叶子素数的分配器：按从小到大的顺序依次分配素数，结果确定、不会重复
+    用分段埃氏筛每次筛出一段 [low, low + SEGMENT) 中的所有素数，
+    分配一个素数的均摊开销为 O(1)，不需要素性检验
+    '''
+
+    SEGMENT = 1 << 16  # 每次筛的区间长度
+
+    def __init__(self, start=2):
+        self.next = max(2, start)  # 下一个可以分配的数（之前的都已经分配过）
+        self.primes = []           # 当前段中筛出的素数
+        self.position = 0          # 当前段中下一个要分配的素数
+        self.basePrimes = []       # 用来筛的小素数（不超过 baseLimit）
+        self.baseLimit = 1
+
+    def allocate(self):
+        '''
+        函数功能：分配下一个素数
+        '''
+        while self.position == len(self.primes):
+            self.sieve()
+        prime = self.primes[self.position]
+        self.position += 1
+        self.next = prime + 1
+        return prime
+
+    def sieve(self):
+        '''
+        函数功能：筛出 [next, next + SEGMENT) 中的素数
+        '''
+        low = self.next
+        high = low + self.SEGMENT
+        self.extend_base(isqrt(high))
+        flags = bytearray(b'\x01') * (high - low)
+        for p in self.basePrimes:
+            if p * p >= high:
+                break
+            start = max(p * p, (low + p - 1) // p * p)
+            flags[start - low::p] = bytes(len(range(start - low, high - low, p)))
+        self.primes = list(compress(range(low, high), flags))
+        self.position = 0
+        # 下一段从这一段的末尾开始
+        if len(self.primes) == 0:
+            self.next = high
+
+    def extend_base(self, limit):
+        '''
+        函数功能：保证 basePrimes 包含所有不超过 limit 的素数，每次至少扩大一倍
+        '''
+        if limit <= self.baseLimit:
+            return
+        limit = max(limit, 2 * self.baseLimit)
+        flags = bytearray(b'\x01') * (limit + 1)
+        flags[0] = flags[1] = 0
+        for p in range(2, isqrt(limit) + 1):
+            if flags[p]:
+                flags[p * p::p] = bytes(len(range(p * p, limit + 1, p)))
+        self.basePrimes = list(compress(range(limit + 1), flags))
+        self.baseLimit = limit
@@ -0,0 +1,225 @@
+'''
+证明服务：asyncio 的请求处理器，从树最近发布的快照（MerkleTree.latest()）生成叶子的 Merkle 证明，
+热门叶子的证明缓存在 ProofCache 中，同一个叶子的并发请求只生成一次证明
+用法：python ProofServer.py [--leaves 100000] [--requests 100000] [--hot 100] [--concurrency 64]
+                            [--write-interval 0.01]
+'''
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree
+
+
+NOT_FOUND = 'not found'  # 缓存中表示叶子不在这一代的树上
+
+
+class ProofCache:
+    '''
+    有界的 LRU 证明缓存，键为 (叶子的素数, 快照的代数)
+    快照发布之后不再变化，某一代的证明永远有效，写操作时不需要逐个失效；
+    而任何一次写操作都会改变每个叶子审计路径上的一个作证 hash（包含被写叶子的那棵子树），
+    新的一代不能沿用旧的证明，旧代的条目不再被访问，自然被 LRU 淘汰
+    不在树上的叶子也缓存（值为 NOT_FOUND），同一个错误的请求不必每次都查找
+    '''
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.entries = OrderedDict()  # (素数, 代数) -> 证明，最近用过的在最后
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, prime, generation):
+        proof = self.entries.get((prime, generation))
+        if proof == None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((prime, generation))
+        self.hits += 1
+        return proof
+
+    def put(self, prime, generation, proof):
+        self.entries[(prime, generation)] = proof
+        self.entries.move_to_end((prime, generation))
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class ProofServer:
+    '''
+    证明请求的处理器，tree 为 MerkleTree，写者线程可以同时修改它
+    workers 大于 0 时，缓存未命中的证明在线程池中由快照生成，不阻塞事件循环（快照是不可变的，线程池中不需要加锁），
+    同一代的同一个叶子正在生成证明时，后来的请求等待同一个结果，不再重复生成；
+    workers 为 0 时直接在事件循环中生成（一次只需几十微秒），没有线程切换，延迟最低
+    '''
+
+    def __init__(self, tree, cacheSize=10000, workers=0):
+        self.tree = tree
+        self.cache = ProofCache(cacheSize)
+        self.executor = ThreadPoolExecutor(workers) if workers > 0 else None
+        self.pending = {}   # (素数, 代数) -> 正在生成的证明
+        self.coalesced = 0  # 合并到其他请求上的请求数
+
+    async def handle(self, prime):
+        '''
+        函数功能：处理一个证明请求，返回 (代数, 树根 hash, 证明)，叶子不在树上时证明为 None
+        证明与树根来自同一个快照，可以用 verify_proof(树根 hash, 证明) 验证
+        '''
+        snapshot = self.tree.latest()
+        key = (int(prime), snapshot.history)
+        proof = self.cache.get(*key)
+        if proof == None:
+            # 快照自带这一代的素数索引，O(1) 就能知道叶子在不在树上，不在时不生成证明
+            index = snapshot.locate_leaf(key[0])
+            if index == None:
+                proof = NOT_FOUND
+                self.cache.put(key[0], key[1], proof)
+            elif self.executor == None:
+                proof = snapshot.proof_by_index(index)
+                self.cache.put(key[0], key[1], proof)
+            else:
+                future = self.pending.get(key)
+                if future == None:
+                    future = self.prove(snapshot, key, index)
+                else:
+                    self.coalesced += 1
+                # 一个请求被取消时，不影响等待同一个结果的其他请求
+                proof = await asyncio.shield(future)
+        if proof is NOT_FOUND:
+            proof = None
+        return snapshot.history, snapshot.root_hash(), proof
+
+    def prove(self, snapshot, key, index):
+        '''
+        函数功能：在线程池中生成第 index 个叶子的证明，生成完成后放入缓存
+        '''
+        future = asyncio.get_running_loop().run_in_executor(self.executor, snapshot.proof_by_index, index)
+        self.pending[key] = future
+        future.add_done_callback(lambda done: self.finish(key, done))
+        return future
+
+    def finish(self, key, future):
+        del self.pending[key]
+        if not future.cancelled() and future.exception() == None:
+            self.cache.put(key[0], key[1], future.result())
+
+    def close(self):
+        if self.executor != None:
+            self.executor.shutdown()
+
+
+class ProofClient:
+    '''
+    进程内的客户端，直接调用服务端的请求处理器，verify=True 时验证每个返回的证明
+    '''
+
+    def __init__(self, server, verify=True):
+        self.server = server
+        self.verify = verify
+
+    async def get_proof(self, prime):
+        generation, rootHash, proof = await self.server.handle(prime)
+        if self.verify and proof != None and not verify_proof(rootHash, proof):
+            raise ValueError('第 ' + str(generation) + ' 代的证明验证失败')
+        return generation, rootHash, proof
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_load(server, primes, hot, requests, concurrency, hotRatio, verify, seed):
+    '''
+    函数功能：concurrency 个并发的请求者一共发出 requests 个请求，返回 (热门叶子的请求的延迟, 其他请求的延迟)（秒）
+    hotRatio 的请求落在 hot 个热门叶子上，其余的请求均匀地落在所有叶子上
+    '''
+    client = ProofClient(server, verify)
+    hotPrimes = random.Random(seed).sample(primes, hot)
+    hotLatencies = []
+    coldLatencies = []
+
+    async def requester(index):
+        rng = random.Random(seed + 1 + index)
+        while len(hotLatencies) + len(coldLatencies) < requests:
+            isHot = rng.random() < hotRatio
+            prime = rng.choice(hotPrimes) if isHot else rng.choice(primes)
+            start = time.perf_counter()
+            await client.get_proof(prime)
+            (hotLatencies if isHot else coldLatencies).append(time.perf_counter() - start)
+            # 缓存命中时不会让出事件循环，主动让出，让请求者交替执行
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(requester(i) for i in range(concurrency)))
+    return hotLatencies, coldLatencies
+
+
+def writer(mt, interval, done):
+    '''
+    函数功能：写者线程，每隔 interval 秒添加一个叶子，发布新的一代
+    '''
+    count = 0
+    while not done.wait(interval):
+        mt.add('w' + str(count))
+        count += 1
+
+
+def measure_latency(leaves=100000, requests=100000, hot=100, concurrency=64, hotRatio=0.9,
+                    writeInterval=0.01, cacheSize=10000, workers=0, verify=False, seed=0):
+    '''
+    函数功能：在写者不断添加叶子的同时测试证明服务的延迟，
+    返回 (热门叶子的请求的延迟, 其他请求的延迟, 服务端, 测试期间发布的代数)
+    '''
+    mt = MerkleTree(primeProduct=False)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        mt.build_merkle_tree([str(i) for i in range(leaves)], way='imbalance')
+        primes = mt.getTreePrime()
+        firstGeneration = mt.history
+        server = ProofServer(mt, cacheSize, workers)
+        done = threading.Event()
+        thread = threading.Thread(target=writer, args=(mt, writeInterval, done))
+        thread.start()
+        try:
+            hotLatencies, coldLatencies = asyncio.run(
+                run_load(server, primes, hot, requests, concurrency, hotRatio, verify, seed))
+        finally:
+            done.set()
+            thread.join()
+            server.close()
+    return hotLatencies, coldLatencies, server, mt.history - firstGeneration
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='证明服务的延迟测试')
+    parser.add_argument('--leaves', type=int, default=100000, help='树的叶子数量')
+    parser.add_argument('--requests', type=int, default=100000, help='请求数量')
+    parser.add_argument('--hot', type=int, default=100, help='热门叶子的数量')
+    parser.add_argument('--hot-ratio', type=float, default=0.9, help='落在热门叶子上的请求比例')
+    parser.add_argument('--concurrency', type=int, default=64, help='并发的请求者数量')
+    parser.add_argument('--write-interval', type=float, default=0.01, help='写者添加叶子的间隔（秒）')
+    parser.add_argument('--cache-size', type=int, default=10000, help='缓存的证明数量')
+    parser.add_argument('--workers', type=int, default=0, help='生成证明的线程数，0 表示在事件循环中生成')
+    parser.add_argument('--verify', action='store_true', help='客户端验证每个证明（计入延迟）')
+    args = parser.parse_args()
+
+    hotLatencies, coldLatencies, server, generations = measure_latency(
+        args.leaves, args.requests, args.hot, args.concurrency, args.hot_ratio,
+        args.write_interval, args.cache_size, args.workers, args.verify)
+    cache = server.cache
+    print('INFO: %d 个请求，测试期间发布了 %d 代' % (len(hotLatencies) + len(coldLatencies), generations))
+    for name, latencies in (('热门叶子', hotLatencies), ('其他叶子', coldLatencies)):
+        if len(latencies) > 0:
+            print('INFO: %s 延迟 p50 %.3f ms，p99 %.3f ms，最大 %.3f ms' % (name,
+                  percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, max(latencies) * 1e3))
+    print('INFO: 缓存命中率 %.1f%%，合并的请求 %d 个' % (
+        100 * cache.hits / max(1, cache.hits + cache.misses), server.coalesced))
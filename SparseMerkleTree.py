@@ -0,0 +1,207 @@
+from MerkleHash import MerkleHasher
+from MerkleProof import SparseProof, default_hashes, sparse_leaf_data
+
+
+class SparseMerkleTree:
+    '''
+    稀疏 Merkle 树：2^keyBits 个叶子，每个键（例如 160 位的合约地址）对应一个叶子，
+    适合承诺 playersFundings、votedAddressMap 这类以地址为键的状态
+    没有值的叶子都是空叶子，空子树的 hash 由 default_hashes 预先算好，不需要保存；
+    只有一个键的子树只在最上面的节点保存 (键, hash)，保存的节点数与键的数量成正比
+    get 为 O(1)，set / delete / prove 为 O(keyBits) 次 hash，可以证明键的值，也可以证明键不在树上
+
+    节点用堆的序号表示：树根为 1，高度为 d、前缀为 p（键 >> d）的节点为 (1 << (keyBits - d)) | p
+    '''
+
+    def __init__(self, keyBits=160, hashName='sha256', compat=False):
+        self.keyBits = keyBits
+        self.hasher = MerkleHasher(hashName, compat)
+        self.defaults = default_hashes(self.hasher, keyBits)
+        self.values = {}     # 键 -> 值
+        self.branches = {}   # 至少有两个键的子树：节点 -> hash
+        self.shortcuts = {}  # 只有一个键的子树最上面的节点：节点 -> (键, hash)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return self.to_key(key) in self.values
+
+    def items(self):
+        return self.values.items()
+
+    def to_key(self, key):
+        '''
+        函数功能：把键转换成整数，键可以是整数、字节串或十六进制字符串（例如 '0x5B38...'）
+        '''
+        if isinstance(key, bytes):
+            key = int.from_bytes(key, 'big')
+        elif isinstance(key, str):
+            key = int(key, 16)
+        if key < 0 or key >> self.keyBits:
+            raise ValueError('键超出了 ' + str(self.keyBits) + ' 位的范围：' + hex(key))
+        return key
+
+    def height_of(self, node):
+        # 节点的高度（叶子为 0）
+        return self.keyBits + 1 - node.bit_length()
+
+    def hash_at(self, node):
+        '''
+        函数功能：任意节点的 hash，空子树返回预先算好的 hash
+        '''
+        digest = self.branches.get(node)
+        if digest != None:
+            return digest
+        shortcut = self.shortcuts.get(node)
+        if shortcut != None:
+            return shortcut[1]
+        return self.defaults[self.height_of(node)]
+
+    def root_hash(self):
+        return self.hash_at(1)
+
+    def fold(self, key, height):
+        '''
+        函数功能：只有一个键的、高度为 height 的子树的 hash，从叶子向上与空子树合并 height 次
+        '''
+        thisHash = self.hasher.leaf(sparse_leaf_data(key, self.values[key], self.keyBits))
+        for depth in range(height):
+            if (key >> depth) & 1:
+                thisHash = self.hasher.node(self.defaults[depth], thisHash)
+            else:
+                thisHash = self.hasher.node(thisHash, self.defaults[depth])
+        return thisHash
+
+    def get(self, key):
+        '''
+        函数功能：键的值，键不在树上时返回 None
+        '''
+        return self.values.get(self.to_key(key))
+
+    def set(self, key, value):
+        '''
+        函数功能：设置键的值，value 为 None 时删除这个键
+        '''
+        self.update_many({key: value})
+
+    def delete(self, key):
+        self.update_many({key: None})
+
+    def update_many(self, mapping):
+        '''
+        函数功能：一次修改一批键（mapping 为 键 -> 值，值为 None 表示删除）
+        先调整每个键所在的子树，再自下而上重新计算受影响的节点，共同的祖先只计算一次 hash，
+        只有一个键的子树也在最后才计算，同一批中被其他键分开的子树不会重复计算
+        '''
+        dirty = set()
+        for key, value in mapping.items():
+            key = self.to_key(key)
+            if value == None:
+                if key in self.values:
+                    self.detach(key, dirty)
+                    del self.values[key]
+            else:
+                self.values[key] = str(value)
+                self.attach(key, dirty)
+        # 更深的节点序号更大，按序号从大到小就是自下而上
+        for node in sorted(dirty, reverse=True):
+            if node in self.branches:
+                self.branches[node] = self.hasher.node(self.hash_at(node << 1), self.hash_at(node << 1 | 1))
+            elif node in self.shortcuts and self.shortcuts[node][1] == None:
+                key = self.shortcuts[node][0]
+                self.shortcuts[node] = (key, self.fold(key, self.height_of(node)))
+
+    def attach(self, key, dirty):
+        '''
+        函数功能：把键放到树上（值已经写入 values），经过的分叉节点和需要重新计算的子树记入 dirty
+        键落在另一个键的子树中时，两个键分开之前的节点都变成分叉节点
+        '''
+        node, height = 1, self.keyBits
+        while node in self.branches:
+            dirty.add(node)
+            height -= 1
+            node = node << 1 | (key >> height) & 1
+        shortcut = self.shortcuts.get(node)
+        if shortcut == None or shortcut[0] == key:
+            self.shortcuts[node] = (key, None)
+            dirty.add(node)
+            return
+
+        other = shortcut[0]
+        del self.shortcuts[node]
+        # 两个键在第 diverge-1 位第一次不同，高度为 diverge 的节点是它们最低的公共祖先
+        diverge = (key ^ other).bit_length()
+        while True:
+            self.branches[node] = None
+            dirty.add(node)
+            height -= 1
+            if height < diverge:
+                break
+            node = node << 1 | (key >> height) & 1
+        for thisKey in (key, other):
+            child = node << 1 | (thisKey >> height) & 1
+            self.shortcuts[child] = (thisKey, None)
+            dirty.add(child)
+
+    def detach(self, key, dirty):
+        '''
+        函数功能：把键从树上拿掉（值还在 values 中），经过的分叉节点记入 dirty
+        分叉节点下面只剩一个键时，它变回这个键的子树的最上面的节点
+        '''
+        node, height = 1, self.keyBits
+        path = []
+        while node in self.branches:
+            path.append(node)
+            height -= 1
+            node = node << 1 | (key >> height) & 1
+        del self.shortcuts[node]
+
+        while len(path) > 0:
+            parent = path[-1]
+            children = [child for child in (parent << 1, parent << 1 | 1)
+                        if child in self.branches or child in self.shortcuts]
+            if len(children) != 1 or children[0] not in self.shortcuts:
+                break
+            # 只剩一个键，向上合并一层
+            other, otherHash = self.shortcuts.pop(children[0])
+            height = self.height_of(children[0])
+            if otherHash == None:
+                # 这一批中还没有计算过
+                dirty.add(parent)
+            elif children[0] & 1:
+                otherHash = self.hasher.node(self.defaults[height], otherHash)
+            else:
+                otherHash = self.hasher.node(otherHash, self.defaults[height])
+            del self.branches[parent]
+            self.shortcuts[parent] = (other, otherHash)
+            path.pop()
+        dirty.update(path)
+
+    def prove(self, key):
+        '''
+        函数功能：生成键的证明，键在树上时证明它的值，不在树上时证明它不在树上
+        可以用 MerkleProof.verify_sparse(tree.root_hash(), proof) 验证
+        '''
+        key = self.to_key(key)
+        node, height = 1, self.keyBits
+        siblings = {}
+        while node in self.branches:
+            height -= 1
+            sibling = node << 1 | ((key >> height) & 1) ^ 1
+            if sibling in self.branches or sibling in self.shortcuts:
+                siblings[height] = self.hash_at(sibling)
+            node = node << 1 | (key >> height) & 1
+        shortcut = self.shortcuts.get(node)
+        if shortcut != None and shortcut[0] != key:
+            # 键所在的位置是另一个键的子树，两个键分开的那一层的作证 hash 是另一个键的子树
+            other = shortcut[0]
+            diverge = (key ^ other).bit_length()
+            siblings[diverge - 1] = self.fold(other, diverge - 1)
+
+        bitmap = 0
+        for height in siblings:
+            bitmap |= 1 << height
+        hashes = [siblings[height] for height in sorted(siblings)]
+        return SparseProof(key, self.values.get(key), bitmap, hashes,
+                           self.keyBits, self.hasher.name, self.hasher.compat)
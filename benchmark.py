@@ -0,0 +1,277 @@
+'''
+Merkle 树的性能测试
+每个 (树, 操作, 叶子数量) 在单独的子进程中运行，记录耗时、hash 调用次数、节点分配和遍历次数（见 MerkleStats）和峰值内存（RSS），
+结果追加到 JSON 历史文件中，并与历史文件中上一次的结果比较，变慢超过阈值时给出提示
+用法：python benchmark.py [--min 1000] [--max 1000000] [--samples 1000]
+                          [--trees MerkleTree MerkleTree.primeProduct ArrayMerkleTree] [--ops build_filling add ...]
+                          [--output benchmark_history.json] [--threshold 0.2] [--prime-max 100000]
+'''
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource，不记录峰值内存
+    resource = None
+
+from MerkleProof import proof_root
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+# MerkleTree 是默认的 MerkleTree()，只衡量 Merkle 树本身；MerkleTree.primeProduct 保留素数乘积，
+# 乘积随叶子数量增长，每次添加都要做大整数乘法
+TREES = {
+    'MerkleTree': MerkleTree,
+    'MerkleTree.primeProduct': lambda: MerkleTree(primeProduct=True),
+    'ArrayMerkleTree': ArrayMerkleTree,
+}
+
+# 这些树的操作随叶子数量增长得很快，只测到 --prime-max 个叶子
+PRIME_TREES = ('MerkleTree.primeProduct',)
+
+
+def new_tree(treeName):
+    mt = TREES[treeName]()
+    # 计数来自树的运行统计，计时中也包括统计本身的开销，与历史结果比较时条件相同
+    mt.enable_stats()
+    return mt
+
+
+def quiet():
+    '''
+    函数功能：屏蔽构建和添加节点时每个叶子一行的 INFO 输出
+    '''
+    return contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+
+def built_tree(treeName, size):
+    mt = new_tree(treeName)
+    with quiet():
+        mt.build_merkle_tree([str(i) for i in range(size)], way='imbalance')
+    return mt
+
+
+def sample_primes(mt, size, samples):
+    # 用叶子数量作为随机种子，每次运行抽到的叶子相同
+    primes = mt.getTreePrime()
+    return random.Random(size).sample(primes, min(samples, len(primes)))
+
+
+'''
+每个测试用例先准备好树和数据，返回 (树, 要计时的函数, 操作次数)
+'''
+
+
+def case_build_filling(treeName, size, samples):
+    mt = new_tree(treeName)
+    data = [str(i) for i in range(size)]
+    return mt, lambda: mt.build_merkle_tree(data, way='filling'), 1
+
+
+def case_build_imbalance(treeName, size, samples):
+    mt = new_tree(treeName)
+    data = [str(i) for i in range(size)]
+    return mt, lambda: mt.build_merkle_tree(data, way='imbalance'), 1
+
+
+def case_add(treeName, size, samples):
+    mt = built_tree(treeName, size)
+
+    def run():
+        for i in range(samples):
+            mt.add(str(size + i))
+    return mt, run, samples
+
+
+def case_search(treeName, size, samples):
+    mt = built_tree(treeName, size)
+    primes = sample_primes(mt, size, samples)
+
+    def run():
+        for prime in primes:
+            mt.search(prime)
+    return mt, run, len(primes)
+
+
+def case_merkle_path(treeName, size, samples):
+    mt = built_tree(treeName, size)
+    proofPaths = [mt.search(prime)[1] for prime in sample_primes(mt, size, samples)]
+
+    def run():
+        for proofPath in proofPaths:
+            mt.merkle_path(proofPath)
+    return mt, run, len(proofPaths)
+
+
+def case_verify(treeName, size, samples):
+    # 与 verify_proof 相同，但用树上计数的 hasher 计算树根，验证时的 hash 计入 hashCalls
+    mt = built_tree(treeName, size)
+    proofs = [mt.get_proof(prime) for prime in sample_primes(mt, size, samples)]
+    rootHash = mt.root_hash()
+
+    def run():
+        for proof in proofs:
+            if proof_root(proof, mt.hasher) != rootHash:
+                raise ValueError('证明验证失败')
+    return mt, run, len(proofs)
+
+
+def case_getTreePrime(treeName, size, samples):
+    mt = built_tree(treeName, size)
+    return mt, mt.getTreePrime, 1
+
+
+def case_show(treeName, size, samples):
+    mt = built_tree(treeName, size)
+    return mt, mt.show, 1
+
+
+def case_compare(treeName, size, samples):
+    mt = built_tree(treeName, size)
+    return mt, lambda: mt.compare(showHistory=True), 1
+
+
+CASES = {
+    'build_filling': case_build_filling,
+    'build_imbalance': case_build_imbalance,
+    'add': case_add,
+    'search': case_search,
+    'merkle_path': case_merkle_path,
+    'verify': case_verify,
+    'getTreePrime': case_getTreePrime,
+    'show': case_show,
+    'compare': case_compare,
+}
+
+# 这些操作为整棵树生成 graphviz 图，叶子太多时没有意义
+RENDER_CASES = ('merkle_path', 'show', 'compare')
+
+
+def peak_rss():
+    '''
+    函数功能：当前进程的峰值内存（KB），Linux 上 ru_maxrss 的单位就是 KB
+    '''
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        peak //= 1024
+    return peak
+
+
+def run_case(treeName, caseName, size, samples):
+    '''
+    函数功能：运行一个测试用例（在子进程中），峰值内存包括准备树和数据的部分
+    '''
+    mt, run, count = CASES[caseName](treeName, size, samples)
+    gc.collect()
+    mt.stats.reset()
+    with quiet():
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+    return {
+        'tree': treeName,
+        'op': caseName,
+        'size': size,
+        'count': count,
+        'seconds': seconds,
+        'usPerOp': seconds / count * 1e6,
+        'hashCalls': mt.stats.hashCalls,
+        'nodesAllocated': mt.stats.nodesAllocated,
+        'nodesTraversed': mt.stats.nodesTraversed,
+        'peakRssKB': peak_rss(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+
+
+def previous_results(history):
+    '''
+    函数功能：上一次运行中每个 (树, 操作, 叶子数量) 的结果
+    '''
+    if len(history) == 0:
+        return {}
+    return {(r['tree'], r['op'], r['size']): r for r in history[-1]['results']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merkle 树性能测试')
+    parser.add_argument('--min', type=int, default=10**3, help='最小的叶子数量')
+    parser.add_argument('--max', type=int, default=10**6, help='最大的叶子数量')
+    parser.add_argument('--samples', type=int, default=1000, help='add / search / merkle_path / verify 重复的次数')
+    parser.add_argument('--trees', nargs='+', default=list(TREES), choices=list(TREES))
+    parser.add_argument('--ops', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--show-max', type=int, default=10**4, help='show / compare / merkle_path 的最大叶子数量')
+    parser.add_argument('--prime-max', type=int, default=10**5, help='保留素数乘积的树的最大叶子数量')
+    parser.add_argument('--output', default='benchmark_history.json', help='JSON 历史文件')
+    parser.add_argument('--threshold', type=float, default=0.2, help='比上一次慢多少（比例）时提示')
+    args = parser.parse_args()
+
+    sizes = []
+    size = args.min
+    while size <= args.max:
+        sizes.append(size)
+        size *= 10
+
+    history = load_history(args.output)
+    previous = previous_results(history)
+    results = []
+    for treeName in args.trees:
+        for caseName in args.ops:
+            print(caseName + ':', treeName)
+            for size in sizes:
+                if caseName in RENDER_CASES and size > args.show_max:
+                    continue
+                if treeName in PRIME_TREES and size > args.prime_max:
+                    continue
+                # 每个用例一个新的子进程，峰值内存互不影响
+                with ProcessPoolExecutor(1) as executor:
+                    result = executor.submit(run_case, treeName, caseName, size, args.samples).result()
+                results.append(result)
+
+                line = '  %10d leaves  %12.2f us/op  %10.1f hashes/op  %10s KB' % (
+                    size, result['usPerOp'], result['hashCalls'] / result['count'], result['peakRssKB'])
+                old = previous.get((treeName, caseName, size))
+                if old != None and old['usPerOp'] > 0:
+                    ratio = result['usPerOp'] / old['usPerOp']
+                    line += '  x%.2f' % ratio
+                    if ratio > 1 + args.threshold:
+                        line += '  <- 变慢'
+                print(line)
+
+    history.append({
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'samples': args.samples,
+        'results': results,
+    })
+    save_history(args.output, history)
+    print('INFO: 结果已追加到', args.output)
@@ -0,0 +1,124 @@
+'''
+并发读写的压力测试：一个写者线程不断添加、修改、删除叶子，N 个读者线程同时从 mt.latest() 取快照生成证明，
+每个证明都用同一个快照的树根验证，并核对证明的就是读者挑选的那个叶子（序号和叶子 hash），
+任何一个证明验证失败、证明的是别的叶子或读者抛出异常都算失败
+加上 --direct 时读者直接读正在被修改的树（不取快照），用来对比
+用法：python stress.py [--readers 8] [--writes 2000] [--initial 1000] [--direct]
+'''
+import argparse
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree
+
+
+class ReaderResult:
+
+    def __init__(self):
+        self.proofs = 0     # 验证通过的证明数量
+        self.failures = 0   # 验证失败的证明数量
+        self.wrongLeaf = 0  # 能通过验证、但证明的是别的叶子的证明数量
+        self.errors = []    # 读者抛出的异常
+        self.stale = 0      # 后取到的快照比先取到的旧（发布不是单调的）
+
+
+def writer(mt, writes, seed, done):
+    '''
+    函数功能：写者线程，以添加为主，夹杂批量添加、修改和删除（删除多了会触发 compact 重建整棵树）
+    '''
+    rng = random.Random(seed)
+    try:
+        for i in range(writes):
+            r = rng.random()
+            primes = mt.getTreePrime() if r >= 0.8 else None
+            if r < 0.7:
+                mt.add('w' + str(i))
+            elif r < 0.8:
+                mt.add_many(['w' + str(i) + '.' + str(j) for j in range(rng.randint(2, 20))])
+            elif r < 0.95:
+                mt.update(rng.choice(primes), 'u' + str(i))
+            else:
+                mt.remove(rng.choice(primes))
+    finally:
+        done.set()
+
+
+def reader(mt, direct, seed, done, result):
+    '''
+    函数功能：读者线程，随机挑选叶子生成证明并验证，直到写者结束
+    '''
+    rng = random.Random(seed)
+    lastGeneration = 0
+    while not done.is_set():
+        try:
+            tree = mt if direct else mt.latest()
+            if tree.history < lastGeneration:
+                result.stale += 1
+            lastGeneration = tree.history
+            rootHash = tree.root_hash()
+            count = tree.leaf_count()
+            if count == 0:
+                continue
+            index = rng.randrange(count)
+            leaf = tree.leaf_view(index)
+            if leaf.hash == tree.hasher.tombstoneHash:
+                continue
+            proof = tree.get_proof(leaf.primeNum)
+            if proof == None or not verify_proof(rootHash, proof):
+                result.failures += 1
+            elif proof.leafIndex != index or proof.leafHash != leaf.hash:
+                result.wrongLeaf += 1
+            else:
+                result.proofs += 1
+        except Exception as e:
+            result.errors.append(e)
+
+
+def run(readers=8, writes=2000, initial=1000, direct=False, seed=0):
+    '''
+    函数功能：运行一次压力测试，返回 (每个读者的 ReaderResult, 耗时（秒）)
+    '''
+    mt = MerkleTree(primeProduct=False)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        mt.build_merkle_tree([str(i) for i in range(initial)], way='imbalance')
+        done = threading.Event()
+        results = [ReaderResult() for _ in range(readers)]
+        threads = [threading.Thread(target=reader, args=(mt, direct, seed + 1 + i, done, results[i]))
+                   for i in range(readers)]
+        threads.append(threading.Thread(target=writer, args=(mt, writes, seed, done)))
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='一个写者、多个读者的并发压力测试')
+    parser.add_argument('--readers', type=int, default=8, help='读者线程数')
+    parser.add_argument('--writes', type=int, default=2000, help='写者的写操作次数')
+    parser.add_argument('--initial', type=int, default=1000, help='初始的叶子数量')
+    parser.add_argument('--direct', action='store_true', help='读者直接读正在被修改的树，不取快照')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # 缩短线程切换的间隔，让读者更容易在写操作的中途被调度
+    sys.setswitchinterval(1e-6)
+    results, seconds = run(args.readers, args.writes, args.initial, args.direct, args.seed)
+    proofs = sum(r.proofs for r in results)
+    failures = sum(r.failures for r in results)
+    wrongLeaf = sum(r.wrongLeaf for r in results)
+    errors = [e for r in results for e in r.errors]
+    stale = sum(r.stale for r in results)
+    print('INFO: %d 个读者，%d 次写操作，%.2f 秒' % (args.readers, args.writes, seconds))
+    print('INFO: 验证通过 %d 个证明（%.0f 个/秒），失败 %d 个，证明了别的叶子 %d 个，异常 %d 个，快照倒退 %d 次'
+          % (proofs, proofs / seconds, failures, wrongLeaf, len(errors), stale))
+    for e in errors[:5]:
+        print('INFO: 异常：', repr(e))
+    sys.exit(1 if failures or wrongLeaf or errors or stale else 0)
@@ -0,0 +1,18 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录下，与 main.ipynb 一样直接 import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    '''
+    屏蔽构建和修改树时每个叶子一行的 INFO 输出
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from MerkleProof import tree_height, verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree, merge_levels
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    return MerkleTree if request.param == 'tree' else ArrayMerkleTree
+
+
+def rebuilt_root(mt):
+    # 由当前的叶子 hash 一次性重新构造整棵树的树根
+    hashes = [mt.leaf_view(index).hash for index in range(mt.leaf_count())]
+    return merge_levels(mt.hasher.name, mt.hasher.compat, hashes, tree_height(len(hashes)))[-1][0]
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('size', [1, 2, 3, 4, 5, 7, 8])
+def test_add_root_matches_rebuild(new_tree, way, size):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(size)], way=way)
+    for i in range(20):
+        mt.add('added ' + str(i))
+        assert mt.root_hash() == rebuilt_root(mt)
+    for index in range(mt.leaf_count()):
+        assert verify_proof(mt.root_hash(), mt.get_proof(mt.leaf_view(index).primeNum))
+
+
+def test_add_to_empty_tree(new_tree):
+    mt = new_tree()
+    for i in range(9):
+        mt.add(str(i))
+        assert mt.leaf_count() == i + 1
+        assert mt.root_hash() == rebuilt_root(mt)
+
+
+def test_add_hashes_only_the_right_spine():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(1000)], way='imbalance')
+    stats = mt.enable_stats()
+    for i in range(100):
+        before = stats.hashCalls
+        mt.add(str(i))
+        # 叶子本身一次，加上从叶子到树根的每一层一次
+        assert stats.hashCalls - before <= mt.tree_height() + 1
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('size, batch', [(0, 5), (1, 1), (3, 6), (5, 11), (8, 8), (13, 40)])
+def test_add_many_root_matches_rebuild(new_tree, monkeypatch, way, size, batch):
+    # 叶子的标号是创建时间，固定下来逐个添加和批量添加的叶子才完全相同
+    monkeypatch.setattr(time, 'time', lambda: 1700000000.5)
+    one, many = new_tree(), new_tree()
+    for mt in (one, many):
+        if size > 0:
+            mt.build_merkle_tree([str(i) for i in range(size)], way=way)
+    data = ['batch ' + str(i) for i in range(batch)]
+    for value in data:
+        one.add(value)
+    many.add_many(data)
+    assert many.leaf_count() == one.leaf_count()
+    assert many.root_hash() == one.root_hash() == rebuilt_root(many)
+    for index in range(many.leaf_count()):
+        assert verify_proof(many.root_hash(), many.get_proof(many.leaf_view(index).primeNum))
+
+
+def test_add_many_hashes_each_dirty_node_once():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(1000)], way='imbalance')
+    stats = mt.enable_stats()
+    mt.add_many([str(i) for i in range(24)])
+    # 叶子 1000..1023 各一次；受影响的中间节点第 1~4 层依次为 12、6、3、2 个，更高的每层至多一个
+    assert stats.hashCalls <= 24 + 12 + 6 + 3 + 2 + mt.tree_height()
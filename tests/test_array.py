@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.fixture
+def fixed_time(monkeypatch):
+    # 叶子的标号是创建时间，固定下来两种树的叶子 hash 才能逐字节比较
+    monkeypatch.setattr(time, 'time', lambda: 1700000000.5)
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 13])
+def test_array_root_matches_tree(fixed_time, way, size):
+    data = [str(i) for i in range(size)]
+    mt = MerkleTree()
+    array = ArrayMerkleTree()
+    for tree in (mt, array):
+        tree.build_merkle_tree(data, way=way)
+    assert array.root_hash() == mt.root_hash()
+
+    for tree in (mt, array):
+        tree.add('x')
+    assert array.root_hash() == mt.root_hash()
+
+    for tree in (mt, array):
+        tree.add_many(['y', 'z', 'w'])
+    assert array.root_hash() == mt.root_hash()
+
@@ -0,0 +1,63 @@
+import pytest
+
+import BlockBuilder as blocks
+from BlockBuilder import BlockBuilder, Transaction, simulate_transactions, verify_chain, verify_transaction
+from MerkleStream import stream_merkle_root
+
+
+def test_block_roots_match_transactions():
+    transactions = list(simulate_transactions(2500))
+    builder = BlockBuilder(maxTransactions=1000, maxDelay=float('inf'))
+    chain = list(builder.run(transactions))
+    assert [len(block) for block in chain] == [1000, 1000, 500]
+    assert [tx for block in chain for tx in block.transactions] == transactions
+
+    for block in chain:
+        # 与流式计算的、imbalance 形状的树根相同
+        root, count = stream_merkle_root(tx.encode() for tx in block.transactions)
+        assert block.header.merkleRoot == root and block.header.txCount == count
+        for txIndex in (0, 1, len(block) // 2, len(block) - 1):
+            tx, proof = builder.proof(block.header.index, txIndex)
+            assert verify_transaction(block.header, tx, proof)
+            assert not verify_transaction(block.header, block.transactions[txIndex - 1], proof)
+    assert verify_chain(chain)
+
+    # 改动任何一笔交易或区块的顺序，链都不再成立
+    chain[1].transactions[7] = Transaction('support', 'attacker', chain[1].transactions[7].funding, value=10**6)
+    assert not verify_chain(chain)
+    chain[1].transactions[7] = transactions[1007]
+    assert verify_chain(chain)
+    assert not verify_chain([chain[0], chain[2], chain[1]])
+
+
+def test_parallel_roots_match_serial():
+    transactions = list(simulate_transactions(3000, seed=1))
+    serial = list(BlockBuilder(maxTransactions=1500, maxDelay=float('inf')).run(transactions))
+    builder = BlockBuilder(maxTransactions=1500, maxDelay=float('inf'), workers=2)
+    try:
+        parallel = list(builder.run(transactions))
+    finally:
+        builder.close()
+    assert [block.header.merkleRoot for block in parallel] == [block.header.merkleRoot for block in serial]
+
+
+def test_block_is_sealed_after_max_delay(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(blocks.time, 'monotonic', lambda: now[0])
+    builder = BlockBuilder(maxTransactions=1000, maxDelay=1.0)
+    transactions = list(simulate_transactions(3))
+    assert builder.submit(transactions[0]) == None
+    now[0] += 0.5
+    assert builder.submit(transactions[1]) == None
+    assert builder.poll() == None
+    now[0] += 0.5
+    block = builder.poll()
+    assert block != None and block.transactions == transactions[:2]
+    assert builder.poll() == None
+    assert builder.submit(transactions[2]) == None
+    assert len(builder.chain) == 1
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        Transaction('withdrawAll', 'sender', 'funding')
@@ -0,0 +1,53 @@
+import pytest
+
+from MerkleProof import tree_height, verify_non_membership, verify_proof
+from MappedMerkleTree import MappedMerkleTree
+from MerkleTree import ArrayMerkleTree, merge_levels
+
+
+@pytest.fixture(params=['array', 'mapped'])
+def new_tree(request, tmp_path):
+    # MappedMerkleTree 继承 ArrayMerkleTree 的 compact
+    def new():
+        if request.param == 'mapped':
+            return MappedMerkleTree.create(str(tmp_path / 'tree.mkt'))
+        return ArrayMerkleTree()
+    return new
+
+
+def expected_root(mt):
+    # 由当前的叶子 hash 重新构造整棵树的树根
+    hashes = [mt.get_hash(0, index) for index in range(mt.leaf_count())]
+    return merge_levels(mt.hasher.name, mt.hasher.compat, hashes, tree_height(len(hashes)))[-1][0]
+
+
+@pytest.mark.parametrize('removed', [1, 3, 5])
+def test_compact_tombstones_at_tail(new_tree, removed):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(6)], way='imbalance')
+    primes = [mt.primes[index] for index in range(6)]
+    for prime in primes[6 - removed:]:
+        mt.remove(prime)
+    mt.compact()
+
+    assert mt.leaf_count() == 6 - removed
+    assert mt.root_hash() == expected_root(mt)
+    for prime in primes[:6 - removed]:
+        assert verify_proof(mt.root_hash(), mt.get_proof(prime))
+
+
+def test_compact_sorted_remove_max_key(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(6)], sorted=True)
+    primes = [mt.primes[index] for index in range(6)]
+    # 有序模式下删除留下墓碑，不打乱键的顺序，最大的键是最后一个叶子
+    mt.remove(primes[-1])
+    assert mt.leaf_count() == 6
+    assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(5))
+
+    mt.compact()
+    assert mt.leaf_count() == 5
+    assert mt.root_hash() == expected_root(mt)
+    for prime in primes[:-1]:
+        assert verify_proof(mt.root_hash(), mt.get_proof(prime))
+    assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(5))
@@ -0,0 +1,66 @@
+import pytest
+
+from MerkleProof import verify_consistency
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    def new_tree():
+        if request.param == 'tree':
+            return MerkleTree(primeProduct=False)
+        return ArrayMerkleTree()
+    return new_tree
+
+
+def grow(mt):
+    '''
+    4 个叶子之后追加、修改、删除，返回每个叶子数量最后一次出现时的树根
+    第 4 个叶子（序号 4）在叶子数量为 5 之后被修改，序号 5 的叶子被删除（留下墓碑）
+    '''
+    mt.build_merkle_tree([str(i) for i in range(4)], way='imbalance')
+    roots = {4: mt.root_hash()}
+    mt.add('4')
+    roots[5] = mt.root_hash()
+    mt.add('5')
+    primes = [mt.leaf_view(index).primeNum for index in range(6)]
+    mt.update(primes[4], 'four')
+    mt.remove(primes[5])
+    roots[6] = mt.root_hash()
+    mt.add('6')
+    roots[7] = mt.root_hash()
+    return roots
+
+
+def test_consistency_after_update_and_remove(new_tree):
+    mt = new_tree()
+    roots = grow(mt)
+    for size in roots:
+        assert mt.version_of_size(size).root_hash() == roots[size]
+
+    for oldSize, newSize in ((4, 5), (4, 6), (4, 7), (6, 7), (5, 5)):
+        proof = mt.consistency_proof(oldSize, newSize)
+        assert verify_consistency(roots[oldSize], roots[newSize], proof), (oldSize, newSize)
+    assert verify_consistency(roots[4], mt.root_hash(), mt.consistency_proof(4))
+
+    # 叶子数量为 5 之后序号 4 的叶子被修改过，5 个叶子的旧树不再是前缀
+    assert not verify_consistency(roots[5], roots[7], mt.consistency_proof(5, 7))
+
+
+def test_remove_inside_prefix_breaks_consistency(new_tree):
+    mt = new_tree()
+    roots = grow(mt)
+    mt.remove(mt.leaf_view(1).primeNum)
+    assert not verify_consistency(roots[4], mt.root_hash(), mt.consistency_proof(4))
+
+
+def test_snapshot_only_sees_earlier_versions(new_tree):
+    mt = new_tree()
+    roots = grow(mt)
+    snapshot = mt.at(mt.history - 1)
+    assert snapshot.leaf_count() == 6
+    assert snapshot.version_of_size(5).root_hash() == roots[5]
+    with pytest.raises(ValueError):
+        snapshot.version_of_size(7)
+    with pytest.raises(ValueError):
+        mt.version_of_size(8)
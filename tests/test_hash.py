@@ -0,0 +1,63 @@
+import hashlib
+
+import pytest
+
+from MerkleHash import MerkleHasher
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+BACKENDS = ['sha256', 'blake2b', 'sha3', 'blake3']
+
+
+def backend(name):
+    if name == 'blake3':
+        pytest.importorskip('blake3')
+    return MerkleHasher(name)
+
+
+def test_sha256_domain_separation():
+    hasher = MerkleHasher()
+    left, right = hasher.leaf(b'a'), hasher.leaf(b'b')
+    assert left == hashlib.sha256(b'\x00a').digest()
+    assert hasher.node(left, right) == hashlib.sha256(b'\x01' + left + right).digest()
+    assert hasher.node(left) == hashlib.sha256(b'\x01' + left).digest()
+    # 叶子和中间节点的 hash 不会混淆
+    assert hasher.leaf(left + right) != hasher.node(left, right)
+
+
+def test_compat_matches_hex_concatenation():
+    hasher = MerkleHasher(compat=True)
+    left, right = hasher.leaf(b'a'), hasher.leaf(b'b')
+    assert left == hashlib.sha256(b'a').digest()
+    assert hasher.node(left, right) == hashlib.sha256((left.hex() + right.hex()).encode()).digest()
+    assert hasher.node(left) == hashlib.sha256(left.hex().encode()).digest()
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_backends_give_32_byte_digests(name):
+    hasher = backend(name)
+    assert len(hasher.leaf(b'data')) == hasher.HASH_SIZE == 32
+    assert len(hasher.node(hasher.leaf(b'a'), hasher.leaf(b'b'))) == 32
+    assert hasher.tombstoneHash == hasher.leaf(b'')
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        MerkleHasher('md5')
+
+
+@pytest.mark.parametrize('cls', [MerkleTree, ArrayMerkleTree])
+@pytest.mark.parametrize('name', BACKENDS)
+def test_trees_use_the_chosen_backend(cls, name):
+    backend(name)
+    mt = cls(hashName=name)
+    mt.build_merkle_tree([str(i) for i in range(6)], way='imbalance')
+    assert mt.hasher.name == name
+    for prime in mt.getTreePrime():
+        proof = mt.get_proof(prime)
+        assert proof.hashName == name
+        assert verify_proof(mt.root_hash(), proof)
+    # 叶子的 hash 由选择的算法计算
+    leaf = mt.leaf_view(0)
+    assert leaf.hash == MerkleHasher(name).leaf(mt.leaf_payload(leaf.value, str(leaf.primeNum), str(leaf.id)))
@@ -0,0 +1,42 @@
+import pytest
+
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+def interior_nodes(mt):
+    level = [mt.root]
+    nodes = []
+    while len(level) > 0:
+        nodes.extend(node for node in level if node.depth > 0)
+        level = [child for node in level for child in (node.leftNode, node.rightNode) if child != None]
+    return nodes
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_interior_nodes_keep_no_value(way):
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(5)], way=way)
+    mt.add('x')
+    mt.add_many(['y', 'z'])
+    nodes = interior_nodes(mt)
+    assert len(nodes) > 0
+    assert all(node.value == None for node in nodes)
+    # 打印不保存数据的节点
+    assert str(nodes[0]).startswith('Node(value=None')
+
+
+def test_labels_come_from_first_and_last_leaf():
+    mt = MerkleTree()
+    array = ArrayMerkleTree()
+    for tree in (mt, array):
+        tree.build_merkle_tree(['a', 'b', 'c', 'd', 'e'], way='imbalance')
+    assert mt.node_label(mt.root) == 'a ~ e\nchilds: 5'
+    assert mt.node_label(mt.root.leftNode) == 'a ~ d\nchilds: 4'
+    assert mt.node_label(mt.root.rightNode) == 'e\nchilds: 1'
+
+    # 数组存储的树显示相同的数据
+    height = array.tree_height()
+    assert array.range_value(height, 0) == 'a ~ e'
+    assert array.range_value(height - 1, 0) == 'a ~ d'
+    assert array.range_value(height - 1, 1) == 'e'
+    assert array.node_view(height, 0).value == 'a ~ e'
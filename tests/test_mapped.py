@@ -0,0 +1,52 @@
+import pytest
+
+from MappedMerkleTree import MappedMerkleTree
+from MerkleProof import verify_non_membership
+from MerkleTree import TOMBSTONE
+
+
+def test_reset_is_rejected(tmp_path):
+    mt = MappedMerkleTree.create(str(tmp_path / 'tree.mkt'))
+    mt.build_merkle_tree([str(i) for i in range(4)], way='imbalance')
+    rootHash = mt.root_hash()
+    with pytest.raises(TypeError):
+        mt.reset()
+    assert mt.leaf_count() == 4
+    assert mt.root_hash() == rootHash
+
+
+def test_sorted_mode_survives_reopen(tmp_path):
+    path = str(tmp_path / 'tree.mkt')
+    mt = MappedMerkleTree.create(path)
+    mt.build_merkle_tree([str(key) for key in (90, 3, 41, 12, 77)], sorted=True)
+    mt.close()
+
+    mt = MappedMerkleTree.open(path)
+    assert mt.sortedKeys != None
+    assert mt.locate_key(41) == 2
+    assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(40))
+    mt.add('40')
+    mt.remove(mt.leaf_view(mt.locate_key(12)).primeNum)
+    rootHash = mt.root_hash()
+    mt.close()
+
+    mt = MappedMerkleTree.open(path)
+    assert mt.root_hash() == rootHash
+    values = [mt.leaf_view(index).value for index in range(mt.leaf_count())]
+    assert [value for value in values if value != TOMBSTONE] == ['3', '40', '41', '77', '90']
+    assert mt.locate_key(12) == None and mt.locate_key(40) == 2
+    for key in (12, 50, 100):
+        assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(key))
+    mt.close()
+
+
+def test_unsorted_tree_stays_unsorted(tmp_path):
+    path = str(tmp_path / 'tree.mkt')
+    mt = MappedMerkleTree.create(path)
+    mt.build_merkle_tree(['b', 'a'], way='imbalance')
+    mt.close()
+    mt = MappedMerkleTree.open(path)
+    assert mt.sortedKeys == None
+    with pytest.raises(ValueError):
+        mt.locate_key(1)
+    mt.close()
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from MerkleProof import MultiProof, verify_multiproof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    return MerkleTree if request.param == 'tree' else ArrayMerkleTree
+
+
+def primes_at(mt, indices):
+    return [mt.leaf_view(index).primeNum for index in indices]
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('size', [1, 2, 5, 8, 13, 32])
+def test_multiproof_round_trip(new_tree, way, size):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(size)], way=way)
+    count = mt.leaf_count()
+    rng = random.Random(size)
+    cases = [[0], [count - 1], list(range(count))]
+    cases += [rng.sample(range(count), rng.randint(1, count)) for _ in range(5)]
+    for indices in cases:
+        proof = mt.multiproof(primes_at(mt, indices))
+        assert proof.leafIndices == sorted(set(indices))
+        assert verify_multiproof(mt.root_hash(), proof)
+
+
+def test_duplicate_and_adjacent_indices_share_hashes(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(16)], way='imbalance')
+    single = mt.multiproof(primes_at(mt, [4]))
+    # 重复的叶子只出现一次
+    duplicated = mt.multiproof(primes_at(mt, [4, 4, 4]))
+    assert duplicated.leafIndices == [4] and duplicated.hashes == single.hashes
+    # 相邻的兄弟叶子互相作证，不再需要最底层的作证 hash
+    adjacent = mt.multiproof(primes_at(mt, [5, 4]))
+    assert adjacent.leafIndices == [4, 5]
+    assert len(adjacent) == len(single) - 1
+    assert verify_multiproof(mt.root_hash(), adjacent)
+    # 所有的叶子都在时不需要任何作证 hash
+    assert len(mt.multiproof(primes_at(mt, range(16)))) == 0
+
+
+def test_tampered_multiproof_is_rejected(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(13)], way='imbalance')
+    root = mt.root_hash()
+    proof = mt.multiproof(primes_at(mt, [1, 6, 7, 12]))
+    assert verify_multiproof(root, proof)
+
+    def forged(**changes):
+        fields = dict(leafIndices=proof.leafIndices, leafHashes=proof.leafHashes, hashes=proof.hashes,
+                      leafCount=proof.leafCount, hashName=proof.hashName, compat=proof.compat)
+        fields.update(changes)
+        return MultiProof(**fields)
+
+    assert not verify_multiproof(root, forged(leafHashes=[mt.leaf_view(0).hash] + proof.leafHashes[1:]))
+    assert not verify_multiproof(root, forged(leafIndices=[0, 6, 7, 12]))
+    assert not verify_multiproof(root, forged(leafIndices=[6, 1, 7, 12]))
+    assert not verify_multiproof(root, forged(hashes=proof.hashes[:-1]))
+    assert not verify_multiproof(root, forged(hashes=proof.hashes + [root]))
+    assert not verify_multiproof(root, forged(leafCount=20))
+    assert mt.multiproof([10**12 + 39]) == None
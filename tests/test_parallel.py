@@ -0,0 +1,23 @@
+import time
+
+import pytest
+
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.mark.parametrize('cls', [MerkleTree, ArrayMerkleTree])
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_parallel_build_matches_serial(monkeypatch, cls, way):
+    # 叶子的标号是创建时间，固定下来两次构建的叶子才完全相同；hash 在子进程中计算，不读取时间
+    monkeypatch.setattr(time, 'time', lambda: 1700000000.5)
+    for size in (1, 3, 100, 1000):
+        data = [str(i) for i in range(size)]
+        serial = cls()
+        serial.build_merkle_tree(data, way=way)
+        parallel = cls()
+        parallel.build_merkle_tree(data, way=way, workers=2)
+        assert parallel.leaf_count() == serial.leaf_count()
+        assert parallel.root_hash() == serial.root_hash()
+        prime = parallel.leaf_view(size // 2).primeNum
+        assert verify_proof(parallel.root_hash(), parallel.get_proof(prime))
@@ -0,0 +1,19 @@
+from math import prod
+
+from MerkleTree import MerkleTree
+
+
+def test_default_tree_keeps_no_products():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(5)], way='imbalance')
+    mt.add('5')
+    assert mt.primeProduct == False
+    assert mt.root.primeNum == None
+
+
+def test_prime_product_on_request():
+    product = MerkleTree(primeProduct=True)
+    product.build_merkle_tree([str(i) for i in range(5)], way='imbalance')
+    product.add('5')
+    primes = [int(product.leaf_view(index).primeNum) for index in range(product.leaf_count())]
+    assert int(product.root.primeNum) == prod(primes)
@@ -0,0 +1,68 @@
+import pytest
+
+from MerkleProof import MerkleProof, proof_root, verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    return MerkleTree if request.param == 'tree' else ArrayMerkleTree
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+@pytest.mark.parametrize('size', [1, 2, 5, 8, 11])
+def test_every_leaf_has_a_compact_proof(new_tree, way, size):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(size)], way=way)
+    root = mt.root_hash()
+    for prime in mt.getTreePrime():
+        proof = mt.get_proof(prime)
+        assert len(proof) == mt.tree_height()
+        assert proof.leafHash == mt.leaf_view(proof.leafIndex).hash
+        assert verify_proof(root, proof)
+        # 十六进制的树根也可以
+        assert verify_proof(root.hex(), proof)
+
+
+def test_tampered_proof_is_rejected(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(11)], way='imbalance')
+    root = mt.root_hash()
+    proof = mt.get_proof(mt.leaf_view(4).primeNum)
+    assert proof_root(proof) == root
+
+    forged = MerkleProof(mt.leaf_view(5).hash, proof.leafIndex, proof.path, proof.hashName, proof.compat)
+    assert not verify_proof(root, forged)
+    for depth, (siblingHash, siblingIsLeft) in enumerate(proof.path):
+        path = list(proof.path)
+        if siblingHash != None:
+            path[depth] = (bytes(len(siblingHash)), siblingIsLeft)
+            assert not verify_proof(root, MerkleProof(proof.leafHash, 4, path, proof.hashName, proof.compat))
+            path[depth] = (siblingHash, not siblingIsLeft)
+            assert not verify_proof(root, MerkleProof(proof.leafHash, 4, path, proof.hashName, proof.compat))
+    assert not verify_proof(bytes(len(root)), proof)
+    assert not verify_proof(root, None)
+
+
+def test_proof_for_missing_leaf_is_none(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(4)], way='imbalance')
+    assert mt.get_proof(10**12 + 39) == None
+
+
+def test_search_copies_only_the_path():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(16)], way='imbalance')
+    root = mt.root
+    prime = mt.leaf_view(6).primeNum
+    thisNode, proofPath = mt.search(prime)
+    assert thisNode is mt.leaf_view(6)
+    assert mt.root is root and proofPath is not root
+
+    # 复制的只有树根到叶子的路径和路径旁边作证的节点
+    copied = []
+    level = [proofPath]
+    while len(level) > 0:
+        copied.extend(level)
+        level = [child for node in level for child in (node.leftNode, node.rightNode) if child != None]
+    assert len(copied) == 1 + 2 * mt.tree_height()
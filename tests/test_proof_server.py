@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree
+from ProofServer import ProofServer, ProofClient
+
+
+def built_tree(size):
+    mt = MerkleTree(primeProduct=False)
+    mt.build_merkle_tree([str(i) for i in range(size)], way='imbalance')
+    return mt
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_proofs_follow_latest_generation(workers):
+    mt = built_tree(50)
+    primes = [mt.leaf_view(index).primeNum for index in range(50)]
+
+    async def main():
+        server = ProofServer(mt, workers=workers)
+        client = ProofClient(server)
+        for round in range(3):
+            for index in range(50):
+                if index == 7 and round > 0:
+                    continue
+                generation, rootHash, proof = await client.get_proof(primes[index])
+                assert generation == mt.history and rootHash == mt.root_hash()
+                assert proof.leafHash == mt.leaf_view(proof.leafIndex).hash
+                assert int(mt.leaf_view(proof.leafIndex).primeNum) == int(primes[index])
+            if round == 0:
+                mt.remove(primes[7])
+            mt.add('round ' + str(round))
+        assert server.cache.hits == 0
+        server.close()
+    asyncio.run(main())
+
+
+def test_unknown_prime_is_rejected_without_proving_and_cached(monkeypatch):
+    mt = built_tree(200)
+    removed = mt.leaf_view(5).primeNum
+    mt.remove(removed)
+    # 素数索引就能说明叶子不在树上，不生成证明
+    proved = []
+    monkeypatch.setattr(MerkleTree, 'proof_by_index', lambda self, index: proved.append(index))
+
+    async def main():
+        server = ProofServer(mt)
+        for prime in (removed, 10**12 + 39):
+            assert (await server.handle(prime))[2] == None
+            hits = server.cache.hits
+            assert (await server.handle(prime))[2] == None
+            assert server.cache.hits == hits + 1
+    asyncio.run(main())
+    assert proved == []
+
+
+def test_concurrent_requests_are_coalesced():
+    mt = built_tree(100)
+    prime = mt.leaf_view(7).primeNum
+
+    async def main():
+        server = ProofServer(mt, workers=2)
+        client = ProofClient(server)
+        results = await asyncio.gather(*(client.get_proof(prime) for _ in range(20)))
+        assert server.coalesced == 19
+        assert all(result[2] is results[0][2] for result in results)
+        assert verify_proof(results[0][1], results[0][2])
+        server.close()
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import json
+import os
+import re
+
+import pytest
+
+import MerkleTree as merkle
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'show_dot.json')
+TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|->|[\[\]=\n]|[^\s\[\]="]+')
+
+
+def parse_dot(source):
+    '''
+    把 DOT 源码解析成 {'nodes': {名字: 属性}, 'edges': [(起点, 终点, 属性)], 'graph': 属性}
+    同一个节点多次声明时属性合并、后面的覆盖前面的，与 graphviz 的语义相同，书写的顺序和分组不影响结果
+    '''
+    tokens = [token[1:-1] if token.startswith('"') else token
+              for token in TOKEN.findall(source[source.index('{') + 1:source.rindex('}')])]
+    nodes, edges, graph = {}, [], {}
+    statement = []
+    for token in tokens + ['\n']:
+        if token != '\n' or statement.count('[') > statement.count(']'):
+            statement.append(token)
+            continue
+        if len(statement) == 0:
+            continue
+        attrs = {}
+        if '[' in statement:
+            body = statement[statement.index('[') + 1:-1]
+            attrs = {body[i]: body[i + 2] for i in range(0, len(body), 3)}
+            statement = statement[:statement.index('[')]
+        if len(statement) == 3 and statement[1] == '->':
+            edges.append((statement[0], statement[2], sorted(attrs.items())))
+        elif len(statement) == 3 and statement[1] == '=':
+            graph[statement[0]] = statement[2]
+        elif statement[0] == 'graph':
+            graph.update(attrs)
+        else:
+            nodes.setdefault(statement[0], {}).update(attrs)
+        statement = []
+    return {'nodes': nodes, 'edges': sorted(edges), 'graph': graph}
+
+
+def build(cls, way, count):
+    mt = cls()
+    if count > 0:
+        mt.build_merkle_tree([str(i) for i in range(count)], way=way)
+    mt.add('x')
+    mt.add('yy yy')
+    return mt
+
+
+def outputs(mt):
+    return {
+        'show': mt.show().source,
+        'show_string': mt.show(string='hi').source,
+        'compare': mt.compare().source,
+        'compare_history': mt.compare(True).source,
+    }
+
+
+CASES = [(cls, way, count) for cls in (MerkleTree, ArrayMerkleTree)
+         for way in ('filling', 'imbalance') for count in (0, 5)]
+
+
+@pytest.fixture
+def fixed_ids(monkeypatch):
+    # 节点的标号来自 time.time()，换成递增的计数，输出可以重复
+    clock = iter(range(1000, 10**6))
+    monkeypatch.setattr(merkle.time, 'time', lambda: next(clock))
+
+
+@pytest.mark.parametrize('cls, way, count', CASES)
+def test_show_matches_previous_output(fixed_ids, cls, way, count):
+    # show_tree 之前的实现输出的图（data/show_dot.json），不带新参数时语义上相同
+    with open(DATA, encoding='utf-8') as f:
+        expected = json.load(f)[cls.__name__ + '.' + way + '.' + str(count)]
+    for name, source in outputs(build(cls, way, count)).items():
+        actual = json.loads(json.dumps(parse_dot(source)))
+        assert actual == expected[name], name
+
+
+@pytest.mark.parametrize('cls', [MerkleTree, ArrayMerkleTree])
+def test_dot_writer_matches_digraph(fixed_ids, tmp_path, cls):
+    mt = build(cls, 'imbalance', 11)
+    prime = mt.getTreePrime()[4]
+    path = str(tmp_path / 'tree.dot')
+    for kwargs in ({}, {'maxDepth': 2}, {'around': prime, 'window': 1}, {'since': mt.history - 1}):
+        for method in (mt.show, mt.compare):
+            expected = parse_dot(method(**kwargs).source)
+            method(path=path, **kwargs)
+            with open(path, encoding='utf-8') as f:
+                assert parse_dot(f.read()) == expected
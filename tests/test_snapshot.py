@@ -0,0 +1,84 @@
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+def test_old_version_with_tombstone_after_compact():
+    # 第 generation 代的树上有一个墓碑，之后 compact 移动了叶子
+    mt = MerkleTree(primeProduct=False)
+    mt.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    primes = [mt.leaf_view(index).primeNum for index in range(8)]
+    mt.remove(primes[2])
+    generation = mt.history
+    for index in (0, 1, 3, 4):
+        mt.remove(primes[index])
+    assert mt.leaf_count() == 3
+
+    snapshot = mt.at(generation)
+    for index in (0, 1, 3, 4, 5, 6, 7):
+        proof = snapshot.get_proof(primes[index])
+        assert proof.leafIndex == index
+        assert proof.leafHash == snapshot.leaf_view(index).hash
+        assert verify_proof(snapshot.root_hash(), proof)
+    assert snapshot.get_proof(primes[2]) == None
+
+
+def test_array_old_version_after_sorted_insert():
+    mt = ArrayMerkleTree()
+    mt.build_merkle_tree([str(i * 10) for i in range(8)], sorted=True)
+    primes = [mt.primes[index] for index in range(8)]
+    generation = mt.history
+    mt.add('15')
+
+    snapshot = mt.at(generation)
+    for index in range(8):
+        proof = snapshot.get_proof(primes[index])
+        assert proof.leafIndex == index
+        assert verify_proof(snapshot.root_hash(), proof)
+
+
+def test_latest_is_isolated_from_later_removes():
+    mt = MerkleTree(primeProduct=False)
+    mt.build_merkle_tree([str(i) for i in range(10)], way='imbalance')
+    primes = [mt.leaf_view(index).primeNum for index in range(10)]
+    mt.remove(primes[2])
+    # 快照中有一个墓碑；之后删除到触发 compact，叶子的位置都发生了变化
+    snapshot = mt.latest()
+    for index in (5, 0, 1, 3, 4):
+        mt.remove(primes[index])
+    mt.add('new')
+
+    assert snapshot.get_proof(primes[2]) == None
+    for index in (0, 1, 3, 4, 5, 6, 7, 8, 9):
+        proof = snapshot.get_proof(primes[index])
+        assert proof.leafIndex == index
+        assert proof.leafHash == snapshot.leaf_view(index).hash
+        assert verify_proof(snapshot.root_hash(), proof)
+    assert mt.latest().get_proof(primes[5]) == None
+    assert mt.latest().get_proof(primes[6]).leafIndex == 0
+
+
+def test_sync_moves_are_isolated():
+    # 素数池是确定的，两棵树的第 i 个素数相同；source compact 之后叶子 7..11 移到了 0..4
+    source = MerkleTree(primeProduct=False)
+    source.build_merkle_tree([str(i) for i in range(12)], way='imbalance')
+    for index in range(7):
+        source.remove(source.leaf_view(index).primeNum)
+    replica = MerkleTree(primeProduct=False)
+    replica.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    primes = [replica.leaf_view(index).primeNum for index in range(8)]
+    snapshot = replica.latest()
+    replica.sync(source)
+    assert replica.root_hash() == source.root_hash()
+
+    for index in range(8):
+        assert snapshot.get_proof(primes[index]).leafIndex == index
+    assert replica.latest().get_proof(primes[7]).leafIndex == 0
+    assert replica.latest().get_proof(primes[0]) == None
+
+
+def test_stress_readers_see_consistent_snapshots():
+    import stress
+    results, _ = stress.run(readers=4, writes=300, initial=200)
+    assert sum(r.proofs for r in results) > 0
+    for r in results:
+        assert r.failures == 0 and r.wrongLeaf == 0 and r.stale == 0 and r.errors == []
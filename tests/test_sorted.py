@@ -0,0 +1,170 @@
+import pytest
+
+from MerkleProof import NonMembershipProof, tree_height, verify_non_membership, verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree, TOMBSTONE, merge_levels
+
+
+KEYS = [3, 12, 25, 40, 41, 77, 90]
+
+
+@pytest.fixture(params=['tree', 'array'])
+def sorted_tree(request):
+    mt = MerkleTree(primeProduct=False) if request.param == 'tree' else ArrayMerkleTree()
+    mt.build_merkle_tree([str(key) for key in reversed(KEYS)], sorted=True)
+    return mt
+
+
+def leaf_keys(mt):
+    # 墓碑不计入
+    values = [mt.leaf_view(index).value for index in range(mt.leaf_count())]
+    return [int(value) for value in values if value != TOMBSTONE]
+
+
+def remove_keys(mt, keys):
+    for key in keys:
+        mt.remove(mt.leaf_view(mt.locate_key(key)).primeNum)
+
+
+def test_build_sorts_leaves(sorted_tree):
+    assert leaf_keys(sorted_tree) == KEYS
+
+
+@pytest.mark.parametrize('key', [0, 2, 4, 13, 39, 42, 89, 91, 1000])
+def test_absent_key_is_proven(sorted_tree, key):
+    proof = sorted_tree.non_membership_proof(key)
+    assert verify_non_membership(sorted_tree.root_hash(), proof)
+    assert not verify_non_membership(sorted_tree.root_hash(), NonMembershipProof(
+        KEYS[3], proof.left, proof.right, proof.hashName, proof.compat))
+
+
+def test_present_key_has_no_proof(sorted_tree):
+    for key in KEYS:
+        assert sorted_tree.non_membership_proof(key) == None
+
+
+def test_resplit_neighbour_cannot_hide_key(sorted_tree):
+    # 把叶子 '12' 的数据和素数重新拆分成 '1' 和 '2' + 素数，拼接起来完全相同
+    index = KEYS.index(12)
+    value, primeNum, id, leafProof = sorted_tree.leaf_witness(index)
+    forged = ('1', '2' + primeNum, id, leafProof)
+    right = sorted_tree.leaf_witness(index + 1)
+    proof = NonMembershipProof(12, forged, right, sorted_tree.hasher.name, sorted_tree.hasher.compat)
+    assert not verify_non_membership(sorted_tree.root_hash(), proof)
+    # 只把邻居换成另一个键也不行
+    proof = NonMembershipProof(12, sorted_tree.leaf_witness(index - 1), right,
+                               sorted_tree.hasher.name, sorted_tree.hasher.compat)
+    assert not verify_non_membership(sorted_tree.root_hash(), proof)
+
+
+def test_add_update_remove_keep_order(sorted_tree):
+    sorted_tree.add('30')
+    sorted_tree.add_many(['1', '95', '26'])
+    keys = sorted(KEYS + [30, 1, 95, 26])
+    assert leaf_keys(sorted_tree) == keys
+
+    prime = sorted_tree.leaf_view(sorted_tree.locate_key(40)).primeNum
+    sorted_tree.update(prime, '50')
+    keys = sorted(set(keys) - {40} | {50})
+    prime = sorted_tree.leaf_view(sorted_tree.locate_key(77)).primeNum
+    sorted_tree.remove(prime)
+    keys.remove(77)
+
+    assert leaf_keys(sorted_tree) == keys
+    for key in (40, 77, 0, 28, 96):
+        assert verify_non_membership(sorted_tree.root_hash(), sorted_tree.non_membership_proof(key))
+    for key in keys:
+        assert sorted_tree.non_membership_proof(key) == None
+        proof = sorted_tree.get_proof(sorted_tree.leaf_view(sorted_tree.locate_key(key)).primeNum)
+        assert verify_proof(sorted_tree.root_hash(), proof)
+
+
+def test_remove_keeps_tombstones_in_place(sorted_tree):
+    mt = sorted_tree
+    mt.compactRatio = 1
+    remove_keys(mt, [3, 40, 41, 90])
+    assert mt.leaf_count() == len(KEYS)
+    assert leaf_keys(mt) == [12, 25, 77]
+    root = mt.root_hash()
+    for key in (0, 3, 12, 25, 26, 40, 41, 50, 77, 90, 95):
+        proof = mt.non_membership_proof(key)
+        if key in (12, 25, 77):
+            assert proof == None
+            assert mt.locate_key(key) != None
+            continue
+        assert mt.locate_key(key) == None
+        assert verify_non_membership(root, proof), key
+    # 40、41 夹在 25 和 77 之间，3 在最前面，90 在最后面
+    assert len(mt.non_membership_proof(50).gap) == 2
+    assert len(mt.non_membership_proof(0).gap) == 1
+    assert len(mt.non_membership_proof(95).gap) == 1
+
+    # 证明中的墓碑不能省略，也不能换成别的叶子
+    proof = mt.non_membership_proof(50)
+    for gap in ([], proof.gap[:1], [proof.gap[0], mt.leaf_witness(KEYS.index(25))[3]]):
+        forged = NonMembershipProof(50, proof.left, proof.right, proof.hashName, proof.compat, gap)
+        assert not verify_non_membership(root, forged)
+    proof = mt.non_membership_proof(95)
+    assert not verify_non_membership(root, NonMembershipProof(
+        95, proof.left, None, proof.hashName, proof.compat))
+
+
+def test_readd_after_remove(sorted_tree):
+    mt = sorted_tree
+    mt.compactRatio = 1
+    remove_keys(mt, [40, 41])
+    mt.add_many(['41', '40'])
+    assert leaf_keys(mt) == KEYS
+    remove_keys(mt, [3])
+    mt.add('3')
+    assert leaf_keys(mt) == KEYS
+    for key in KEYS:
+        assert verify_proof(mt.root_hash(), mt.get_proof(mt.leaf_view(mt.locate_key(key)).primeNum))
+    for key in (2, 4, 39, 42, 91):
+        assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(key))
+
+
+def test_snapshot_proves_absence_across_tombstones(sorted_tree):
+    mt = sorted_tree
+    mt.compactRatio = 1
+    remove_keys(mt, [40, 41])
+    snapshot = mt.at(mt.history)
+    mt.add('45')
+    assert snapshot.locate_key(40) == None
+    assert verify_non_membership(snapshot.root_hash(), snapshot.non_membership_proof(45))
+    assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(44))
+
+
+def test_compact_keeps_prefix_subtrees():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(key) for key in range(12)], sorted=True)
+    left = mt.root.leftNode
+    remove_keys(mt, [9])
+    mt.compact()
+    # 第一个墓碑之前的前 8 个叶子的子树原样保留
+    assert mt.root.leftNode is left
+    assert mt.leaf_count() == 11
+    assert leaf_keys(mt) == [key for key in range(12) if key != 9]
+    hashes = [mt.leaf_view(index).hash for index in range(11)]
+    assert mt.root_hash() == merge_levels(mt.hasher.name, mt.hasher.compat, hashes, tree_height(11))[-1][0]
+    for key in leaf_keys(mt):
+        assert verify_proof(mt.root_hash(), mt.get_proof(mt.leaf_view(mt.locate_key(key)).primeNum))
+    assert verify_non_membership(mt.root_hash(), mt.non_membership_proof(9))
+
+
+def test_middle_insert_keeps_prefix_subtrees():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(key * 2) for key in range(12)], sorted=True)
+    left = mt.root.leftNode
+    version = mt.history
+    snapshot = mt.at(version)
+    mt.add_many(['17', '21'])
+    # 插入点之前的前 8 个叶子的子树原样保留
+    assert mt.root.leftNode is left
+    assert leaf_keys(mt) == sorted([key * 2 for key in range(12)] + [17, 21])
+    hashes = [mt.leaf_view(index).hash for index in range(14)]
+    assert mt.root_hash() == merge_levels(mt.hasher.name, mt.hasher.compat, hashes, tree_height(14))[-1][0]
+    for key in leaf_keys(mt):
+        assert verify_proof(mt.root_hash(), mt.get_proof(mt.leaf_view(mt.locate_key(key)).primeNum))
+    # 旧版本中后移的叶子仍然在原来的位置
+    assert snapshot.locate_key(18) == 9
+    assert verify_proof(snapshot.root_hash(), snapshot.get_proof(snapshot.leaf_view(9).primeNum))
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from MerkleHash import MerkleHasher
+from MerkleProof import default_hashes, sparse_leaf_data, verify_sparse
+from SparseMerkleTree import SparseMerkleTree
+
+
+def naive_root(values, keyBits):
+    '''
+    逐层计算所有非空节点，空的孩子取空子树的 hash
+    '''
+    hasher = MerkleHasher()
+    defaults = default_hashes(hasher, keyBits)
+    level = {key: hasher.leaf(sparse_leaf_data(key, value, keyBits)) for key, value in values.items()}
+    for height in range(keyBits):
+        parents = {}
+        for prefix in {key >> 1 for key in level}:
+            left = level.get(prefix << 1, defaults[height])
+            right = level.get(prefix << 1 | 1, defaults[height])
+            parents[prefix] = hasher.node(left, right)
+        level = parents
+    return level.get(0, defaults[keyBits])
+
+
+def random_key(rng, keyBits, keys):
+    # 一半的键与已有的键只有最低的几位不同，覆盖在各个高度分开的情况
+    if len(keys) > 0 and rng.random() < 0.5:
+        return rng.choice(keys) ^ rng.randrange(1, 1 << min(keyBits, rng.randint(1, 8)))
+    return rng.getrandbits(keyBits)
+
+
+# 160 位时逐层计算的开销大，少做几步
+@pytest.mark.parametrize('keyBits, steps', [(4, 200), (8, 200), (16, 200), (160, 50)])
+def test_random_updates_match_naive_root(keyBits, steps):
+    rng = random.Random(keyBits)
+    smt = SparseMerkleTree(keyBits)
+    values = {}
+    assert smt.root_hash() == naive_root(values, keyBits)
+    for step in range(steps):
+        keys = list(values)
+        mapping = {}
+        for _ in range(rng.choice([1, 1, 1, 5, 20])):
+            if len(keys) > 0 and rng.random() < 0.3:
+                mapping[rng.choice(keys)] = None
+            else:
+                mapping[random_key(rng, keyBits, keys)] = 'v' + str(rng.randrange(1000))
+        if len(mapping) == 1:
+            key, value = mapping.popitem()
+            smt.set(key, value)
+            mapping[key] = value
+        else:
+            smt.update_many(mapping)
+        for key, value in mapping.items():
+            if value == None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+
+        assert len(smt) == len(values)
+        assert smt.root_hash() == naive_root(values, keyBits)
+        # 在树上的键证明它的值，不在树上的键证明它不在
+        for key in rng.sample(list(values), min(3, len(values))) + [random_key(rng, keyBits, keys)]:
+            proof = smt.prove(key)
+            assert proof.value == values.get(key)
+            assert verify_sparse(smt.root_hash(), proof)
+
+    # 修改的顺序不影响树根
+    rebuilt = SparseMerkleTree(keyBits)
+    rebuilt.update_many(values)
+    assert rebuilt.root_hash() == smt.root_hash()
+    assert rebuilt.branches == smt.branches
+    assert rebuilt.shortcuts == smt.shortcuts
+
+
+def test_delete_all_keys_gives_empty_root():
+    smt = SparseMerkleTree(8)
+    empty = smt.root_hash()
+    for key in range(256):
+        smt.set(key, str(key))
+    for key in random.Random(0).sample(range(256), 256):
+        smt.delete(key)
+    assert smt.root_hash() == empty
+    assert smt.branches == {} and smt.shortcuts == {}
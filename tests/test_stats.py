@@ -0,0 +1,28 @@
+import threading
+
+from MerkleTree import MerkleTree
+
+
+def test_nodes_allocated_counts_only_this_tree():
+    mt = MerkleTree(primeProduct=False)
+    stats = mt.enable_stats()
+    mt.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    built = stats.nodesAllocated
+    assert built == 15
+
+    # 另一棵树（在另一个线程中）创建的节点不计入这棵树
+    other = MerkleTree(primeProduct=False)
+    thread = threading.Thread(target=other.build_merkle_tree, args=([str(i) for i in range(100)], 'imbalance'))
+    thread.start()
+    thread.join()
+    other.add('x')
+    assert stats.nodesAllocated == built
+
+    deltas = []
+    stats.subscribe(lambda name, seconds, delta: deltas.append((name, delta['nodesAllocated'])))
+    primes = stats.primesAllocated
+    mt.add('8')
+    assert stats.nodesAllocated > built
+    # 分配素数由 primesAllocated 计数，不再作为单独的操作计时
+    assert deltas == [('add', stats.nodesAllocated - built)]
+    assert stats.primesAllocated == primes + 1
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import MerkleStream
+from MerkleProof import verify_proof
+from MerkleStream import NODE_SUFFIX, stream_merkle_root, stream_proof
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7, 8, 13, 64, 100])
+def test_stream_proofs_match_folding_from_leaves(tmp_path, count):
+    leafFile = str(tmp_path / 'leaves')
+    root, leafCount = stream_merkle_root([str(i) for i in range(count)], leafFile)
+    assert leafCount == count
+    proofs = [stream_proof(leafFile, index) for index in range(count)]
+    for proof in proofs:
+        assert verify_proof(root, proof)
+
+    # 没有中间节点文件时从叶子重新计算，得到相同的证明
+    os.remove(leafFile + NODE_SUFFIX)
+    for index, proof in enumerate(proofs):
+        folded = stream_proof(leafFile, index)
+        assert folded.path == proof.path and folded.leafHash == proof.leafHash
+
+
+def test_stream_proof_reads_only_a_few_leaves(tmp_path, monkeypatch):
+    leafFile = str(tmp_path / 'leaves')
+    root, count = stream_merkle_root((str(i) for i in range(5000)), leafFile)
+    read = []
+    original = MerkleStream.read_leaf_hashes
+
+    def counting(f, first, count, *args):
+        for leafHash in original(f, first, count, *args):
+            read.append(leafHash)
+            yield leafHash
+    monkeypatch.setattr(MerkleStream, 'read_leaf_hashes', counting)
+
+    for index in (0, 2500, 4095, 4096, 4999):
+        read.clear()
+        assert verify_proof(root, stream_proof(leafFile, index))
+        # 自己和最右边不满的子树中的单个叶子，而不是整个相邻子树
+        assert len(read) <= 2
@@ -0,0 +1,79 @@
+import pytest
+
+from MerkleProof import verify_non_membership, verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+TREES = {'tree': MerkleTree, 'array': ArrayMerkleTree}
+
+
+@pytest.fixture(params=[('tree', 'tree'), ('tree', 'array'), ('array', 'tree'), ('array', 'array')],
+                ids=lambda pair: pair[0] + '-' + pair[1])
+def pair(request):
+    return TREES[request.param[0]], TREES[request.param[1]]
+
+
+def assert_converged(replica, source):
+    assert replica.leaf_count() == source.leaf_count()
+    assert replica.root_hash() == source.root_hash()
+    assert list(replica.diff(source)) == []
+    for prime in source.getTreePrime():
+        assert verify_proof(replica.root_hash(), replica.get_proof(prime))
+
+
+def test_sync_converges(pair):
+    sourceCls, replicaCls = pair
+    source = sourceCls()
+    source.build_merkle_tree([str(i) for i in range(20)], way='imbalance')
+    replica = replicaCls()
+    assert replica.sync(source) == 20
+    assert_converged(replica, source)
+
+    primes = source.getTreePrime()
+    source.update_many({primes[3]: 'three', primes[17]: 'seventeen'})
+    assert list(replica.diff(source)) == [(3, 3), (17, 17)]
+    assert replica.sync(source) == 2
+    assert_converged(replica, source)
+
+    source.add_many(['a', 'b', 'c'])
+    source.remove(primes[9])
+    assert list(replica.diff(source)) == [(9, 9), (20, 22)]
+    assert replica.sync(source) == 4
+    assert_converged(replica, source)
+    assert replica.sync(source) == 0
+
+
+def test_sync_shrinks_longer_replica(pair):
+    sourceCls, replicaCls = pair
+    source = sourceCls()
+    source.build_merkle_tree([str(i) for i in range(30)], way='imbalance')
+    replica = replicaCls()
+    replica.sync(source)
+    for prime in source.getTreePrime()[:20]:
+        source.remove(prime)
+    assert source.leaf_count() < replica.leaf_count()
+    replica.sync(source)
+    assert_converged(replica, source)
+
+
+def test_sync_sorted_tree_with_tombstones(pair):
+    sourceCls, replicaCls = pair
+    source = sourceCls()
+    source.build_merkle_tree([str(key) for key in range(0, 100, 10)], sorted=True)
+    replica = replicaCls()
+    replica.build_merkle_tree(['5'], sorted=True)
+    source.remove(source.leaf_view(source.locate_key(40)).primeNum)
+    source.add('45')
+    replica.sync(source)
+    assert_converged(replica, source)
+    assert replica.locate_key(40) == None and replica.locate_key(45) != None
+    for key in (40, 41, 95):
+        assert verify_non_membership(replica.root_hash(), replica.non_membership_proof(key))
+
+
+def test_sync_rejects_other_hash(pair):
+    sourceCls, replicaCls = pair
+    source = sourceCls(hashName='blake2b')
+    source.build_merkle_tree(['a', 'b'], way='imbalance')
+    with pytest.raises(ValueError):
+        replicaCls().sync(source)
@@ -0,0 +1,56 @@
+import pytest
+
+from MerkleProof import tree_height, verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree, merge_levels
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    return MerkleTree if request.param == 'tree' else ArrayMerkleTree
+
+
+def rebuilt_root(mt):
+    hashes = [mt.leaf_view(index).hash for index in range(mt.leaf_count())]
+    return merge_levels(mt.hasher.name, mt.hasher.compat, hashes, tree_height(len(hashes)))[-1][0]
+
+
+@pytest.mark.parametrize('way', ['filling', 'imbalance'])
+def test_update_many_root_matches_rebuild(new_tree, way):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(11)], way=way)
+    primes = [mt.leaf_view(index).primeNum for index in range(11)]
+    oldRoot = mt.root_hash()
+    generation = mt.history
+
+    mt.update(primes[3], 'three')
+    assert mt.root_hash() == rebuilt_root(mt)
+    mt.update_many({primes[0]: 'zero', primes[1]: 'one', primes[10]: 'ten'})
+    assert mt.root_hash() == rebuilt_root(mt)
+
+    assert [mt.leaf_view(index).value for index in (0, 1, 3, 10)] == ['zero', 'one', 'three', 'ten']
+    for index, prime in enumerate(primes):
+        # 素数和位置不变
+        assert mt.locate_leaf(prime) == index
+        assert verify_proof(mt.root_hash(), mt.get_proof(prime))
+    # 整批修改属于同一代，修改之前的版本不变
+    assert mt.history == generation + 2
+    assert mt.at(generation).root_hash() == oldRoot
+
+
+def test_update_many_hashes_each_dirty_node_once():
+    mt = MerkleTree()
+    mt.build_merkle_tree([str(i) for i in range(1024)], way='imbalance')
+    primes = [mt.leaf_view(index).primeNum for index in range(8)]
+    stats = mt.enable_stats()
+    before = stats.hashCalls
+    mt.update_many({prime: 'new ' + prime for prime in primes})
+    # 8 个叶子，共同的祖先第 1~3 层依次为 4、2、1 个，再往上每层一个
+    assert stats.hashCalls - before == 8 + 4 + 2 + 1 + (mt.tree_height() - 3)
+
+
+def test_update_unknown_prime_changes_nothing(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(4)], way='imbalance')
+    root, generation = mt.root_hash(), mt.history
+    mt.update_many({mt.leaf_view(0).primeNum: 'x', 10**12 + 39: 'y'})
+    assert mt.root_hash() == root and mt.history == generation
@@ -0,0 +1,80 @@
+import pytest
+
+from MerkleProof import verify_proof
+from MerkleTree import MerkleTree, ArrayMerkleTree
+
+
+@pytest.fixture(params=['tree', 'array'])
+def new_tree(request):
+    def new_tree(**kwargs):
+        if request.param == 'tree':
+            return MerkleTree(primeProduct=False, **kwargs)
+        return ArrayMerkleTree(**kwargs)
+    return new_tree
+
+
+def write(mt, count):
+    '''
+    每一代添加或修改一个叶子，返回每一代结束时的 (代数, 树根 hash, 叶子的素数)
+    '''
+    versions = []
+    for i in range(count):
+        if i % 3 == 2:
+            mt.update(mt.leaf_view(i // 2).primeNum, 'u' + str(i))
+        else:
+            mt.add(str(i))
+        primes = [mt.leaf_view(index).primeNum for index in range(mt.leaf_count())]
+        versions.append((mt.history, mt.root_hash(), primes))
+    return versions
+
+
+def test_keep_versions_bounds_history(new_tree):
+    mt = new_tree(keepVersions=4)
+    mt.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    first = mt.at(mt.history)
+    firstPrime = mt.leaf_view(0).primeNum
+    versions = write(mt, 60)
+
+    # 最近 keepVersions 代的版本仍然可以查询，树根和证明都是当时的
+    for generation, rootHash, primes in versions[-4:]:
+        snapshot = mt.at(generation)
+        assert snapshot.root_hash() == rootHash
+        for index, prime in enumerate(primes):
+            proof = snapshot.get_proof(prime)
+            assert proof.leafIndex == index
+            assert verify_proof(rootHash, proof)
+    # 更早的版本最多保留到 2 * keepVersions 代，之后被丢弃
+    with pytest.raises(ValueError):
+        mt.at(versions[-9][0])
+    # 丢弃之前取到的快照不能再使用，不会悄悄地给出错误的证明
+    with pytest.raises(ValueError):
+        first.get_proof(firstPrime)
+    if isinstance(mt, ArrayMerkleTree):
+        assert all(entries[-1][0] >= mt.firstGeneration
+                   for log in (mt.oldHashes, mt.oldIndex) for entries in log.values())
+    else:
+        assert len(mt.versionGenerations) < 8
+
+
+def test_forget(new_tree):
+    mt = new_tree()
+    mt.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    versions = write(mt, 20)
+    generation, rootHash, primes = versions[10]
+    mt.forget(generation)
+    with pytest.raises(ValueError):
+        mt.at(generation - 1)
+    for generation, rootHash, primes in versions[10:]:
+        snapshot = mt.at(generation)
+        assert snapshot.root_hash() == rootHash
+        proof = snapshot.get_proof(primes[-1])
+        assert proof.leafIndex == len(primes) - 1
+        assert verify_proof(rootHash, proof)
+
+
+def test_history_is_unbounded_by_default():
+    mt = MerkleTree(primeProduct=False)
+    mt.build_merkle_tree([str(i) for i in range(8)], way='imbalance')
+    versions = write(mt, 30)
+    generation, rootHash, primes = versions[0]
+    assert mt.at(generation).root_hash() == rootHash